@@ -9,27 +9,63 @@ from django.conf import settings
 import datetime
 import logging
 import traceback
+from multiprocessing.pool import ThreadPool
 
-from alert.alerts.models import FREQUENCY, RealTimeQueue, ITEM_TYPES
+from alert.alerts.matcher import AlertMatcher, SolrAnalyzer, get_new_items
+from alert.alerts.models import Alert, FREQUENCY, RealTimeQueue, ITEM_TYPES
 from alert.lib import search_utils
 from alert.lib import sunburnt
+from alert.lib.db_tools import keyset_chunks
+from alert.lib.sunburnt.sunburnt import grouper
 from alert.search.forms import SearchForm
 from alert.stats import tally_stat
-from alert.userHandling.models import UserProfile
+from alert.lib.mail import get_template, send_messages_in_batches
+from alert.userHandling.models import UserProfile, \
+    get_totals_donated_last_year
 
 from django.core.mail import EmailMultiAlternatives
 from django.core.management import BaseCommand
-from django.template import loader, Context
+from django.db.models import Max
+from django.template import Context
 from django.utils.timezone import now
 from optparse import make_option
 
 logger = logging.getLogger(__name__)
 
 
+# How many alert queries are run at the same time.
+QUERY_WORKERS = 8
+
+# How many items of the RealTimeQueue are looked up in Solr, deleted, or
+# searched by an alert at a time. Solr can't take more than 1024 clauses in a
+# query.
+RT_CHUNK_SIZE = 500
+
+
 class InvalidDateError(Exception):
     pass
 
 
+def canonicalize_params(params):
+    """Make a hashable version of the params of a query, which is the same
+    for any two queries that would get the same results.
+
+    The caller param is only for the logs, so it's left out.
+    """
+    if params is None:
+        return None
+    canonical = []
+    for k, v in params.items():
+        if k == 'caller':
+            continue
+        if isinstance(v, (list, tuple)):
+            v = tuple(sorted(unicode(item) for item in v))
+        else:
+            v = unicode(v)
+        canonical.append((k, v))
+    return tuple(sorted(canonical))
+
+
 def get_cut_off_date(rate, d=datetime.date.today()):
     """Given a rate of dly, wly or mly and a date, returns the date after which
     new results should be considered a hit for an alert.
@@ -56,20 +92,19 @@ def get_cut_off_date(rate, d=datetime.date.today()):
     return cut_off_date
 
 
-def send_alert(user_profile, hits, simulate):
+def make_alert_email(user_profile, hits):
     email_subject = 'New hits for your CourtListener alerts'
     email_sender = 'CourtListener Alerts <alerts@courtlistener.com>'
 
-    txt_template = loader.get_template('alerts/email.txt')
-    html_template = loader.get_template('alerts/email.html')
+    txt_template = get_template('alerts/email.txt')
+    html_template = get_template('alerts/email.html')
     c = Context({'hits': hits})
     txt = txt_template.render(c)
     html = html_template.render(c)
     msg = EmailMultiAlternatives(email_subject, txt, email_sender,
                                  [user_profile.user.email])
     msg.attach_alternative(html, "text/html")
-    if not simulate:
-        msg.send(fail_silently=False)
+    return msg
 
 
 class Command(BaseCommand):
@@ -86,98 +121,248 @@ class Command(BaseCommand):
             help='Simulate the emails that would be sent using the console '
                  'backend.',
         ),
+        make_option(
+            '--workers',
+            type='int',
+            default=QUERY_WORKERS,
+            help='The number of alert queries to run at the same time '
+                 '(default %s).' % QUERY_WORKERS,
+        ),
     )
     help = 'Sends the alert emails on a daily, weekly or monthly basis.'
     args = ('--rate (dly|wly|mly) [--simulate] [--date YYYY-MM-DD] '
-            '[--user USER]')
+            '[--user USER] [--workers N]')
+
+    def get_connection(self, type):
+        """Get the Solr interface for a type of item. Interfaces are kept per
+        thread, so this is safe to call from the pool.
+        """
+        return sunburnt.get_solr_interface(self.solr_urls[type], mode='r')
+
+    def parse_query(self, query):
+        """Turn the GET string of an alert into the cleaned data of its search
+        form, with the cut off date of the rate added.
+
+        Returns None if the query is invalid.
+        """
+        logger.info("Now parsing the query: %s\n" % query)
 
-    def run_query(self, alert):
-        results = []
-        error = False
+        # Set up the data
+        data = search_utils.get_string_to_dict(query)
         try:
-            logger.info("Now running the query: %s\n" % alert.query)
+            del data['filed_before']
+        except KeyError:
+            pass
+        data['order_by'] = 'score desc'
+        logger.info("  Data sent to SearchForm is: %s\n" % data)
+        search_form = SearchForm(data)
+        if not search_form.is_valid():
+            logger.info("  Query for alert %s was invalid\n"
+                        "  Errors from the SearchForm: %s\n" %
+                        (query, search_form.errors))
+            return None
+        cd = search_form.cleaned_data
+
+        cut_off_date = get_cut_off_date(self.rate)
+        if cd['type'] == 'o':
+            cd['filed_after'] = cut_off_date
+        elif cd['type'] == 'oa':
+            cd['argued_after'] = cut_off_date
+        return cd
+
+    def make_query(self, cd, ids=None):
+        """Make the type of item, the params of the Solr query and the ids it
+        is limited to for the cleaned data of an alert. Only real time alerts
+        are limited to ids, see run_query; the rest get ids of None.
+
+        Returns params of None if the query can't have any results.
+        """
+        if self.rate == 'rt' and not ids:
+            # Bail out. No results will be found if no valid_ids.
+            return cd['type'], None, None
+
+        main_params = search_utils.build_main_query(cd)
+        main_params.update({
+            'rows': '20',
+            'start': '0',
+            'hl.tag.pre': '<em><strong>',
+            'hl.tag.post': '</strong></em>',
+            'caller': 'cl_send_alerts',
+        })
+        if self.rate == 'rt':
+            return cd['type'], main_params, tuple(sorted(ids))
+        return cd['type'], main_params, None
 
-            # Set up the data
-            data = search_utils.get_string_to_dict(alert.query)
-            try:
-                del data['filed_before']
-            except KeyError:
-                pass
-            data['order_by'] = 'score desc'
-            logger.info("  Data sent to SearchForm is: %s\n" % data)
-            search_form = SearchForm(data)
-            if search_form.is_valid():
-                cd = search_form.cleaned_data
-
-                if self.rate == 'rt' and len(self.valid_ids[cd['type']]) == 0:
-                    # Bail out. No results will be found if no valid_ids.
-                    return error, cd['type'], results
-
-                cut_off_date = get_cut_off_date(self.rate)
-                if cd['type'] == 'o':
-                    cd['filed_after'] = cut_off_date
-                elif cd['type'] == 'oa':
-                    cd['argued_after'] = cut_off_date
-                main_params = search_utils.build_main_query(cd)
-                main_params.update({
-                    'rows': '20',
-                    'start': '0',
-                    'hl.tag.pre': '<em><strong>',
-                    'hl.tag.post': '</strong></em>',
-                    'caller': 'cl_send_alerts',
-                })
-                if self.rate == 'rt':
-                    main_params['fq'].append(
-                        'id:(%s)' % ' OR '.join(
-                            [str(i) for i in self.valid_ids[cd['type']]]
-                        ),
-                    )
-                results = self.connections[
-                    cd['type']
-                ].raw_query(
-                    **main_params
-                ).execute()
+    def match_new_items(self, parsed):
+        """Work out which of the new items each real time alert could match,
+        without asking Solr, see alerts.matcher.
+
+        Takes a dict of {query: cd}, and returns one of {query: ids}. Queries
+        that can't match any of the new items are left out.
+        """
+        candidates = {}
+        for type, items in self.new_items.iteritems():
+            queries = [(query, cd) for query, cd in parsed.iteritems()
+                       if cd is not None and cd['type'] == type]
+            if items is None:
+                # The new items couldn't be fetched, so every query has to be
+                # tried against all of them.
+                for query, cd in queries:
+                    candidates[query] = self.valid_ids[type]
+                continue
+            matcher = AlertMatcher(self.analyzers[type])
+            for query, cd in queries:
+                matcher.add(query, cd)
+            matches = matcher.match(items)
+            logger.info("%s of %s queries could match the %s new items of "
+                        "type %s.\n" %
+                        (len(matches), len(queries), len(items), type))
+            candidates.update(matches)
+        return candidates
+
+    def plan_queries(self, alerts):
+        """Work out the queries that have to be run for alerts.
+
+        Lots of users have alerts for the same thing, and those are run once.
+        Alerts with the same GET string are only parsed once, and queries are
+        the same when their params are, whatever order they were in. Real time
+        alerts are first matched against the new items locally, and only run
+        for the items they could match.
+
+        Returns a dict of the unique queries, {key: (type, params, ids)}, and
+        a dict of which query each alert needs, {alert.pk: key}. Alerts whose
+        queries are invalid are left out of the latter.
+        """
+        parsed = {}
+        for alert in alerts:
+            if alert.query not in parsed:
+                try:
+                    parsed[alert.query] = self.parse_query(alert.query)
+                except:
+                    traceback.print_exc()
+                    logger.info("  Search for this alert failed: %s\n" %
+                                alert.query)
+                    parsed[alert.query] = None
+
+        if self.rate == 'rt':
+            candidates = self.match_new_items(parsed)
+
+        made = {}
+        for query, cd in parsed.iteritems():
+            if cd is None:
+                continue
+            if self.rate == 'rt':
+                made[query] = self.make_query(cd, candidates.get(query))
             else:
-                logger.info("  Query for alert %s was invalid\n"
-                            "  Errors from the SearchForm: %s\n" %
-                            (alert.query, search_form.errors))
-                error = True
+                made[query] = self.make_query(cd)
+
+        queries = {}
+        alert_queries = {}
+        for alert in alerts:
+            if alert.query not in made:
+                continue
+            type, params, ids = made[alert.query]
+            key = (type, canonicalize_params(params), ids)
+            queries[key] = made[alert.query]
+            alert_queries[alert.pk] = key
+        logger.info("Planned %s unique queries for %s alerts.\n" %
+                    (len(queries), len(alerts)))
+        return queries, alert_queries
+
+    def run_query(self, query):
+        """Run one of the planned queries, returning its key and its results,
+        or None if it failed.
+        """
+        key, (type, params, ids) = query
+        if params is None:
+            return key, []
+        conn = self.get_connection(type)
+        try:
+            if ids is None:
+                results = conn.raw_query(**params).execute()
+            else:
+                results = self.run_query_for_ids(conn, params, ids)
         except:
             traceback.print_exc()
-            logger.info("  Search for this alert failed: %s\n" %
-                        alert.query)
-            error = True
-
-        logger.info("  There were %s results\n" % len(results))
-
-        return error, cd['type'], results
+            logger.info("  Search failed with params: %s\n" % params)
+            return key, None
+        logger.info("  There were %s results for: %s\n" %
+                    (len(results), params.get('q')))
+        return key, results
+
+    @staticmethod
+    def run_query_for_ids(conn, params, ids):
+        """Run a query for the items with ids, RT_CHUNK_SIZE of them at a
+        time, so that no query has more clauses than Solr allows, however many
+        items are new. Returns the best hits of all the chunks, as a list.
+        """
+        chunks = list(grouper(ids, RT_CHUNK_SIZE))
+        if len(chunks) > 1:
+            # To put the hits of the chunks in order.
+            params = dict(params, fl=params.get('fl', '*') + ',score')
+        hits = []
+        for chunk in chunks:
+            chunk_params = dict(params)
+            chunk_params['fq'] = list(params.get('fq', [])) + [
+                'id:(%s)' % ' OR '.join([str(i) for i in chunk])]
+            hits.extend(conn.raw_query(**chunk_params).execute())
+        if len(chunks) > 1:
+            hits.sort(key=lambda hit: hit.get('score', 0), reverse=True)
+        return hits[:int(params['rows'])]
+
+    def run_queries(self, queries):
+        """Run the planned queries on a pool of threads, returning a dict of
+        {key: results}.
+        """
+        pool = ThreadPool(self.workers)
+        try:
+            return dict(pool.imap_unordered(self.run_query, queries.items()))
+        finally:
+            pool.close()
+            pool.join()
 
     def send_emails(self):
         """Send out an email to every user whose alert has a new hit for a
         rate.
+
+        Every user's alerts are gathered first, so that the queries they have
+        in common are run once, and all at the same time. The results are then
+        handed back out to the users.
         """
         ups = UserProfile.objects.filter(
             alert__rate=self.rate,
-        ).distinct()
+        ).distinct().select_related('user').prefetch_related('alert')
 
-        alerts_sent_count = 0
+        if self.rate == 'rt':
+            totals_donated = get_totals_donated_last_year(ups)
+
+        user_alerts = []
         for up in ups:
-            not_donated_enough = up.total_donated_last_year < \
-                settings.MIN_DONATION['rt_alerts']
-            if not_donated_enough and self.rate == 'rt':
+            alerts = [a for a in up.alert.all() if a.rate == self.rate]
+            if self.rate == 'rt' and totals_donated[up.pk] < \
+                    settings.MIN_DONATION['rt_alerts']:
                 logger.info('\n\nUser: %s has not donated enough for their %s RT '
                             'alerts to be sent.\n' % (up.user, len(alerts)))
                 continue
+            user_alerts.append((up, alerts))
 
-            alerts = up.alert.filter(rate=self.rate)
+        queries, alert_queries = self.plan_queries(
+            [alert for up, alerts in user_alerts for alert in alerts])
+        query_results = self.run_queries(queries)
+
+        alerts_sent_count = 0
+        hit_alert_pks = []
+        messages = []
+        for up, alerts in user_alerts:
             logger.info("\n\nAlerts for user '%s': %s\n"
                         "%s\n" % (up.user, alerts, '*' * 40))
 
             hits = []
             for alert in alerts:
-                error, type, results = self.run_query(alert)
-                if error:
+                key = alert_queries.get(alert.pk)
+                if key is None or query_results.get(key) is None:
                     continue
+                type, results = key[0], query_results[key]
 
                 # hits is a multi-dimensional array. It consists of alerts,
                 # paired with a list of document dicts, of the form:
@@ -185,8 +370,7 @@ class Command(BaseCommand):
                 try:
                     if len(results) > 0:
                         hits.append([alert, type, results])
-                        alert.date_last_hit = now()
-                        alert.save()
+                        hit_alert_pks.append(alert.pk)
                     elif len(results) == 0 and alert.always_send_email:
                         hits.append([alert, type, None])
                         logger.info("  Sending results for negative alert "
@@ -198,10 +382,15 @@ class Command(BaseCommand):
 
             if len(hits) > 0:
                 alerts_sent_count += 1
-                send_alert(up, hits, self.options['simulate'])
+                messages.append(make_alert_email(up, hits))
             elif self.verbosity >= 1:
                 logger.info("  No hits. Not sending mail for this alert.\n")
 
+        Alert.objects.filter(pk__in=hit_alert_pks).update(date_last_hit=now())
+
+        if not self.options['simulate']:
+            send_messages_in_batches(messages)
+
         if not self.options['simulate']:
             tally_stat('alerts.sent.%s' % self.rate, inc=alerts_sent_count)
             logger.info("Sent %s %s email alerts." %
@@ -210,46 +399,88 @@ class Command(BaseCommand):
     def clean_rt_queue(self):
         """Clean out any items in the RealTime queue once they've been run or
         if they are stale.
+
+        Only rows up to the high water mark are touched, so items queued while
+        the alerts ran are left for the next run. Rows are deleted in chunks,
+        so no single statement gets too big.
         """
         if self.rate == 'rt' and not self.options['simulate']:
-            for type, ids in self.valid_ids.iteritems():
-                RealTimeQueue.objects.filter(
-                    item_type=type,
-                    item_pk__in=ids,
-                ).delete()
+            for chunk in grouper(self.resolved_queue_pks, RT_CHUNK_SIZE):
+                RealTimeQueue.objects.filter(pk__in=chunk).delete()
 
-            RealTimeQueue.objects.filter(
+            stale = RealTimeQueue.objects.filter(
+                pk__lte=self.rt_high_water_mark,
                 date_modified__lt=now() - datetime.timedelta(days=7),
-            ).delete()
+            )
+            for chunk in keyset_chunks(stale, chunksize=RT_CHUNK_SIZE,
+                                       fields=('pk',), flat=True):
+                RealTimeQueue.objects.filter(pk__in=chunk).delete()
 
     def get_new_ids(self):
         """For every item that's in the RealTimeQueue, query Solr and
         see which have made it to the index. We'll use these to run the alerts.
 
+        The queue is read up to its high water mark at the start of the run,
+        RT_CHUNK_SIZE rows at a time, and each chunk's items are looked up in
+        Solr with a query of their own, so however big a burst of items is,
+        none are dropped and no query is bigger than a chunk. The queue rows
+        whose items were found are kept for clean_rt_queue.
+
         Returns a dict like so:
             {
                 'oa': [list, of, ids],
                 'o': [list, of, ids],
             }
         """
-        valid_ids = {}
-        for type in [t[0] for t in ITEM_TYPES]:
-            ids = RealTimeQueue.objects.filter(item_type=type)
-            if ids:
+        self.rt_high_water_mark = RealTimeQueue.objects.aggregate(
+            Max('pk'))['pk__max'] or 0
+        self.resolved_queue_pks = []
+        valid_ids = dict((t[0], set()) for t in ITEM_TYPES)
+        queue = RealTimeQueue.objects.filter(pk__lte=self.rt_high_water_mark)
+        for chunk in keyset_chunks(queue, chunksize=RT_CHUNK_SIZE,
+                                   fields=('pk', 'item_type', 'item_pk')):
+            queue_pks = {}
+            for pk, type, item_pk in chunk:
+                queue_pks.setdefault(type, {}).setdefault(item_pk, []).append(pk)
+            for type, item_pks in queue_pks.iteritems():
                 main_params = {
                     'q': '*:*',  # Vital!
                     'caller': 'cl_send_alerts',
-                    'rows': 1000,
+                    'rows': len(item_pks),
                     'fl': 'id',
                     'fq': ['id:(%s)' % ' OR '.join(
-                        [str(i.item_pk) for i in ids]
+                        [str(i) for i in item_pks]
                     )],
                 }
-                results = self.connections[type].raw_query(**main_params).execute()
-                valid_ids[type] = [int(r['id']) for r in results.result.docs]
-            else:
-                valid_ids[type] = []
-        return valid_ids
+                results = self.get_connection(type).raw_query(**main_params).execute()
+                for r in results.result.docs:
+                    valid_ids[type].add(int(r['id']))
+                    self.resolved_queue_pks.extend(item_pks[int(r['id'])])
+        return dict((type, sorted(ids)) for type, ids in valid_ids.iteritems())
+
+    def get_new_items(self):
+        """Get the new items, with the terms they were indexed with, for the
+        alerts to be matched against.
+
+        Returns a dict like get_new_ids, but of lists of NewItems, or of None
+        for the types whose items couldn't be fetched.
+        """
+        new_items = {}
+        for type, ids in self.valid_ids.iteritems():
+            if not ids:
+                new_items[type] = []
+                continue
+            try:
+                new_items[type] = []
+                for chunk in grouper(ids, RT_CHUNK_SIZE):
+                    new_items[type].extend(get_new_items(
+                        self.solr_urls[type], chunk, self.analyzers[type]))
+            except:
+                traceback.print_exc()
+                logger.info("  Unable to get the new items of type %s for "
+                            "matching.\n" % type)
+                new_items[type] = None
+        return new_items
 
     def handle(self, *args, **options):
         self.verbosity = int(options.get('verbosity', 1))
@@ -263,13 +494,17 @@ class Command(BaseCommand):
                               ', '.join(dict(FREQUENCY).keys()))
             exit(1)
 
-        self.connections = {
-            'o': sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r'),
-            'oa': sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='r'),
+        self.workers = options.get('workers') or QUERY_WORKERS
+        self.solr_urls = {
+            'o': settings.SOLR_OPINION_URL,
+            'oa': settings.SOLR_AUDIO_URL,
         }
 
         if self.rate == 'rt':
             self.valid_ids = self.get_new_ids()
+            self.analyzers = dict((type, SolrAnalyzer(url)) for type, url in
+                                  self.solr_urls.iteritems())
+            self.new_items = self.get_new_items()
 
         if self.options['simulate']:
             logger.info("******************************************\n"
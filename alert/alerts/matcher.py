@@ -0,0 +1,348 @@
+"""Matching real time alerts against new items without asking Solr.
+
+Real time alerts only look for the handful of items that were indexed since
+the last run, yet running them means a Solr query per alert. Instead, the
+alerts are compiled into an index in memory, and each new item is run through
+it to find the alerts it could match. Only those are then run against Solr,
+with the items they could match, to verify them and highlight the hits.
+
+The matcher must never leave out an alert that Solr would match, so anything
+it can't be sure about is treated as matching: queries it can't parse, terms
+with synonyms, and so on. The words of queries are analyzed by Solr, and the
+words of items come from their term vectors, so stemming and splitting are
+the same as when searching.
+"""
+import hashlib
+import re
+from datetime import datetime
+
+import requests
+from django.core.cache import cache
+
+# The field type of the text fields, which analyzes queries for the matcher.
+ANALYSIS_FIELD_TYPE = 'text_en_splitting_cl'
+ANALYSIS_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# The fields searched by the main query that have term vectors.
+TERM_VECTOR_FIELDS = ('text', 'caseName', 'judge', 'docketNumber', 'citation',
+                      'neutralCite', 'lexisCite', 'westCite', 'caseNumber')
+# The fields searched by the main query that don't. Their stored values are
+# analyzed instead.
+ANALYZED_FIELDS = ('court', 'status')
+# The stored fields the filters need.
+ITEM_FIELDS = ('id', 'court_exact', 'status_exact', 'dateFiled', 'dateArgued',
+               'citeCount') + ANALYZED_FIELDS
+
+# The fields of the search form that filter on a text field, and that field.
+FIELD_FILTERS = {
+    'o': (('case_name', 'caseName'), ('judge', 'judge'),
+          ('docket_number', 'docketNumber'), ('citation', 'citation'),
+          ('neutral_cite', 'neutralCite')),
+    'oa': (('case_name', 'caseName'), ('judge', 'judge'),
+           ('docket_number', 'docketNumber')),
+}
+
+QUERY_PART_RE = re.compile(r'"[^"]*"|[^\s"]+')
+# Syntax the matcher doesn't try to understand.
+SPECIAL_CHARS_RE = re.compile(r'[(){}\[\]^~*?:\\/"]|&&|\|\||^[-+!]')
+OPERATORS = ('or', 'not')
+
+
+class QueryNotUnderstood(Exception):
+    pass
+
+
+class SolrAnalyzer(object):
+    """Analyze text the way a Solr core does, using its field analysis
+    handler. Results are cached, since alerts hardly change.
+    """
+    def __init__(self, url, field_type=ANALYSIS_FIELD_TYPE):
+        self.url = url.rstrip('/') + '/'
+        self.field_type = field_type
+
+    def get_tokens(self, value, phase):
+        """Get the tokens Solr makes of value when it's in a query or the
+        index, depending on phase, as a list of dicts with the text, type and
+        position of each.
+        """
+        key = 'solr-analysis-%s' % hashlib.md5(repr((
+            self.url, self.field_type, phase, value))).hexdigest()
+        tokens = cache.get(key)
+        if tokens is None:
+            params = {
+                'analysis.fieldtype': self.field_type,
+                'analysis.fieldvalue': value,
+                'wt': 'json',
+                'json.nl': 'flat',
+            }
+            if phase == 'query':
+                params['analysis.query'] = value
+            r = requests.get(self.url + 'analysis/field', params=params)
+            r.raise_for_status()
+            stages = r.json()['analysis']['field_types'][self.field_type]
+            stages = stages.get(phase, [])
+            # The stages are a list of each analyzer and what it made; the
+            # last is what ends up in the index or query.
+            tokens = [{'text': t['text'], 'type': t.get('type'),
+                       'position': t.get('position')}
+                      for t in (stages[-1] if stages else [])]
+            cache.set(key, tokens, ANALYSIS_CACHE_TIMEOUT)
+        return tokens
+
+    def analyze_query(self, value):
+        """Get the terms Solr requires for value in a query, or None if there
+        are alternatives, like synonyms, so there's no telling.
+        """
+        try:
+            tokens = self.get_tokens(value, 'query')
+        except (requests.RequestException, ValueError, KeyError):
+            return None
+        positions = [t['position'] for t in tokens]
+        if any(t['type'] == 'SYNONYM' for t in tokens) or \
+                len(set(positions)) != len(positions):
+            return None
+        return set(t['text'] for t in tokens)
+
+    def analyze_value(self, value):
+        """Get the terms Solr indexes for value."""
+        return set(t['text'] for t in self.get_tokens(value, 'index'))
+
+
+def split_query(q):
+    """Split a query into its words and phrases. Raises QueryNotUnderstood if
+    it has syntax that can't be matched locally.
+    """
+    parts = []
+    for part in QUERY_PART_RE.findall(q):
+        if part.startswith('"'):
+            phrase = part.strip('"')
+            if phrase:
+                parts.append(phrase)
+            continue
+        if part.lower() == 'and':
+            # The default anyway.
+            continue
+        if part.lower() in OPERATORS or SPECIAL_CHARS_RE.search(part):
+            raise QueryNotUnderstood(part)
+        parts.append(part)
+    return parts
+
+
+def to_date(value):
+    if value is None:
+        return None
+    if isinstance(value, basestring):
+        return datetime.strptime(value[:10], '%Y-%m-%d').date()
+    if isinstance(value, datetime):
+        return value.date()
+    return value
+
+
+class NewItem(object):
+    """An item that was just indexed, with its stored fields and the terms
+    it was indexed with.
+    """
+    def __init__(self, fields, terms):
+        self.id = int(fields['id'])
+        self.fields = fields
+        # {field: set(terms)}
+        self.terms = terms
+        self.all_terms = set()
+        for field_terms in terms.values():
+            self.all_terms.update(field_terms)
+
+
+class AlertQuery(object):
+    """The parts of an alert's query that can be checked against an item.
+
+    Made from the cleaned data of the search form, after the cut off date of
+    the rate has been added, mirroring search_utils.build_main_query.
+    """
+    def __init__(self, cd, analyzer):
+        self.type = cd['type']
+        self.courts = None
+        self.statuses = None
+        selected_courts = set(k[len('court_'):] for k, v in cd.iteritems()
+                              if k.startswith('court_') and v is True)
+        if self.type == 'o':
+            selected_stats = set(k[len('stat_'):] for k, v in cd.iteritems()
+                                 if k.startswith('stat_') and v is True)
+            if selected_courts or selected_stats:
+                self.courts = selected_courts
+                self.statuses = selected_stats
+            self.date_field = 'dateFiled'
+            self.after = to_date(cd.get('filed_after'))
+            self.before = to_date(cd.get('filed_before'))
+            self.cite_range = None
+            if cd.get('cited_gt') is not None and \
+                    cd.get('cited_lt') is not None and \
+                    (cd['cited_gt'] or cd['cited_lt']):
+                self.cite_range = (cd['cited_gt'], cd['cited_lt'])
+        else:
+            if selected_courts:
+                self.courts = selected_courts
+            self.date_field = 'dateArgued'
+            self.after = to_date(cd.get('argued_after'))
+            self.before = to_date(cd.get('argued_before'))
+            self.cite_range = None
+
+        # The terms of the main query, which can be in any field, and of the
+        # field filters, which have to be in theirs.
+        self.terms = self.get_terms(cd['q'], analyzer)
+        self.field_terms = {}
+        for key, field in FIELD_FILTERS[self.type]:
+            if cd.get(key):
+                if '"' in cd[key]:
+                    continue
+                terms = self.get_terms(cd[key], analyzer)
+                if terms:
+                    self.field_terms[field] = terms
+
+    @staticmethod
+    def get_terms(q, analyzer):
+        """Get the terms an item must have to match q, or an empty set if
+        there's no telling.
+        """
+        terms = set()
+        if not q or q == '*:*':
+            return terms
+        try:
+            parts = split_query(q)
+        except QueryNotUnderstood:
+            return set()
+        for part in parts:
+            part_terms = analyzer.analyze_query(part)
+            if part_terms is None:
+                continue
+            # Numbers can match dates, which aren't in the term vectors.
+            terms.update(t for t in part_terms if not t.isdigit())
+        return terms
+
+    def get_anchor(self):
+        """Get one of the terms the query needs, to index it by. Longer terms
+        are rarer, so fewer items bring the query up for checking.
+        """
+        terms = set(self.terms)
+        for field_terms in self.field_terms.values():
+            terms.update(field_terms)
+        if terms:
+            return max(terms, key=lambda t: (len(t), t))
+        return None
+
+    def matches(self, item):
+        fields = item.fields
+        if self.courts is not None and \
+                fields.get('court_exact') not in self.courts:
+            return False
+        if self.statuses is not None and \
+                fields.get('status_exact') not in self.statuses:
+            return False
+        if self.after or self.before:
+            item_date = to_date(fields.get(self.date_field))
+            if item_date is None:
+                return False
+            if self.after and item_date < self.after:
+                return False
+            if self.before and item_date > self.before:
+                return False
+        if self.cite_range is not None:
+            cite_count = fields.get('citeCount') or 0
+            if not self.cite_range[0] <= cite_count <= self.cite_range[1]:
+                return False
+        if not self.terms <= item.all_terms:
+            return False
+        for field, terms in self.field_terms.iteritems():
+            if not terms <= item.terms.get(field, set()):
+                return False
+        return True
+
+
+class AlertMatcher(object):
+    """An index of alert queries, which new items are matched against.
+
+    Queries that need terms are indexed by one of them, and the rest by the
+    court they're limited to, if any. An item is only checked against the
+    queries it brings up through its terms and its court.
+    """
+    def __init__(self, analyzer):
+        self.analyzer = analyzer
+        self.queries = {}
+        self.by_anchor = {}
+        self.by_court = {}
+        self.unindexed = []
+
+    def add(self, key, cd):
+        """Add the query of an alert, as the cleaned data of its search form,
+        under key.
+        """
+        query = AlertQuery(cd, self.analyzer)
+        self.queries[key] = query
+        anchor = query.get_anchor()
+        if anchor is not None:
+            self.by_anchor.setdefault(anchor, []).append(key)
+        elif query.courts is not None:
+            for court in query.courts:
+                self.by_court.setdefault(court, []).append(key)
+        else:
+            self.unindexed.append(key)
+
+    def match_item(self, item):
+        """Get the keys of the queries an item could match."""
+        candidates = set(self.unindexed)
+        candidates.update(self.by_court.get(item.fields.get('court_exact'), []))
+        if len(item.all_terms) < len(self.by_anchor):
+            for term in item.all_terms:
+                candidates.update(self.by_anchor.get(term, []))
+        else:
+            for anchor, keys in self.by_anchor.iteritems():
+                if anchor in item.all_terms:
+                    candidates.update(keys)
+        return set(key for key in candidates
+                   if self.queries[key].matches(item))
+
+    def match(self, items):
+        """Get the ids of the items each query could match, as a dict of
+        {key: set(ids)}. Queries that can't match any are left out.
+        """
+        matches = {}
+        for item in items:
+            for key in self.match_item(item):
+                matches.setdefault(key, set()).add(item.id)
+        return matches
+
+
+def get_new_items(url, ids, analyzer):
+    """Get the items with ids from the Solr core at url, along with the terms
+    they were indexed with.
+    """
+    params = {
+        'q': '*:*',
+        'fq': 'id:(%s)' % ' OR '.join(str(i) for i in ids),
+        'fl': ','.join(ITEM_FIELDS),
+        'rows': len(ids),
+        'tv.fl': ','.join(TERM_VECTOR_FIELDS),
+        'tv.tf': 'false',
+        'tv.df': 'false',
+        'tv.positions': 'false',
+        'tv.offsets': 'false',
+        'wt': 'json',
+        'json.nl': 'map',
+        'caller': 'cl_send_alerts',
+    }
+    r = requests.post(url.rstrip('/') + '/tvrh', data=params)
+    r.raise_for_status()
+    response = r.json()
+    term_vectors = {}
+    for value in response.get('termVectors', {}).values():
+        if isinstance(value, dict) and 'uniqueKey' in value:
+            term_vectors[unicode(value['uniqueKey'])] = dict(
+                (field, set(value.get(field) or {}))
+                for field in TERM_VECTOR_FIELDS)
+    items = []
+    for doc in response['response']['docs']:
+        terms = term_vectors.get(unicode(doc['id']), {})
+        for field in ANALYZED_FIELDS:
+            if doc.get(field):
+                terms[field] = analyzer.analyze_value(doc[field])
+        items.append(NewItem(doc, terms))
+    return items
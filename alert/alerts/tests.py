@@ -0,0 +1,283 @@
+import datetime
+import re
+
+import requests
+from django.core.cache import cache
+from django.test import TestCase
+
+from alert.alerts.management.commands.cl_send_alerts import Command, \
+    RT_CHUNK_SIZE
+from alert.alerts.matcher import AlertMatcher, NewItem, SolrAnalyzer, \
+    get_new_items
+from alert.alerts.models import Alert
+from alert.lib.test_helpers import FakeSolr
+
+
+class SplittingAnalyzer(object):
+    """Stands in for Solr's analysis, lower casing and splitting on anything
+    that's not a letter or a number."""
+    synonyms = ('tv',)
+
+    def analyze_query(self, value):
+        terms = set(re.findall(r'[a-z0-9]+', value.lower()))
+        if terms & set(self.synonyms):
+            return None
+        return terms
+
+    def analyze_value(self, value):
+        return set(re.findall(r'[a-z0-9]+', value.lower()))
+
+
+class AlertMatcherTest(TestCase):
+    def setUp(self):
+        self.analyzer = SplittingAnalyzer()
+        self.items = [
+            NewItem({'id': '1', 'court_exact': 'scotus',
+                     'status_exact': 'Precedential',
+                     'dateFiled': '2014-06-02T00:00:00Z', 'citeCount': 0},
+                    {'text': set(['copyright', 'fair', 'use', 'tv']),
+                     'caseName': set(['american', 'broadcasting', 'aereo'])}),
+            NewItem({'id': '2', 'court_exact': 'ca9',
+                     'status_exact': 'Non-Precedential',
+                     'dateFiled': '2014-06-01T00:00:00Z', 'citeCount': 0},
+                    {'text': set(['patent', 'infringement']),
+                     'caseName': set(['smith', 'jones'])}),
+        ]
+
+    def match(self, cd):
+        base_cd = {
+            'q': '',
+            'type': 'o',
+            'case_name': '',
+            'judge': '',
+            'filed_after': None,
+            'filed_before': None,
+        }
+        base_cd.update(cd)
+        matcher = AlertMatcher(self.analyzer)
+        matcher.add('alert', base_cd)
+        return matcher.match(self.items).get('alert', set())
+
+    def test_terms(self):
+        self.assertEqual(self.match({'q': 'copyright "fair use"'}), set([1]))
+        self.assertEqual(self.match({'q': 'copyright AND patent'}), set())
+        self.assertEqual(self.match({'case_name': 'jones'}), set([2]))
+        # The first item has copyright in its text, but not its case name.
+        self.assertEqual(self.match({'case_name': 'copyright'}), set())
+
+    def test_filters(self):
+        self.assertEqual(self.match({'court_ca9': True,
+                                     'stat_Non-Precedential': True}),
+                         set([2]))
+        self.assertEqual(self.match({'filed_after': datetime.date(2014, 6, 2)}),
+                         set([1]))
+
+    def test_unsure_queries_match(self):
+        """Are queries that can't be matched locally left for Solr?"""
+        self.assertEqual(self.match({'q': 'copyright OR patent'}),
+                         set([1, 2]))
+        self.assertEqual(self.match({'q': 'caseName:smith'}), set([1, 2]))
+        # Terms with synonyms are left out.
+        self.assertEqual(self.match({'q': 'patent tv'}), set([2]))
+
+
+class FakeHttpResponse(object):
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+def analysis_response(tokens, phase='query'):
+    """Make a response of Solr's field analysis handler, whose last stage
+    made tokens, a list of (text, type, position) tuples.
+    """
+    return FakeHttpResponse({'analysis': {'field_types': {
+        'text_en_splitting_cl': {phase: [
+            'org.apache.lucene.analysis.standard.StandardTokenizer',
+            [],
+            'org.apache.lucene.analysis.core.LowerCaseFilter',
+            [{'text': text, 'type': type, 'position': position}
+             for text, type, position in tokens],
+        ]},
+    }}})
+
+
+class SolrAnalyzerTest(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.requests_get = requests.get
+        self.requests = []
+        self.response = None
+
+        def get(url, params=None):
+            self.requests.append((url, params))
+            if isinstance(self.response, Exception):
+                raise self.response
+            return self.response
+        requests.get = get
+        self.analyzer = SolrAnalyzer('http://solr/collection1')
+
+    def tearDown(self):
+        requests.get = self.requests_get
+
+    def test_query_terms(self):
+        """Are the terms of the last stage used, and only asked for once?"""
+        self.response = analysis_response([('fair', '<ALPHANUM>', 1),
+                                           ('use', '<ALPHANUM>', 2)])
+        self.assertEqual(self.analyzer.analyze_query(u'Fair Use'),
+                         set(['fair', 'use']))
+        self.assertEqual(self.analyzer.analyze_query(u'Fair Use'),
+                         set(['fair', 'use']))
+        self.assertEqual(len(self.requests), 1)
+        url, params = self.requests[0]
+        self.assertEqual(url, 'http://solr/collection1/analysis/field')
+        self.assertEqual(params['analysis.query'], u'Fair Use')
+
+    def test_alternatives_are_unsure(self):
+        """Are synonyms, and terms sharing a position, left for Solr?"""
+        self.response = analysis_response([('tv', 'SYNONYM', 1)])
+        self.assertIsNone(self.analyzer.analyze_query(u'tv'))
+        self.response = analysis_response([('wi', '<ALPHANUM>', 1),
+                                           ('wifi', '<ALPHANUM>', 1)])
+        self.assertIsNone(self.analyzer.analyze_query(u'wi-fi'))
+
+    def test_errors_are_unsure(self):
+        self.response = requests.ConnectionError()
+        self.assertIsNone(self.analyzer.analyze_query(u'copyright'))
+
+    def test_index_terms(self):
+        self.response = analysis_response(
+            [('supreme', '<ALPHANUM>', 1), ('court', '<ALPHANUM>', 2)],
+            phase='index')
+        self.assertEqual(self.analyzer.analyze_value(u'Supreme Court'),
+                         set(['supreme', 'court']))
+
+
+class GetNewItemsTest(TestCase):
+    def setUp(self):
+        self.requests_post = requests.post
+        self.requests = []
+
+        def post(url, data=None):
+            self.requests.append((url, data))
+            return FakeHttpResponse({
+                'response': {'docs': [
+                    {'id': '1', 'court': 'Supreme Court',
+                     'court_exact': 'scotus'},
+                    {'id': '2', 'court_exact': 'ca9'},
+                ]},
+                'termVectors': {
+                    'uniqueKeyFieldName': 'id',
+                    '1': {'uniqueKey': '1',
+                          'text': {'copyright': {}, 'use': {}},
+                          'caseName': {'aereo': {}}},
+                    '2': {'uniqueKey': '2', 'text': {'patent': {}}},
+                },
+            })
+        requests.post = post
+
+    def tearDown(self):
+        requests.post = self.requests_post
+
+    def test_items_have_their_terms(self):
+        items = get_new_items('http://solr/collection1/', [1, 2],
+                              SplittingAnalyzer())
+        url, data = self.requests[0]
+        self.assertEqual(url, 'http://solr/collection1/tvrh')
+        self.assertEqual(data['fq'], 'id:(1 OR 2)')
+
+        item1, item2 = items
+        self.assertEqual((item1.id, item2.id), (1, 2))
+        self.assertEqual(item1.terms['caseName'], set(['aereo']))
+        # Fields without term vectors are analyzed from their values.
+        self.assertEqual(item1.terms['court'], set(['supreme', 'court']))
+        self.assertEqual(item1.all_terms,
+                         set(['copyright', 'use', 'aereo', 'supreme',
+                              'court']))
+        self.assertEqual(item2.all_terms, set(['patent']))
+
+
+class PlanQueriesTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def setUp(self):
+        filed = datetime.date.today().strftime('%Y-%m-%dT00:00:00Z')
+        self.items = [
+            NewItem({'id': '1', 'court_exact': 'test',
+                     'status_exact': 'Precedential', 'dateFiled': filed,
+                     'citeCount': 0},
+                    {'text': set(['copyright', 'fair', 'use'])}),
+            NewItem({'id': '2', 'court_exact': 'test',
+                     'status_exact': 'Precedential', 'dateFiled': filed,
+                     'citeCount': 0},
+                    {'text': set(['patent', 'infringement'])}),
+        ]
+        self.command = Command()
+        self.command.rate = 'rt'
+        self.command.valid_ids = {'o': [1, 2], 'oa': []}
+        self.command.new_items = {'o': self.items, 'oa': []}
+        self.command.analyzers = {'o': SplittingAnalyzer(),
+                                  'oa': SplittingAnalyzer()}
+        self.alerts = [
+            Alert(pk=1, name='a', query='q=copyright', rate='rt'),
+            Alert(pk=2, name='b', query='q=copyright', rate='rt'),
+            Alert(pk=3, name='c', query='q=patent', rate='rt'),
+            Alert(pk=4, name='d', query='q=trademark', rate='rt'),
+        ]
+
+    def get_ids(self, queries, alert_queries):
+        return dict((pk, queries[key][2])
+                    for pk, key in alert_queries.iteritems())
+
+    def test_real_time_queries_get_their_candidates(self):
+        """Is each real time alert only run against the new items it could
+        match, and not at all if there are none?"""
+        queries, alert_queries = self.command.plan_queries(self.alerts)
+        # The same query is only run once.
+        self.assertEqual(alert_queries[1], alert_queries[2])
+        self.assertEqual(len(queries), 3)
+        self.assertEqual(self.get_ids(queries, alert_queries),
+                         {1: (1,), 2: (1,), 3: (2,), 4: None})
+        self.assertIsNone(queries[alert_queries[4]][1])
+
+    def test_every_item_is_a_candidate_without_new_items(self):
+        """If the new items couldn't be fetched, is every one of them tried?
+        """
+        self.command.new_items['o'] = None
+        queries, alert_queries = self.command.plan_queries(self.alerts)
+        self.assertEqual(self.get_ids(queries, alert_queries),
+                         {1: (1, 2), 2: (1, 2), 3: (1, 2), 4: (1, 2)})
+
+
+class ScoringSolr(FakeSolr):
+    """Answers every query with a hit for each id in its last filter, scored
+    by id, so the best hits are the highest ids.
+    """
+    def respond(self, params):
+        ids = re.match(r'id:\((.*)\)$', params['fq'][-1]).group(1)
+        hits = [{'id': int(i), 'score': float(i)} for i in ids.split(' OR ')]
+        hits.sort(key=lambda hit: hit['score'], reverse=True)
+        return hits[:int(params['rows'])]
+
+
+class RunQueryTest(TestCase):
+    def test_ids_are_searched_in_chunks(self):
+        """Is a burst of new items split between queries Solr can take, and
+        are the best hits of all of them kept?"""
+        solr = ScoringSolr()
+        params = {'q': 'foo', 'rows': '20', 'fq': ['court_exact:test']}
+        hits = Command.run_query_for_ids(solr, params, range(1, 1201))
+
+        self.assertEqual(len(solr.queries), 3)
+        for query in solr.queries:
+            self.assertEqual(query['fq'][0], 'court_exact:test')
+            self.assertLessEqual(query['fq'][-1].count(' OR ') + 1,
+                                 RT_CHUNK_SIZE)
+        self.assertEqual([hit['id'] for hit in hits], range(1200, 1180, -1))
+        # The params of the alert are left alone.
+        self.assertEqual(params['fq'], ['court_exact:test'])
@@ -9,7 +9,7 @@ from django.conf import settings
 from django.utils.timezone import now
 
 from alert.lib.timer import print_timing
-from alert.lib.db_tools import queryset_generator
+from alert.lib.db_tools import keyset_iterator
 from alert.lib.utils import deepgetattr
 from alert.lib.utils import mkdir_p
 
@@ -116,11 +116,8 @@ def write_json_to_disk(obj_type_str, obj_type, court_attr,
         print "   - Incremental data not found. Working from scratch..."
         qs = obj_type.objects.all()
     item_resource = api_resource_obj()
-    if type(qs[0].pk) == int:
-        item_list = queryset_generator(qs)
-    else:
-        # Necessary for jurisdictions, which don't have ints for ids.
-        item_list = qs
+    # Keyset pagination works for the string ids of jurisdictions too.
+    item_list = keyset_iterator(qs, server_side=True)
     i = 0
     for item in item_list:
         json_str = item_resource.serialize(
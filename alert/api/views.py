@@ -38,7 +38,7 @@ def annotate_courts_with_counts(courts, court_count_tuples):
 
 def make_court_variable():
     courts = Court.objects.exclude(jurisdiction='T')  # Non-testing courts
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
     response = conn.raw_query(
         **search_utils.build_court_count_query()).execute()
     court_count_tuples = response.facet_counts.facet_fields['court_exact']
@@ -143,7 +143,7 @@ def coverage_data(request, court):
     """
     
     q = request.GET.get('q')
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
     start_year = search_utils.get_court_start_year(conn, court)
     response = conn.raw_query(
         **search_utils.build_coverage_query(court, start_year, q)
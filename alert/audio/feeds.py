@@ -25,7 +25,7 @@ class JurisdictionPodcast(JurisdictionFeed):
         """
         Returns a list of items to publish in this feed.
         """
-        conn = sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='r')
+        conn = sunburnt.get_solr_interface(settings.SOLR_AUDIO_URL, mode='r')
         params = {
             'q': '*:*',
             'fq': 'court_exact:%s' % obj.pk,
@@ -73,7 +73,7 @@ class AllJurisdictionsPodcast(JurisdictionPodcast):
         return None
 
     def items(self, obj):
-        conn = sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='r')
+        conn = sunburnt.get_solr_interface(settings.SOLR_AUDIO_URL, mode='r')
         params = {
             'q': '*:*',
             'sort': 'dateArgued desc',
@@ -94,7 +94,6 @@ class SearchPodcast(JurisdictionPodcast):
         search_form = SearchForm(obj.GET)
         if search_form.is_valid():
             cd = search_form.cleaned_data
-            conn = sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='r')
             main_params = search_utils.build_main_query(cd, highlight=False)
             main_params.update({
                 'sort': 'dateArgued desc',
@@ -102,6 +101,7 @@ class SearchPodcast(JurisdictionPodcast):
                 'start': '0',
                 'caller': 'SearchFeed',
             })
-            return conn.raw_query(**main_params).execute()
+            return search_utils.get_search_results(
+                settings.SOLR_AUDIO_URL, main_params)['docs']
         else:
             return []
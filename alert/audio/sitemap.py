@@ -3,33 +3,28 @@ from django.http import HttpResponse
 from django.template import loader
 from django.utils.encoding import smart_str
 
-from alert.lib import sunburnt
-from alert.sitemap import items_per_sitemap
+from alert.lib import search_utils
+from alert.sitemap import items_per_sitemap, serve_sitemap_file, \
+    sitemap_file_name
 
+oral_argument_sitemap_params = {
+    'q': '*:*',
+    'fl': ','.join([
+        'absolute_url',
+        'dateArgued',
+        'local_path',
+        'citeCount',
+        'timestamp',
+    ]),
+    'sort': 'dateArgued asc',
+    'caller': 'oral_argument_sitemap_maker',
+}
 
-def oral_argument_sitemap_maker(request):
-    conn = sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='r')
-    page = request.GET.get("p")
-    start = (int(page) - 1) * items_per_sitemap
-    params = {
-        'q': '*:*',
-        'rows': items_per_sitemap,
-        'start': start,
-        'fl': ','.join([
-            'absolute_url',
-            'dateArgued',
-            'local_path',
-            'citeCount',
-            'timestamp',
-        ]),
-        'sort': 'dateArgued asc',
-        'caller': 'oral_argument_sitemap_maker',
-    }
-    search_results_object = conn.raw_query(**params).execute()
-
-    # Translate Solr object into something Django's template can use
+
+def make_oral_argument_urls(results):
+    """Translate Solr results into something Django's template can use"""
     urls = []
-    for result in search_results_object:
+    for result in results:
         url_strs = [
             'https://www.courtlistener.com%s' % result['absolute_url']]
         if result.get('local_path') and result.get('local_path') != '':
@@ -46,6 +41,24 @@ def oral_argument_sitemap_maker(request):
             else:
                 sitemap_item['priority'] = '0.5'
             urls.append(dict(sitemap_item))
+    return urls
+
+
+def oral_argument_sitemap_maker(request):
+    page = int(request.GET.get("p"))
+    response = serve_sitemap_file(request,
+                                  sitemap_file_name('oral-arguments', page))
+    if response is not None:
+        return response
+
+    # The files haven't been made yet, so get the page from the index.
+    params = oral_argument_sitemap_params.copy()
+    params.update({
+        'rows': items_per_sitemap,
+        'start': (page - 1) * items_per_sitemap,
+    })
+    results = search_utils.get_search_results(settings.SOLR_AUDIO_URL, params)
+    urls = make_oral_argument_urls(results['docs'])
 
     xml = smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
     # These links contain case names, so they should get crawled but not
@@ -0,0 +1,342 @@
+import mmap
+import os
+import re
+import threading
+import time
+
+from alert.search.models import CITATION_FIELDS, Document, \
+    DOCUMENT_STATUSES
+from django.conf import settings
+from django.core.cache import cache
+
+# Citations are matched against Solr with status:Precedential, which, because
+# the status field is tokenized, also matches Non-Precedential documents.
+# Mirror that here.
+INDEXED_STATUSES = [status for status, label in DOCUMENT_STATUSES
+                    if 'precedential' in label.lower()]
+
+# How often, in seconds, to check whether the index file has been rebuilt.
+RELOAD_CHECK_INTERVAL = 60
+
+# How often, in seconds, to pick up the documents other processes changed.
+CHANGE_CHECK_INTERVAL = 10
+
+# How many changed documents are kept in memory on top of the file. Past that,
+# lookups return None, so callers ask Solr, until the file is rebuilt.
+MAX_OVERLAY_DOCUMENTS = 10000
+
+# Every process adds the pks of the documents it changes to the cache under a
+# new version number, and the others refresh them from the database when they
+# see the version go up. Builds of the file note the version they started at,
+# so the changes made since can be applied on top of it.
+VERSION_KEY = 'citation-index-version'
+CHANGE_KEY = 'citation-index-change-%s'
+# How long the version and the changes are kept.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+CHANGE_TIMEOUT = 60 * 60 * 24
+
+# Held while a rebuild of a full index is queued or running.
+REBUILD_LOCK_KEY = 'citation-index-rebuilding'
+REBUILD_LOCK_TIMEOUT = 60 * 60
+
+VERSION_LINE = '#version\t%d\n'
+
+BASE_CITATION_RE = re.compile(r'^\s*(\d+)\s+(.+?)\s+(\d+)\b')
+
+
+def tokenize_citation(citation_string):
+    """Split a citation into lowercase alphanumeric tokens, approximating how
+    Solr analyzes the citation field.
+    """
+    return re.findall(r'[a-z0-9]+', citation_string.lower())
+
+
+def normalize_citation(citation_string):
+    """Make a key from the volume, reporter and page of a citation.
+
+    Anything after the page, such as a parenthetical, is dropped, so
+    "1 Yeates 1 (test 1795)" and "1 Yeates 1" become the same key. Returns
+    None if the string doesn't look like a citation.
+    """
+    m = BASE_CITATION_RE.match(citation_string)
+    if m is None:
+        return None
+    return ' '.join(tokenize_citation(' '.join(m.groups())))
+
+
+def get_rows(queryset):
+    return queryset.values_list(
+        'pk', 'date_filed', 'docket__court_id', 'precedential_status',
+        *['citation__%s' % field for field in CITATION_FIELDS]
+    ).iterator()
+
+
+def make_entries(row):
+    """Turn a row from get_rows into (key, (pk, year, court_id)) tuples."""
+    pk, date_filed, court_id, status = row[:4]
+    if status not in INDEXED_STATUSES or date_filed is None:
+        return []
+    keys = set()
+    for citation_string in row[4:]:
+        if citation_string:
+            key = normalize_citation(citation_string)
+            if key is not None:
+                keys.add(key)
+    return [(key, (pk, date_filed.year, court_id)) for key in keys]
+
+
+def get_version():
+    return cache.get(VERSION_KEY) or 0
+
+
+def publish_changes(pks):
+    """Tell every process that the citations of the documents with pks have
+    changed.
+    """
+    cache.add(VERSION_KEY, 0, VERSION_TIMEOUT)
+    try:
+        version = cache.incr(VERSION_KEY)
+    except ValueError:
+        # Evicted in between. The processes that had a later version will
+        # notice it went back and stop using their index until it's rebuilt.
+        version = 1
+        cache.set(VERSION_KEY, version, VERSION_TIMEOUT)
+    cache.set(CHANGE_KEY % version, list(pks), CHANGE_TIMEOUT)
+
+
+def build_citation_index(path=None):
+    """Write the index of every citation in the database to path, which
+    defaults to settings.CITATION_INDEX_PATH.
+
+    The file starts with the version of the changes it includes, and then has
+    a line per citation and document, sorted by citation:
+
+        normalized citation<TAB>document id<TAB>year filed<TAB>court id
+
+    It's written to a temporary file and then moved into place, so processes
+    using the old file aren't disturbed.
+    """
+    path = path or settings.CITATION_INDEX_PATH
+    # Anything changed from here on is applied on top of the file.
+    version = get_version()
+    lines = []
+    qs = Document.objects.filter(precedential_status__in=INDEXED_STATUSES)
+    for row in get_rows(qs):
+        for key, (pk, year, court_id) in make_entries(row):
+            lines.append('%s\t%s\t%s\t%s\n' % (key, pk, year, court_id))
+    lines.sort()
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(VERSION_LINE % version)
+        f.writelines(lines)
+    os.rename(tmp_path, path)
+    return len(lines)
+
+
+class CitationIndex(object):
+    """A map of citation strings to the documents that have them.
+
+    Matching a citation against this takes a binary search of a sorted file,
+    where Solr takes a round trip. The file is memory-mapped, so all the
+    processes on a machine share a single copy of it in the page cache. It's
+    built by the cl_build_citation_index command; until it exists, lookups
+    return None and callers should ask Solr instead.
+
+    Documents saved or deleted since the file was built, by any process, are
+    kept in an overlay, see publish_changes. If too many of them pile up, or
+    some of the changes are lost from the cache, the index stops answering
+    and has itself rebuilt, asking again until a new file turns up.
+    """
+    def __init__(self, path=None, max_overlay_documents=MAX_OVERLAY_DOCUMENTS):
+        self.path = path
+        self.max_overlay_documents = max_overlay_documents
+        self.lock = threading.RLock()
+        self.mm = None
+        self.file_stamp = None
+        self.last_check = 0
+        self.last_change_check = 0
+        self.version = 0
+        self.missing_version = None
+        self.stale = False
+        self.reset_overlay()
+
+    def reset_overlay(self):
+        # {key: [(pk, year, court_id)]}
+        self.overlay = {}
+        # {pk: [keys]}, for every document in the overlay, even those with no
+        # entries, which hide their lines in the file.
+        self.overlay_keys = {}
+
+    def check_file(self):
+        """(Re)open the index file if it has been (re)built, and pick up the
+        changes made since. Returns whether an index is available.
+        """
+        if time.time() - self.last_check >= RELOAD_CHECK_INTERVAL:
+            with self.lock:
+                self.last_check = time.time()
+                self._open_file()
+                if self.stale:
+                    # Try again, in case the rebuild failed or was lost.
+                    self.queue_rebuild()
+        if self.mm is not None and \
+                time.time() - self.last_change_check >= CHANGE_CHECK_INTERVAL:
+            with self.lock:
+                self.last_change_check = time.time()
+                self.sync_changes()
+        return self.mm is not None
+
+    def _open_file(self):
+        try:
+            stat = os.stat(self.path or settings.CITATION_INDEX_PATH)
+        except OSError:
+            return
+        stamp = (stat.st_ino, stat.st_mtime)
+        if stamp == self.file_stamp or stat.st_size == 0:
+            return
+        with open(self.path or settings.CITATION_INDEX_PATH, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm is not None:
+            self.mm.close()
+        self.mm = mm
+        self.file_stamp = stamp
+        first_line = mm[:mm.find('\n') + 1]
+        if first_line.startswith('#version\t'):
+            self.version = int(first_line.split('\t')[1])
+        else:
+            self.version = 0
+        self.missing_version = None
+        self.stale = False
+        self.reset_overlay()
+        self.last_change_check = 0
+
+    def sync_changes(self):
+        """Refresh the documents changed by any process since the last time.
+        """
+        current = get_version()
+        if current == self.version:
+            return
+        if current < self.version or \
+                current - self.version > self.max_overlay_documents:
+            self.version = current
+            self.go_stale()
+            return
+        versions = range(self.version + 1, current + 1)
+        changes = cache.get_many([CHANGE_KEY % v for v in versions])
+        pks = set()
+        for version in versions:
+            change = changes.get(CHANGE_KEY % version)
+            if change is None:
+                if version != self.missing_version:
+                    # It may be about to be set by the process that took the
+                    # version. Wait for it until the next check.
+                    self.missing_version = version
+                    break
+                # It never was, or it expired.
+                self.version = current
+                self.go_stale()
+                return
+            pks.update(change)
+            self.version = version
+        self._refresh_pks(pks)
+
+    def go_stale(self):
+        """Stop answering lookups, and have the file rebuilt."""
+        self.stale = True
+        self.reset_overlay()
+        self.queue_rebuild()
+
+    def queue_rebuild(self):
+        """Have the file rebuilt, unless that's already queued or running.
+        """
+        if cache.add(REBUILD_LOCK_KEY, True, REBUILD_LOCK_TIMEOUT):
+            # Imported here, since the tasks use this module.
+            from alert.citations.tasks import rebuild_citation_index
+            rebuild_citation_index.delay()
+
+    def refresh(self, pks):
+        """Update the overlay for the documents with pks, in every process.
+        """
+        pks = list(pks)
+        if not pks:
+            return
+        publish_changes(pks)
+        if self.mm is None:
+            return
+        with self.lock:
+            self._refresh_pks(pks)
+
+    def _refresh_pks(self, pks):
+        if self.stale or not pks:
+            return
+        pks = sorted(pks)
+        rows = {}
+        for i in range(0, len(pks), 1000):
+            qs = Document.objects.filter(pk__in=pks[i:i + 1000])
+            for row in get_rows(qs):
+                rows[row[0]] = row
+        for pk in pks:
+            self._remove_from_overlay(pk)
+            entries = make_entries(rows[pk]) if pk in rows else []
+            self.overlay_keys[pk] = [key for key, entry in entries]
+            for key, entry in entries:
+                self.overlay.setdefault(key, []).append(entry)
+        if len(self.overlay_keys) > self.max_overlay_documents:
+            self.go_stale()
+
+    def _remove_from_overlay(self, pk):
+        for key in self.overlay_keys.pop(pk, []):
+            entries = [entry for entry in self.overlay[key] if entry[0] != pk]
+            if entries:
+                self.overlay[key] = entries
+            else:
+                del self.overlay[key]
+
+    def _find_first(self, key):
+        """Binary search for the offset of the first line whose key is
+        greater than or equal to key.
+        """
+        mm = self.mm
+        lo, hi = 0, len(mm)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            start = mm.rfind('\n', 0, mid) + 1
+            if mm[start:mm.find('\t', start)] < key:
+                lo = mm.find('\n', start) + 1
+            else:
+                hi = start
+        return lo
+
+    def _get_entries(self, key):
+        entries = []
+        mm = self.mm
+        position = self._find_first(key)
+        while position < len(mm):
+            end = mm.find('\n', position)
+            fields = mm[position:end].split('\t')
+            if fields[0] != key:
+                break
+            pk = int(fields[1])
+            if pk not in self.overlay_keys:
+                entries.append((pk, int(fields[2]), fields[3]))
+            position = end + 1
+        return entries + self.overlay.get(key, [])
+
+    def lookup(self, citation_string, start_year, end_year, court=None):
+        """Get the ids of the documents with citation_string that were filed
+        between start_year and end_year (inclusive), and in the court, if
+        provided.
+
+        Returns None if there's no index to look in.
+        """
+        if not self.check_file() or self.stale:
+            return None
+        key = normalize_citation(citation_string)
+        if key is None:
+            return None
+        with self.lock:
+            return [pk for pk, year, court_id in self._get_entries(key)
+                    if start_year <= year <= end_year and
+                    (court is None or court_id == court)]
+
+
+citation_index = CitationIndex()
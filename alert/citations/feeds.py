@@ -1,4 +1,5 @@
 import datetime
+from alert.lib.feed_cache import CachedFeedMixin
 from alert.lib.string_utils import trunc
 from alert.search.models import Document
 from django.contrib.syndication.views import Feed
@@ -6,7 +7,7 @@ from django.shortcuts import get_object_or_404
 from django.utils.feedgenerator import Atom1Feed
 
 
-class CitedByFeed(Feed):
+class CitedByFeed(CachedFeedMixin, Feed):
     """Creates a feed of cases that cite a case, ordered by date filed."""
     feed_type = Atom1Feed
 
@@ -8,7 +8,7 @@ from juriscraper.lib.html_utils import get_visible_text
 from reporters_db import EDITIONS, REPORTERS, VARIATIONS_ONLY
 from django.utils.timezone import now
 from alert.citations import reporter_tokenizer
-from alert.search.models import Court
+from alert.search.court_registry import court_registry
 
 
 FORWARD_SEEK = 20
@@ -18,16 +18,6 @@ BACKWARD_SEEK = 70  # Average case name length in the db is 67
 STOP_TOKENS = ['v', 're', 'parte', 'denied', 'citing', "aff'd", "affirmed",
                "remanded", "see", "granted", "dismissed"]
 
-# Store court values to avoid repeated DB queries
-if not set(sys.argv).isdisjoint(['test', 'syncdb', 'shell', 'migrate']):
-    # If it's a test, we can't count on the database being prepped, so we have
-    # to load lazily
-    ALL_COURTS = Court.objects.all().values('citation_string', 'pk')
-else:
-    # list() forces early evaluation of the queryset so we don't have issues
-    # with closed cursors.
-    ALL_COURTS = list(Court.objects.all().values('citation_string', 'pk'))
-
 
 class Citation(object):
     """Convenience class which represents a single citation found in a
@@ -160,12 +150,9 @@ def get_court_by_paren(paren_string, citation):
         court_code = None
     else:
         # Map the string to a court, if possible.
-        for court in ALL_COURTS:
-            # Use startswith because citations are often missing final period,
-            # e.g. "2d Cir"
-            if court['citation_string'].startswith(court_str):
-                court_code = court['pk']
-                break
+        court = court_registry.get_by_citation_string(court_str)
+        if court is not None:
+            court_code = court.pk
 
     return court_code
 
@@ -407,7 +394,7 @@ def get_citations(text, html=True, do_post_citation=True, do_defendant=True):
     # citations must have a volume before and a page number after the reporter.
     for i in xrange(1, len(words) - 1):
         # Find reporter
-        if words[i] in (EDITIONS.keys() + VARIATIONS_ONLY.keys()):
+        if words[i] in reporter_tokenizer.REPORTER_STRINGS:
             citation = extract_base_citation(words, i)
             if citation is None:
                 # Not a valid citation; continue looking
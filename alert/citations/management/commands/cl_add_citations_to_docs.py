@@ -3,17 +3,23 @@ import time
 import sys
 from django.conf import settings
 
-from alert.lib.db_tools import queryset_generator
+from alert.lib.db_tools import keyset_iterator
 from alert.lib import sunburnt
+from alert.lib.search_utils import commit_index
 from alert.search.models import Document
 from celery.task.sets import TaskSet
-from citations.tasks import update_document
+from citations.tasks import update_documents
 from django.core.management import call_command
 from django.core.management import BaseCommand, CommandError
 from django.utils.timezone import make_aware, utc
 from optparse import make_option
 
 
+# How many documents each Celery task should match citations for. Matching
+# them together lets us batch the queries to Solr.
+DOCS_PER_TASK = 25
+
+
 class Command(BaseCommand):
     option_list = BaseCommand.option_list + (
         make_option(
@@ -75,6 +81,7 @@ class Command(BaseCommand):
         sys.stdout.flush()
         processed_count = 0
         subtasks = []
+        doc_batch = []
         timings = []
         average_per_s = 0
         if self.index == 'concurrently':
@@ -85,8 +92,8 @@ class Command(BaseCommand):
             processed_count += 1
             if processed_count % 10000 == 0:
                 # Send the commit every 10000 times.
-                self.si.commit()
-            subtasks.append(update_document.subtask((doc, index_during_subtask)))
+                commit_index(self.si)
+            doc_batch.append(doc)
             if processed_count % 1000 == 1:
                 t1 = time.time()
             if processed_count % 1000 == 0:
@@ -101,6 +108,10 @@ class Command(BaseCommand):
             ))
             sys.stdout.flush()
             last_document = (count == processed_count)
+            if len(doc_batch) == DOCS_PER_TASK or last_document:
+                subtasks.append(update_documents.subtask(
+                    (doc_batch, index_during_subtask)))
+                doc_batch = []
             if (processed_count % 500 == 0) or last_document:
                 # Every 500 documents, we send the subtasks off for processing
                 # Poll to see when they're done.
@@ -142,7 +153,7 @@ class Command(BaseCommand):
             start_date = make_aware(datetime.strptime(options['filed_after'], '%Y-%m-%d'), utc)
 
         self.index = options['index'].lower()
-        self.si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='rw')
+        self.si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='rw')
 
         # Use query chaining to build the query
         query = Document.objects.all()
@@ -157,5 +168,8 @@ class Command(BaseCommand):
         if options.get('all'):
             query = Document.objects.all()
         count = query.count()
-        docs = queryset_generator(query, chunksize=10000)
+        # The tasks need the text of the documents, so they can't be deferred,
+        # but the citations can be sent along with them.
+        docs = keyset_iterator(query.select_related('citation'),
+                               chunksize=1000, server_side=True)
         self.update_documents(docs, count)
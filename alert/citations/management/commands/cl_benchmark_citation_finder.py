@@ -0,0 +1,170 @@
+import os
+import sys
+import time
+
+from alert.citations import reporter_tokenizer
+from alert.citations.find_citations import get_citations, strip_punct
+from alert.search.court_registry import court_registry
+from alert.search.models import Document
+from django.core.management import BaseCommand, CommandError
+from juriscraper.lib.html_utils import get_visible_text
+from optparse import make_option
+from reporters_db import EDITIONS, VARIATIONS_ONLY
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--path',
+            type=str,
+            help='A directory of opinion files to use as the corpus.',
+        ),
+        make_option(
+            '--count',
+            type=int,
+            default=500,
+            help='If no path is given, use this many documents from the '
+                 'database, ordered by pk, as the corpus.',
+        ),
+        make_option(
+            '--briefs',
+            type=int,
+            default=0,
+            help='Add this many made up briefs, full of citations with court '
+                 'parentheticals, to the corpus.',
+        ),
+        make_option(
+            '--iterations',
+            type=int,
+            default=3,
+            help='How many times to run over the corpus. The fastest run is '
+                 'reported.',
+        ),
+    )
+    help = 'Benchmark citation extraction over a fixed corpus of opinions.'
+
+    @staticmethod
+    def load_corpus(path, count):
+        """Get a list of (text, is_html) tuples to benchmark against."""
+        corpus = []
+        if path:
+            for filename in sorted(os.listdir(path)):
+                with open(os.path.join(path, filename)) as f:
+                    text = f.read().decode('utf-8', 'ignore')
+                corpus.append((text, filename.endswith('html')))
+        else:
+            qs = Document.objects.order_by('pk').only(
+                'html', 'html_lawbox', 'plain_text')[:count]
+            for doc in qs:
+                if doc.html_lawbox:
+                    corpus.append((doc.html_lawbox, True))
+                elif doc.html:
+                    corpus.append((doc.html, True))
+                else:
+                    corpus.append((doc.plain_text, False))
+        return corpus
+
+    @staticmethod
+    def make_briefs(count, courts):
+        """Make briefs that are little more than citations with court
+        parentheticals, one for each court, to stress the court lookup.
+        """
+        citations = []
+        for i, court in enumerate(c for c in courts if c.citation_string):
+            citations.append(u'Foo v. Bar, {0:d} F.3d {1:d} ({2} {3:d}).'.format(
+                i % 900 + 1, i % 1500 + 1, court.citation_string,
+                1950 + i % 60))
+        brief = u' See also '.join(citations)
+        return [(brief, False) for _ in range(count)]
+
+    @staticmethod
+    def best_of(iterations, func, *args):
+        timings = []
+        for _ in range(iterations):
+            t1 = time.time()
+            func(*args)
+            timings.append(time.time() - t1)
+        return min(timings)
+
+    @staticmethod
+    def find_reporters_legacy(token_lists):
+        """The reporter lookup as it was done before REPORTER_STRINGS existed,
+        rebuilding and scanning a list for every token.
+        """
+        for words in token_lists:
+            for word in words:
+                word in (EDITIONS.keys() + VARIATIONS_ONLY.keys())
+
+    @staticmethod
+    def find_reporters(token_lists):
+        for words in token_lists:
+            for word in words:
+                word in reporter_tokenizer.REPORTER_STRINGS
+
+    @staticmethod
+    def find_courts_legacy(court_strings, courts):
+        """The court lookup as it was done before the registry indexed the
+        citation strings, checking every court for every parenthetical.
+        """
+        for court_string in court_strings:
+            for court in courts:
+                if court.citation_string.startswith(court_string):
+                    break
+
+    @staticmethod
+    def find_courts(court_strings):
+        for court_string in court_strings:
+            court_registry.get_by_citation_string(court_string)
+
+    @staticmethod
+    def extract_all(corpus):
+        for text, is_html in corpus:
+            get_citations(text, html=is_html)
+
+    def handle(self, *args, **options):
+        corpus = self.load_corpus(options.get('path'), options['count'])
+        courts = court_registry.all()
+        corpus.extend(self.make_briefs(options['briefs'], courts))
+        if not corpus:
+            raise CommandError('No documents found for the corpus.')
+        iterations = options['iterations']
+
+        token_lists = []
+        for text, is_html in corpus:
+            if is_html:
+                text = get_visible_text(text)
+            token_lists.append(reporter_tokenizer.tokenize(text))
+        token_count = sum(len(words) for words in token_lists)
+        sys.stdout.write('Corpus is {0:d} documents and {1:d} tokens.\n'.format(
+            len(corpus), token_count))
+
+        legacy = self.best_of(iterations, self.find_reporters_legacy,
+                              token_lists)
+        current = self.best_of(iterations, self.find_reporters, token_lists)
+        sys.stdout.write(
+            'Reporter lookup: {0:.3f}s with lists, {1:.3f}s with the '
+            'precompiled set ({2:.1f}x faster).\n'.format(
+                legacy, current, legacy / max(current, 1e-9)))
+
+        # What get_court_by_paren looks up: the citation strings without
+        # their final periods, as they are once the punctuation is stripped.
+        court_strings = [strip_punct(court.citation_string)
+                         for court in courts if court.citation_string]
+        court_strings = court_strings * max(1, 100000 / max(len(court_strings), 1))
+        legacy = self.best_of(iterations, self.find_courts_legacy,
+                              court_strings, courts)
+        court_registry.clear()
+        current = self.best_of(iterations, self.find_courts, court_strings)
+        sys.stdout.write(
+            'Court lookup: {0:.3f}s scanning every court, {1:.3f}s with the '
+            'index ({2:.1f}x faster) for {3:d} parentheticals.\n'.format(
+                legacy, current, legacy / max(current, 1e-9),
+                len(court_strings)))
+
+        extraction = max(self.best_of(iterations, self.extract_all, corpus),
+                         1e-9)
+        sys.stdout.write(
+            'Full extraction: {0:.3f}s ({1:.1f} docs/s, {2:.0f} '
+            'tokens/s).\n'.format(extraction,
+                                  len(corpus) / extraction,
+                                  token_count / extraction))
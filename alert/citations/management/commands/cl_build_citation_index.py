@@ -0,0 +1,30 @@
+import sys
+import time
+
+from alert.citations.citation_index import build_citation_index
+from django.conf import settings
+from django.core.management import BaseCommand
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--path',
+            type=str,
+            default=None,
+            help='Where to write the index. Defaults to '
+                 'settings.CITATION_INDEX_PATH, which is where the citation '
+                 'matcher looks for it.',
+        ),
+    )
+    help = ('Build the index of citations used to match citations without '
+            'querying Solr. Run this regularly, e.g. nightly, to pick up new '
+            'documents.')
+
+    def handle(self, *args, **options):
+        path = options['path'] or settings.CITATION_INDEX_PATH
+        t1 = time.time()
+        count = build_citation_index(path)
+        sys.stdout.write('Wrote {0:d} citations to {1} in {2:.1f}s.\n'.format(
+            count, path, time.time() - t1))
@@ -9,6 +9,7 @@ import sys
 execfile('/etc/courtlistener')
 sys.path.append(INSTALL_ROOT)
 from reporters_db import REPORTERS
+from alert.citations.citation_index import citation_index, normalize_citation
 from alert.citations.find_citations import strip_punct
 from alert.lib import sunburnt
 from datetime import date, datetime
@@ -18,6 +19,14 @@ DEBUG = True
 
 QUERY_LENGTH = 10
 
+# How many citations to look up per request when matching them in bulk, and
+# how many documents to get back for them.
+BATCH_SIZE = 50
+BATCH_ROWS = 500
+# The stored fields of the documents found in bulk, with the citations they
+# are matched back to.
+BATCH_FIELDS = 'id,caseName,citation,neutralCite,lexisCite,dateFiled,court_id'
+
 
 def build_date_range(start_year, end_year):
     """Build a date range to be handed off to a solr query."""
@@ -42,9 +51,20 @@ def make_name_param(defendant, plaintiff=None):
 def reverse_match(conn, results, citing_doc):
     """Uses the case name of the found document to verify that it is a match on
     the original.
+
+    Rather than placing a query per result, each result's case name becomes a
+    facet query against the citing document, so a single request tells us
+    which of them appear in it.
     """
-    params = {'fq': ['id:%s' % citing_doc.pk]}
-    for result in results:
+    params = {
+        'q': '*:*',
+        'fq': ['id:%s' % citing_doc.pk],
+        'rows': 0,
+        'facet': 'true',
+        'facet.query': [],
+        'caller': 'reverse_match',
+    }
+    for i, result in enumerate(results):
         case_name, length = make_name_param(result['caseName'])
         # Avoid overly long queries
         start = max(length - QUERY_LENGTH, 0)
@@ -52,39 +72,56 @@ def reverse_match(conn, results, citing_doc):
         query = ' '.join(query_tokens)
         # ~ performs a proximity search for the preceding phrase
         # See: http://wiki.apache.org/solr/SolrRelevancyCookbook#Term_Proximity
-        params['q'] = '"%s"~%d' % (query, len(query_tokens))
-        params['caller'] = 'reverse_match'
-        new_results = conn.raw_query(**params).execute()
-        if len(new_results) == 1:
+        params['rq%d' % i] = '"%s"~%d' % (query, len(query_tokens))
+        params['facet.query'].append('{!edismax v=$rq%d}' % i)
+    if not params['facet.query']:
+        return []
+    facet_queries = dict(
+        conn.raw_query(**params).execute().facet_counts.facet_queries)
+    for i, result in enumerate(results):
+        if facet_queries.get('{!edismax v=$rq%d}' % i) == 1:
             return [result]
     return []
 
 
 def case_name_query(conn, params, citation, citing_doc):
+    """Find documents by the case name in the citation.
+
+    We use Solr's minimum match to require all the words to match, and then
+    one less, and so on until something is found. The counts for each value
+    of mm are gathered in a single request using facet queries, and only the
+    best one is then run for its results.
+    """
     query, length = make_name_param(citation.defendant, citation.plaintiff)
-    params['q'] = "caseName:(%s)" % query
-    params['caller'] = 'match_citations'
-    results = []
-    # Use Solr minimum match search, starting with requiring all words to match,
-    # and decreasing by one word each time until a match is found
+    count_params = {
+        'q': '*:*',
+        'fq': params['fq'],
+        'rows': 0,
+        'facet': 'true',
+        'facet.query': ['{!edismax mm=%d v=$name_q}' % num_words
+                        for num_words in xrange(length, 0, -1)],
+        'name_q': "caseName:(%s)" % query,
+        'caller': 'match_citations',
+    }
+    facet_queries = dict(
+        conn.raw_query(**count_params).execute().facet_counts.facet_queries)
     for num_words in xrange(length, 0, -1):
-        params['mm'] = num_words
-        new_results = conn.raw_query(**params).execute()
-        if len(new_results) >= 1:
-            # For 1 result, make sure case name of match actually appears in citing doc
-            # For multiple results, use same technique to potentially narrow down
+        if facet_queries.get('{!edismax mm=%d v=$name_q}' % num_words) >= 1:
+            params['q'] = "caseName:(%s)" % query
+            params['mm'] = num_words
+            params['caller'] = 'match_citations'
+            new_results = conn.raw_query(**params).execute()
+            # For 1 result, make sure case name of match actually appears in
+            # citing doc. For multiple results, use same technique to
+            # potentially narrow down
             return reverse_match(conn, new_results, citing_doc)
-            # Else, try again
-        results = new_results
-    return results
+    return []
 
 
-def match_citation(citation, citing_doc):
-    # TODO: Create shared solr connection to use across multiple citations/
-    # documents
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
-    main_params = {'fq': []}
-    # Set up filter parameters
+def get_year_range(citation, citing_doc):
+    """Get the first and last years in which a match for the citation could
+    have been filed.
+    """
     start_year = 1750
     end_year = date.today().year
     if citation.year:
@@ -103,11 +140,47 @@ def match_citation(citation, citing_doc):
                 end_year = 2030
         if citing_doc.date_filed:
             end_year = min(end_year, citing_doc.date_filed.year)
-    date_param = 'dateFiled:%s' % build_date_range(start_year, end_year)
-    main_params['fq'].append(date_param)
+    return start_year, end_year
+
+
+def get_filter_queries(citation, citing_doc):
+    """Get the date and court filters that a match for the citation must meet.
+    """
+    fq = []
+    date_param = 'dateFiled:%s' % build_date_range(
+        *get_year_range(citation, citing_doc))
+    fq.append(date_param)
     if citation.court:
         court_param = 'court_exact:%s' % citation.court
-        main_params['fq'].append(court_param)
+        fq.append(court_param)
+    return fq
+
+
+def match_in_index(citation, citing_doc):
+    """Look the citation up in the local citation index.
+
+    Returns the match in the same form Solr would, if there's exactly one, and
+    None otherwise, in which case Solr should be asked.
+    """
+    start_year, end_year = get_year_range(citation, citing_doc)
+    pks = citation_index.lookup(citation.base_citation(), start_year,
+                                end_year, citation.court)
+    if pks is not None and len(pks) == 1:
+        return [{'id': pks[0]}]
+    return None
+
+
+def match_citation(citation, citing_doc, conn=None):
+    # Take 0: Use the local index, if we can
+    matches = match_in_index(citation, citing_doc)
+    if matches:
+        return matches, True
+
+    if conn is None:
+        conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL,
+                                           mode='r')
+    # Set up filter parameters
+    main_params = {'fq': get_filter_queries(citation, citing_doc)}
 
     # Non-precedential documents shouldn't be cited
     main_params['fq'].append('status:Precedential')
@@ -125,12 +198,129 @@ def match_citation(citation, citing_doc):
         return results, True
 
     # Take 2: Use case name
+    return match_by_case_name(conn, citation, citing_doc)
+
+
+def match_by_case_name(conn, citation, citing_doc):
+    """Match a citation by its case name alone, for when the citation itself
+    found nothing.
+    """
     if not citation.defendant:
         return [], False
-        # Remove citation parameter
-    main_params['fq'].remove(citation_param)
+    main_params = {'fq': get_filter_queries(citation, citing_doc)}
+    main_params['fq'].append('status:Precedential')
     return case_name_query(conn, main_params, citation, citing_doc), False
 
 
+def get_doc_citations(doc):
+    """Get the keys of the citations of a document from Solr, as made by
+    normalize_citation.
+
+    The citation field has all of them, joined by commas, as made by
+    SearchDocument.
+    """
+    citation_strings = doc.get('citation', u'').split(', ')
+    citation_strings.extend([doc.get('neutralCite'), doc.get('lexisCite')])
+    keys = set()
+    for citation_string in citation_strings:
+        if citation_string:
+            key = normalize_citation(citation_string)
+            if key is not None:
+                keys.add(key)
+    return keys
+
+
+def is_match_in_range(doc, citation, citing_doc):
+    """Check a result against the filters from get_filter_queries."""
+    if citation.court and doc.get('court_id') != citation.court:
+        return False
+    if doc.get('dateFiled') is None:
+        return False
+    start_year, end_year = get_year_range(citation, citing_doc)
+    return start_year <= doc['dateFiled'].year <= end_year
+
+
+def match_citations(citation_pairs, conn=None):
+    """Match many citations at once, from one document or several.
+
+    citation_pairs is a list of (citation, citing_doc) tuples. The return
+    value is a list of (matches, is_citation_match) tuples, in the same order,
+    exactly as match_citation would return them.
+
+    Citations found in the local citation index don't go to Solr at all. For
+    the rest, the exact citation lookups are OR-ed together into a few
+    queries, with a facet query per citation telling us how many documents
+    each one matched. Citations that matched exactly one document are resolved
+    from the results of the combined query, by the document's own citations.
+    The rest go through the usual case name matching, all using a single
+    connection.
+    """
+    matches = [None] * len(citation_pairs)
+    pending = []
+    for i, (citation, citing_doc) in enumerate(citation_pairs):
+        index_matches = match_in_index(citation, citing_doc)
+        if index_matches:
+            matches[i] = (index_matches, True)
+        else:
+            pending.append(i)
+    if not pending:
+        return matches
+
+    if conn is None:
+        conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL,
+                                           mode='r')
+    clauses = {}
+    for i in pending:
+        citation, citing_doc = citation_pairs[i]
+        clauses[i] = ' AND '.join(
+            ['citation:"%s"' % citation.base_citation()] +
+            get_filter_queries(citation, citing_doc))
+
+    counts = {}
+    docs_by_clause = {}
+    unique_clauses = list(set(clauses.values()))
+    for i in xrange(0, len(unique_clauses), BATCH_SIZE):
+        batch = unique_clauses[i:i + BATCH_SIZE]
+        params = {
+            'q': '*:*',
+            'fq': [
+                'status:Precedential',
+                ' OR '.join(['(%s)' % clause for clause in batch]),
+            ],
+            'fl': BATCH_FIELDS,
+            'rows': BATCH_ROWS,
+            'facet': 'true',
+            'facet.query': batch,
+            'caller': 'match_citations',
+        }
+        response = conn.raw_query(**params).execute()
+        counts.update(dict(response.facet_counts.facet_queries))
+        for clause in batch:
+            docs_by_clause[clause] = response.result.docs
+
+    for i in pending:
+        citation, citing_doc = citation_pairs[i]
+        count = counts.get(clauses[i])
+        if count == 0:
+            matches[i] = match_by_case_name(conn, citation, citing_doc)
+            continue
+        if count == 1:
+            # Find the document that matched, among those from the batch, by
+            # the citations it has.
+            key = normalize_citation(citation.base_citation())
+            candidates = []
+            for doc in docs_by_clause[clauses[i]]:
+                if key in get_doc_citations(doc) and \
+                        is_match_in_range(doc, citation, citing_doc):
+                    candidates.append(doc)
+            if len(candidates) == 1:
+                matches[i] = (candidates, True)
+                continue
+        # Multiple matches, or we couldn't tell which one it was. Do it the
+        # long way.
+        matches[i] = match_citation(citation, citing_doc, conn)
+    return matches
+
+
 if __name__ == '__main__':
     exit(0)
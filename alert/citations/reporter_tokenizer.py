@@ -8,9 +8,14 @@ import re
 from reporters_db import EDITIONS, VARIATIONS_ONLY
 
 
+# All the strings that are a reporter or a variation of one, built once so
+# lookups are constant time. Multi-word reporters (e.g. "U. S.") are matched as
+# a single token by REPORTER_RE, below, so a flat set is all we need here.
+REPORTER_STRINGS = frozenset(EDITIONS.keys() + VARIATIONS_ONLY.keys())
+
 # We need to build a REGEX that has all the variations and the reporters in
 # order from longest to shortest.
-REGEX_LIST = EDITIONS.keys() + VARIATIONS_ONLY.keys()
+REGEX_LIST = list(REPORTER_STRINGS)
 REGEX_LIST.sort(key=len, reverse=True)
 REGEX_STR = '|'.join(map(re.escape, REGEX_LIST))
 REPORTER_RE = re.compile("(%s)" % REGEX_STR)
@@ -24,7 +29,7 @@ def normalize_variation(string):
     which is best. Usually, this can be accomplished using the year of the
     item.
     """
-    if string in VARIATIONS_ONLY.keys():
+    if string in VARIATIONS_ONLY:
         if len(VARIATIONS_ONLY[string]) == 1:
             # Simple case
             return VARIATIONS_ONLY[string][0]
@@ -54,7 +59,7 @@ def tokenize(text):
     strings = REPORTER_RE.split(text)
     words = []
     for string in strings:
-        if string in EDITIONS.keys() + VARIATIONS_ONLY.keys():
+        if string in REPORTER_STRINGS:
             words.append(string)
         else:
             # Normalize spaces
@@ -9,8 +9,11 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 
 from alert.opinion_page.views import make_citation_string
 from alert.citations import find_citations, match_citations
+from alert.citations.citation_index import REBUILD_LOCK_KEY, \
+    build_citation_index
 from alert.search.models import Document
 from celery import task
+from django.core.cache import cache
 
 
 def get_document_citations(document):
@@ -29,17 +32,60 @@ def get_document_citations(document):
     return citations
 
 
+# Finds runs of digits that could be the volume of a citation.
+VOLUME_RE = re.compile(r'\d+(?=\s)')
+
+
+def link_citations(text, citations, template=u'%s'):
+    """Replace the occurrences of the citations in text with their HTML.
+
+    This used to be done with one re.sub per citation, rescanning and copying
+    the whole text each time. Instead, we walk the text once, looking for
+    volume numbers, and only try the regexes of the citations with that
+    volume. Where two citations would overlap, the leftmost wins, with ties
+    going to the earlier citation, as before.
+    """
+    citations_by_volume = {}
+    seen = set()
+    for citation in citations:
+        regex = citation.as_regex()
+        if regex in seen:
+            # The first copy of a citation replaces all its occurrences.
+            continue
+        seen.add(regex)
+        citations_by_volume.setdefault(str(citation.volume), []).append(
+            (re.compile(regex), template % citation.as_html()))
+    if not citations_by_volume:
+        return text
+
+    pieces = []
+    last_end = 0
+    for volume_match in VOLUME_RE.finditer(text):
+        # Volumes aren't anchored to word boundaries, so "6 F.2d 29" can be
+        # found within "16 F.2d 29". Try each suffix of the digits.
+        end = volume_match.end()
+        for start in xrange(max(volume_match.start(), last_end), end):
+            for regex, repl in citations_by_volume.get(text[start:end], []):
+                citation_match = regex.match(text, start)
+                if citation_match:
+                    pieces.append(text[last_end:start])
+                    pieces.append(citation_match.expand(repl))
+                    last_end = citation_match.end()
+                    break
+            else:
+                continue
+            break
+    pieces.append(text[last_end:])
+    return ''.join(pieces)
+
+
 def create_cited_html(document, citations):
     if document.html_lawbox or document.html:
-        new_html = document.html_lawbox or document.html
-        for citation in citations:
-            new_html = re.sub(citation.as_regex(), citation.as_html(),
-                              new_html)
+        new_html = link_citations(document.html_lawbox or document.html,
+                                  citations)
     elif document.plain_text:
-        inner_html = document.plain_text
-        for citation in citations:
-            repl = u'</pre>%s<pre class="inline">' % citation.as_html()
-            inner_html = re.sub(citation.as_regex(), repl, inner_html)
+        inner_html = link_citations(document.plain_text, citations,
+                                    u'</pre>%s<pre class="inline">')
         new_html = u'<pre class="inline">%s</pre>' % inner_html
     return new_html.encode('utf-8')
 
@@ -48,68 +94,93 @@ def create_cited_html(document, citations):
 def update_document(document, index=True):
     """Get the citations for an item and save it and add it to the index if
     requested."""
-    DEBUG = 0
-    if DEBUG >= 1:
-        print "%s at https://www.courtlistener.com/admin/search/citation/%s/" % \
-            (document.citation.case_name, document.citation.pk)
+    update_documents([document], index=index)
 
-    citations = get_document_citations(document)
-    # List for tracking number of citation vs. name matches
-    matched_citations = []
-    for citation in citations:
+
+@task
+def update_documents(documents, index=True):
+    """Get the citations for a list of items, save them, and add them to the
+    index if requested.
+
+    The citations of all the items are matched together, which takes far
+    fewer trips to Solr than matching them one item at a time.
+    """
+    DEBUG = 0
+    citations_by_document = []
+    citation_pairs = []
+    for document in documents:
+        if DEBUG >= 1:
+            print "%s at https://www.courtlistener.com/admin/search/citation/%s/" % \
+                (document.citation.case_name, document.citation.pk)
+        citations = get_document_citations(document)
         # Resource.org docs contain their own citation in the html text, which
         # we don't want to include
-        if citation.base_citation() in make_citation_string(document):
-            continue
-        matches, is_citation_match = match_citations.match_citation(citation, document)
-
-        # TODO: Figure out what to do if there's more than one
-        if len(matches) == 1:
-            matched_citations.append(is_citation_match)
-            match_id = matches[0]['id']
-            try:
-                matched_doc = Document.objects.get(pk=match_id)
-                # Increase citation count for matched document if it hasn't
-                # already been cited by this document.
-                if not matched_doc.citation in document.cases_cited.all():
-                    matched_doc.citation_count += 1
-                    matched_doc.save(index=index)
-
-                # Add citation match to the citing document's list of cases it cites.
-                # cases_cited is a set so duplicates aren't an issue
-                document.cases_cited.add(matched_doc.citation)
-                # URL field will be used for generating inline citation html
-                citation.match_url = matched_doc.get_absolute_url()
-                citation.match_id = matched_doc.pk
-            except Document.DoesNotExist:
-                if DEBUG >= 2:
-                    print "No database matches found for document id %s" % match_id
-                continue
-            except Document.MultipleObjectsReturned:
+        own_citation_string = make_citation_string(document)
+        citations_to_match = [citation for citation in citations
+                              if citation.base_citation() not in
+                              own_citation_string]
+        citations_by_document.append(
+            (document, citations, citations_to_match))
+        citation_pairs.extend([(citation, document)
+                               for citation in citations_to_match])
+
+    all_matches = iter(match_citations.match_citations(citation_pairs))
+    for document, citations, citations_to_match in citations_by_document:
+        # List for tracking number of citation vs. name matches
+        matched_citations = []
+        for citation in citations_to_match:
+            matches, is_citation_match = all_matches.next()
+
+            # TODO: Figure out what to do if there's more than one
+            if len(matches) == 1:
+                matched_citations.append(is_citation_match)
+                match_id = matches[0]['id']
+                try:
+                    matched_doc = Document.objects.get(pk=match_id)
+                    # Increase citation count for matched document if it
+                    # hasn't already been cited by this document.
+                    if not matched_doc.citation in document.cases_cited.all():
+                        matched_doc.citation_count += 1
+                        matched_doc.save(index=index)
+
+                    # Add citation match to the citing document's list of
+                    # cases it cites. cases_cited is a set so duplicates
+                    # aren't an issue
+                    document.cases_cited.add(matched_doc.citation)
+                    # URL field will be used for generating inline citation
+                    # html
+                    citation.match_url = matched_doc.get_absolute_url()
+                    citation.match_id = matched_doc.pk
+                except Document.DoesNotExist:
+                    if DEBUG >= 2:
+                        print "No database matches found for document id %s" % match_id
+                    continue
+                except Document.MultipleObjectsReturned:
+                    if DEBUG >= 2:
+                        print "Multiple database matches found for document id %s" % match_id
+                    continue
+            else:
+                #create_stub([citation])
                 if DEBUG >= 2:
-                    print "Multiple database matches found for document id %s" % match_id
-                continue
-        else:
-            #create_stub([citation])
-            if DEBUG >= 2:
-                # TODO: Don't print 1 line per citation.  Save them in a list
-                # and print in a single line at the end.
-                print "No match found for citation %s" % citation.base_citation()
-    # Only create new HTML if we found citations
-    if citations:
-        document.html_with_citations = create_cited_html(document, citations)
-        if DEBUG >= 3:
-            print document.html_with_citations
-
-    # Update Solr if requested. In some cases we do it at the end for
-    # performance reasons.
-    document.save(index=index)
-    if DEBUG >= 1:
-        citation_matches = sum(matched_citations)
-        name_matches = len(matched_citations) - citation_matches
-        print "  %d citations" % len(citations)
-        print "  %d exact matches" % citation_matches
-        print "  %d name matches" % name_matches
+                    # TODO: Don't print 1 line per citation.  Save them in a
+                    # list and print in a single line at the end.
+                    print "No match found for citation %s" % citation.base_citation()
+        # Only create new HTML if we found citations
+        if citations:
+            document.html_with_citations = create_cited_html(document,
+                                                             citations)
+            if DEBUG >= 3:
+                print document.html_with_citations
+
+        # Update Solr if requested. In some cases we do it at the end for
+        # performance reasons.
+        document.save(index=index)
+        if DEBUG >= 1:
+            citation_matches = sum(matched_citations)
+            name_matches = len(matched_citations) - citation_matches
+            print "  %d citations" % len(citations)
+            print "  %d exact matches" % citation_matches
+            print "  %d name matches" % name_matches
 
 
 @task
@@ -117,3 +188,13 @@ def update_document_by_id(document_id):
     """This is not an OK way to do id-based tasks. Needs to be refactored."""
     doc = Document.objects.get(pk=document_id)
     update_document(doc)
+
+
+@task
+def rebuild_citation_index():
+    """Rebuild the citation index, once too much has changed for it to keep
+    up."""
+    try:
+        build_citation_index()
+    finally:
+        cache.delete(REBUILD_LOCK_KEY)
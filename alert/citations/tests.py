@@ -1,18 +1,27 @@
+import os
+import re
+import shutil
+import tempfile
 import time
-from datetime import date
+from datetime import date, datetime
 
 from reporters_db import REPORTERS, VARIATIONS_ONLY, EDITIONS
+from alert.citations.citation_index import CitationIndex, \
+    REBUILD_LOCK_KEY, VERSION_KEY, build_citation_index, get_version, \
+    normalize_citation
 from alert.citations.find_citations import get_citations, is_date_in_reporter
-from alert.citations import find_citations
+from alert.citations import find_citations, match_citations, tasks
 from alert.citations.reporter_tokenizer import tokenize
 from alert.lib import sunburnt
 from alert.lib.solr_core_admin import create_solr_core, delete_solr_core, \
     swap_solr_core
-from alert.lib.test_helpers import CitationTest
-from alert.search.models import Court, Docket, Document
+from alert.lib.test_helpers import CitationTest, FakeSolr, \
+    FakeSolrResponse
+from alert.search.models import Citation, Court, Docket, Document
 from alert.search import models
-from citations.tasks import update_document
+from citations.tasks import link_citations, update_document
 from django.conf import settings
+from django.core.cache import cache
 from django.test import TestCase
 
 
@@ -201,6 +210,270 @@ class CiteTest(TestCase):
                     )
             )
 
+    def test_link_citations(self):
+        """Does the single pass linker give the same HTML that running one
+        re.sub per citation did?
+        """
+        def link_with_re_sub(text, citations, template=u'%s'):
+            for citation in citations:
+                text = re.sub(citation.as_regex(),
+                              template % citation.as_html(), text)
+            return text
+
+        cite_1 = find_citations.Citation(volume=1, reporter='U.S.', page=1)
+        cite_2 = find_citations.Citation(volume=22, reporter='A.2d', page=332,
+                                         match_url='/opinion/2/foo/',
+                                         match_id=2)
+        test_pairs = (
+            (u'1 U.S. 1', [cite_1]),
+            (u'asdf 22 A.2d  332 asdf 1\nU.S. 1 (1982) and 22 A.2d 332',
+             [cite_2, cite_1]),
+            # A citation found twice in a document is only wrapped once.
+            (u'<p>1 U.S. 1</p><p>1 U.S. 1</p>', [cite_1, cite_1]),
+            (u'No citations here, only 22 and 1.', [cite_1, cite_2]),
+        )
+        for text, citations in test_pairs:
+            for template in (u'%s', u'</pre>%s<pre class="inline">'):
+                self.assertEqual(
+                    link_citations(text, citations, template),
+                    link_with_re_sub(text, citations, template),
+                    msg="Linked HTML differs for: %s" % text
+                )
+
+    def test_normalize_citation(self):
+        """Do citations that Solr would match get the same index key?"""
+        test_pairs = (
+            ('1 U.S. 1', '1 u s 1'),
+            ('1 U. S. 1', '1 u s 1'),
+            ('22 A.2d 332 (Pa. 1950)', '22 a 2d 332'),
+            ('1 Yeates 1 (test 1795)', '1 yeates 1'),
+            ('Not a citation', None),
+        )
+        for citation_string, key in test_pairs:
+            self.assertEqual(normalize_citation(citation_string), key)
+
+
+class CitationIndexTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def setUp(self):
+        self.court = Court.objects.get(pk='test')
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'citation_index')
+        cache.delete(VERSION_KEY)
+        # Keep a full index from queueing a rebuild of the real one.
+        cache.set(REBUILD_LOCK_KEY, True)
+
+    def tearDown(self):
+        cache.delete(REBUILD_LOCK_KEY)
+        shutil.rmtree(self.tmp_dir)
+
+    def make_document(self, citation_string, date_filed,
+                      precedential_status='Published'):
+        citation = Citation(federal_cite_one=citation_string)
+        citation.save(index=False)
+        docket = Docket(case_name=u'Lissner v. Saad', court=self.court)
+        docket.save()
+        document = Document(
+            date_filed=date_filed,
+            citation=citation,
+            docket=docket,
+            precedential_status=precedential_status,
+        )
+        document.save(index=False)
+        return document
+
+    def test_lookup(self):
+        """Are documents found by citation, year and court?"""
+        d1 = self.make_document(u'1 Yeates 1 (test 1795)', date(1795, 6, 9))
+        self.make_document(u'2 Yeates 5', date(1796, 1, 1))
+        self.make_document(u'1 Yeates 1', date(1795, 1, 1), 'Errata')
+        self.assertEqual(build_citation_index(self.path), 2)
+
+        index = CitationIndex(self.path)
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1790, 1800), [d1.pk])
+        self.assertEqual(
+            index.lookup(u'1 Yeates 1', 1790, 1800, court='test'), [d1.pk])
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1800, 1810), [])
+        self.assertEqual(
+            index.lookup(u'1 Yeates 1', 1790, 1800, court='other'), [])
+        self.assertEqual(index.lookup(u'3 Yeates 1', 1790, 1800), [])
+        self.assertIsNone(CitationIndex(self.path + '.missing').lookup(
+            u'1 Yeates 1', 1790, 1800))
+
+    def test_find_first(self):
+        """Does the binary search find the first line of a key, or where it
+        would be?"""
+        lines = ['#version\t0\n', '1 a 1\t1\t1900\ttest\n',
+                 '1 a 2\t2\t1900\ttest\n', '1 a 2\t3\t1901\ttest\n',
+                 '2 b 5\t4\t1902\ttest\n']
+        with open(self.path, 'w') as f:
+            f.writelines(lines)
+        index = CitationIndex(self.path)
+        self.assertTrue(index.check_file())
+        offsets = [sum(len(line) for line in lines[:i])
+                   for i in range(len(lines) + 1)]
+        self.assertEqual(index._find_first('1 a 1'), offsets[1])
+        self.assertEqual(index._find_first('1 a 2'), offsets[2])
+        self.assertEqual(index._find_first('1 a 3'), offsets[4])
+        self.assertEqual(index._find_first('3 c 1'), offsets[5])
+        self.assertEqual(index._get_entries('1 a 2'),
+                         [(2, 1900, 'test'), (3, 1901, 'test')])
+
+    def test_changes_are_seen_by_other_processes(self):
+        """Are documents saved and deleted after the index was built picked up
+        from the cache, without the file being rebuilt?"""
+        d1 = self.make_document(u'1 Yeates 1', date(1795, 6, 9))
+        build_citation_index(self.path)
+        index = CitationIndex(self.path)
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1790, 1800), [d1.pk])
+
+        # Saved by a process other than this index's.
+        d2 = self.make_document(u'1 Yeates 1', date(1796, 6, 9))
+        d1.date_filed = date(1820, 1, 1)
+        d1.save(index=False)
+        index.sync_changes()
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1790, 1800), [d2.pk])
+
+        # Without going to Solr, as Document.delete does.
+        Document.objects.filter(pk=d2.pk).delete()
+        index.sync_changes()
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1790, 1800), [])
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1800, 1830), [d1.pk])
+
+    def test_only_changes_to_entries_are_published(self):
+        """Are other processes only told about saves that change the index?
+        """
+        d1 = self.make_document(u'1 Yeates 1', date(1795, 6, 9))
+        version = get_version()
+        d1.citation_count += 1
+        d1.save(index=False)
+        self.assertEqual(get_version(), version)
+
+        d1.precedential_status = 'Errata'
+        d1.save(index=False)
+        self.assertEqual(get_version(), version + 1)
+
+        citation = Citation.objects.get(pk=d1.citation_id)
+        citation.case_name = u'Lissner v. Saad'
+        citation.save(index=False)
+        self.assertEqual(get_version(), version + 1)
+        citation.federal_cite_one = u'2 Yeates 1'
+        citation.save(index=False)
+        self.assertEqual(get_version(), version + 2)
+
+    def test_rebuild_is_queued_again(self):
+        """If a stale index's rebuild never happens, is it queued again once
+        the lock is gone?"""
+        build_citation_index(self.path)
+        index = CitationIndex(self.path)
+        index.check_file()
+        index.go_stale()
+
+        queued = []
+
+        class FakeTask(object):
+            def delay(self):
+                queued.append(True)
+        rebuild_citation_index = tasks.rebuild_citation_index
+        tasks.rebuild_citation_index = FakeTask()
+        try:
+            index.last_check = 0
+            self.assertIsNone(index.lookup(u'1 Yeates 1', 1790, 1800))
+            self.assertEqual(queued, [])
+            # The rebuild failed, or the lock expired.
+            cache.delete(REBUILD_LOCK_KEY)
+            index.last_check = 0
+            self.assertIsNone(index.lookup(u'1 Yeates 1', 1790, 1800))
+            self.assertEqual(queued, [True])
+        finally:
+            tasks.rebuild_citation_index = rebuild_citation_index
+
+    def test_full_overlay_stops_lookups(self):
+        """Once too many documents have changed, is Solr asked instead?"""
+        build_citation_index(self.path)
+        index = CitationIndex(self.path, max_overlay_documents=1)
+        self.assertEqual(index.lookup(u'1 Yeates 1', 1790, 1800), [])
+        self.make_document(u'1 Yeates 1', date(1795, 6, 9))
+        self.make_document(u'2 Yeates 1', date(1795, 6, 9))
+        index.sync_changes()
+        self.assertIsNone(index.lookup(u'1 Yeates 1', 1790, 1800))
+        self.assertEqual(index.overlay, {})
+
+        # Until the file is rebuilt.
+        build_citation_index(self.path)
+        index.last_check = 0
+        self.assertEqual(len(index.lookup(u'1 Yeates 1', 1790, 1800)), 1)
+
+
+class BatchSolr(FakeSolr):
+    """Answers the combined query of match_citations with counts that are set
+    up front, and the docs it was made with, and every other query with
+    nothing.
+    """
+    def __init__(self, counts, docs):
+        super(BatchSolr, self).__init__(docs)
+        self.counts = counts
+
+    def respond(self, params):
+        if params.get('fl') != match_citations.BATCH_FIELDS:
+            return []
+        return FakeSolrResponse(self.docs, [
+            (clause, self.counts.get(clause.split(' AND ')[0], 0))
+            for clause in params['facet.query']])
+
+
+class BatchMatchingTest(TestCase):
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        # Without an index file every citation goes to Solr.
+        self.citation_index = match_citations.citation_index
+        match_citations.citation_index = CitationIndex(
+            os.path.join(self.tmp_dir, 'citation_index'))
+        self.citing_doc = Document(date_filed=date(1982, 6, 9))
+
+    def tearDown(self):
+        match_citations.citation_index = self.citation_index
+        shutil.rmtree(self.tmp_dir)
+
+    def make_citation(self, volume, page, court=None):
+        return find_citations.Citation('Yeates', page, volume, year=1795,
+                                       court=court)
+
+    def test_hits_are_matched_by_their_citations(self):
+        """Is each hit of the combined query given to the citation it has,
+        rather than one its citation merely looks like?"""
+        d1 = {'id': 1, 'citation': u'11 Yeates 1, 1 Yeates 5 (test 1795)',
+              'dateFiled': datetime(1795, 6, 9), 'court_id': 'test'}
+        d2 = {'id': 2, 'citation': u'2 Yeates 7', 'lexisCite': u'1 Yeates 1',
+              'dateFiled': datetime(1795, 6, 9), 'court_id': 'test'}
+        solr = BatchSolr({'citation:"1 Yeates 5"': 1,
+                         'citation:"1 Yeates 1"': 1,
+                         'citation:"2 Yeates 7"': 1}, [d1, d2])
+        pairs = [(self.make_citation(1, 5), self.citing_doc),
+                 (self.make_citation(1, 1), self.citing_doc),
+                 (self.make_citation(3, 3), self.citing_doc)]
+        matches = match_citations.match_citations(pairs, solr)
+
+        self.assertEqual(matches, [([d1], True), ([d2], True), ([], False)])
+        # One query for all of them.
+        self.assertEqual(len(solr.queries), 1)
+        fq = solr.queries[0]['fq']
+        self.assertEqual(fq[0], 'status:Precedential')
+        self.assertEqual(fq[1].count(' OR '), 2)
+
+    def test_unresolved_hits_are_looked_up(self):
+        """If the hit can't be told apart, or isn't in range, is the citation
+        looked up on its own?"""
+        d1 = {'id': 1, 'citation': u'1 Yeates 5',
+              'dateFiled': datetime(1795, 6, 9), 'court_id': 'other'}
+        solr = BatchSolr({'citation:"1 Yeates 5"': 1}, [d1])
+        pairs = [(self.make_citation(1, 5, court='test'), self.citing_doc)]
+        self.assertEqual(match_citations.match_citations(pairs, solr),
+                         [([], False)])
+        self.assertEqual(len(solr.queries), 2)
+        self.assertIn('citation:"1 Yeates 5"', solr.queries[1]['fq'])
+
 
 class MatchingTest(TestCase):
     fixtures = ['test_court.json']
@@ -122,7 +122,7 @@ def get_dup_stats(doc):
             - Similarity of docket number
             - Comparison of content length
     """
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
     DEBUG = True
 
     ##########################################
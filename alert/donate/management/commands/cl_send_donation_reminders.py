@@ -1,8 +1,9 @@
 from django.core.mail import EmailMultiAlternatives
 from django.core.management.base import BaseCommand
 from django.db.models import Sum
-from django.template import loader, Context
+from django.template import Context
 from django.utils.timezone import now
+from alert.lib.mail import get_template, send_messages_in_batches
 from alert.search.models import Document, Court
 from alert.stats import Stat
 from alert.userHandling.models import UserProfile
@@ -33,14 +34,14 @@ class Command(BaseCommand):
             donation__date_created__day=about_a_year_ago.day,
             donation__send_annual_reminder=True,
             donation__status=4
-        ).annotate(Sum('donation__amount'))
+        ).annotate(Sum('donation__amount')).select_related('user')
 
-    def send_reminder_email(self, up, amount):
-        """Send an email imploring the person for another donation."""
+    def make_reminder_email(self, up, amount):
+        """Make an email imploring the person for another donation."""
         email_subject = "Please donate again to Free Law Project"
         email_sender = "CourtListener <mike@courtlistener.com>"
-        txt_template = loader.get_template('donate/reminder_email.txt')
-        html_template = loader.get_template('donate/reminder_email.html')
+        txt_template = get_template('donate/reminder_email.txt')
+        html_template = get_template('donate/reminder_email.html')
         c = Context({
             'amount': amount,
             'new_doc_count': self.new_doc_count,
@@ -57,11 +58,12 @@ class Command(BaseCommand):
             [up.user.email],
         )
         msg.attach_alternative(html, 'text/html')
-        msg.send(fail_silently=False)
+        return msg
 
     def handle(self, *args, **options):
         self.verbosity = int(options.get('verbosity', 1))
         self.gather_stats_and_ups()
-        for up in self.ups:
-            # Iterate over the people and send them emails
-            self.send_reminder_email(up, up.donation__amount__sum)
+        # Make an email for each of the people, and send them all together
+        messages = [self.make_reminder_email(up, up.donation__amount__sum)
+                    for up in self.ups]
+        send_messages_in_batches(messages)
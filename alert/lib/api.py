@@ -1,6 +1,7 @@
 import re
 import time
 from django.core.cache import cache
+from django.db import models
 from lxml import etree
 from tastypie import http
 from tastypie.authentication import BasicAuthentication
@@ -8,8 +9,9 @@ from tastypie.resources import ModelResource
 from tastypie.throttle import CacheThrottle
 
 from alert import settings
+from alert.lib import search_utils
 from alert.lib.string_utils import filter_invalid_XML_chars
-from alert.lib.sunburnt import SolrError, sunburnt
+from alert.lib.sunburnt import SolrError
 from alert.stats import tally_stat
 
 good_time_filters = ('exact', 'gte', 'gt', 'lte', 'lt', 'range',
@@ -18,10 +20,119 @@ good_date_filters = good_time_filters[:-3]
 numerical_filters = ('exact', 'gte', 'gt', 'lte', 'lt', 'range',)
 
 
+def is_list_request(request):
+    """Is the request for a list of objects, rather than a single one?"""
+    match = getattr(request, 'resolver_match', None)
+    return match is not None and match.url_name == 'api_dispatch_list'
+
+
+def get_select_related(queryset):
+    """Get the paths a queryset already selects related objects on.
+
+    Calling select_related again replaces them, so they have to be passed
+    along with any new ones.
+    """
+    def walk(tree, prefix):
+        for name, subtree in tree.iteritems():
+            path = prefix + name
+            if subtree:
+                for subpath in walk(subtree, path + '__'):
+                    yield subpath
+            else:
+                yield path
+    select_related = queryset.query.select_related
+    if isinstance(select_related, dict):
+        return list(walk(select_related, ''))
+    return []
+
+
 class ModelResourceWithFieldsFilter(ModelResource):
     def __init__(self, tally_name=None):
         super(ModelResourceWithFieldsFilter, self).__init__()
         self.tally_name = tally_name
+        # Fields that aren't asked for with the fields parameter aren't
+        # dehydrated at all. Tastypie asks use_in whether to dehydrate a
+        # field, so each field's use_in is wrapped with that check.
+        self.field_use_in = {}
+        for field_name, field_object in self.fields.items():
+            self.field_use_in[field_name] = field_object.use_in
+            field_object.use_in = self.make_use_in(field_name)
+
+    def make_use_in(self, field_name):
+        original_use_in = self.field_use_in[field_name]
+
+        def use_in(bundle):
+            requested = self.get_requested_fields(bundle.request)
+            if requested is not None and field_name not in requested:
+                return False
+            if callable(original_use_in):
+                return original_use_in(bundle)
+            for_list = getattr(bundle, 'for_list', False)
+            return original_use_in in ('all', 'list' if for_list else 'detail')
+        return use_in
+
+    @staticmethod
+    def get_requested_fields(request):
+        """Get the names of the fields asked for with the fields parameter,
+        or None if it wasn't used.
+        """
+        fields = request.GET.get("fields", "")
+        if fields:
+            return set(re.split(',|__', fields))
+        return None
+
+    def get_dehydrated_fields(self, request, for_list):
+        """Get the fields that will be dehydrated for the request, as a dict
+        of names and field objects.
+        """
+        requested = self.get_requested_fields(request)
+        modes = ('all', 'list' if for_list else 'detail')
+        dehydrated = {}
+        for field_name, field_object in self.fields.items():
+            if requested is not None and field_name not in requested:
+                continue
+            use_in = self.field_use_in[field_name]
+            if callable(use_in):
+                # Decided per bundle, so assume it's used.
+                pass
+            elif use_in not in modes:
+                continue
+            dehydrated[field_name] = field_object
+        return dehydrated
+
+    def project_fields(self, object_list, request):
+        """Only load what will be dehydrated for the request.
+
+        Text columns that won't be dehydrated, which include the full text of
+        documents, are deferred, and related objects that will be are
+        selected in the same query.
+        """
+        dehydrated = self.get_dehydrated_fields(request,
+                                                is_list_request(request))
+        attributes = set()
+        related = []
+        for field_object in dehydrated.values():
+            attribute = getattr(field_object, 'attribute', None)
+            if not isinstance(attribute, basestring):
+                continue
+            attributes.add(attribute)
+            if getattr(field_object, 'dehydrated_type', None) == 'related' \
+                    and not getattr(field_object, 'is_m2m', False):
+                related.append(attribute)
+        if related and object_list.query.select_related is not True:
+            object_list = object_list.select_related(
+                *set(get_select_related(object_list) + related))
+        deferred = [field.name for field in object_list.model._meta.fields
+                    if isinstance(field, models.TextField) and
+                    field.name not in attributes]
+        if deferred:
+            object_list = object_list.defer(*deferred)
+        return object_list
+
+    def get_object_list(self, request):
+        object_list = super(ModelResourceWithFieldsFilter,
+                            self).get_object_list(request)
+        return self.project_fields(object_list, request)
 
     def _handle_500(self, request, exception):
         # Note that this will only be run if DEBUG=False
@@ -50,8 +161,9 @@ class ModelResourceWithFieldsFilter(ModelResource):
 
         return data
 
-    def full_dehydrate(self, bundle, *args, **kwargs):
-        bundle = super(ModelResourceWithFieldsFilter, self).full_dehydrate(bundle, *args, **kwargs)
+    def full_dehydrate(self, bundle, for_list=False):
+        bundle.for_list = for_list
+        bundle = super(ModelResourceWithFieldsFilter, self).full_dehydrate(bundle, for_list=for_list)
         # bundle.obj[0]._data['citeCount'] = 0
         fields = bundle.request.GET.get("fields", "")
         if fields:
@@ -104,12 +216,52 @@ class BasicAuthenticationWithUser(BasicAuthentication):
 
 
 class PerUserCacheThrottle(CacheThrottle):
-    """Sets up higher throttles for specific users"""
+    """Sets up higher throttles for specific users
+
+    Rather than a list of the time of every access, which has to be read,
+    filtered and written back on every request and grows with the limit, each
+    user has a fixed number of counters in the cache, one per slice of the
+    timeframe. An access increments the counter of the current slice, and the
+    accesses in the timeframe are the sum of the counters it covers, counting
+    the slice it only partly covers in proportion. Either way, a request costs
+    the same no matter how high the user's limit is.
+    """
     custom_throttles = {
         'scout': 10000,
         'scout_test': 10000,
         'mlissner': 1e9,  # A billion because I made this.
     }
+    # How many slices the timeframe is cut into.
+    buckets = 10
+
+    def now(self):
+        return time.time()
+
+    def get_bucket_width(self):
+        return max(1, int(self.timeframe) // self.buckets)
+
+    def get_bucket_key(self, identifier, bucket):
+        return '%s_%s' % (self.convert_identifier_to_key(identifier), bucket)
+
+    def count_accesses(self, identifier):
+        """Count the accesses by identifier in the last timeframe."""
+        width = self.get_bucket_width()
+        now = self.now()
+        current = int(now) // width
+        # The timeframe covers the current slice and the ones before it, and
+        # ends part of the way into the oldest one.
+        oldest = current - int(self.timeframe) // width
+        keys = dict((self.get_bucket_key(identifier, bucket), bucket)
+                    for bucket in range(oldest, current + 1))
+        counts = cache.get_many(keys.keys())
+        oldest_fraction = 1 - (now - current * width) / float(width)
+        accesses = 0
+        for key, count in counts.iteritems():
+            if keys[key] == oldest:
+                accesses += count * oldest_fraction
+            else:
+                accesses += count
+        return accesses
 
     def should_be_throttled(self, identifier, **kwargs):
         """
@@ -118,30 +270,31 @@ class PerUserCacheThrottle(CacheThrottle):
 
         Returns whether or not the user has exceeded their throttle limit.
 
-        Maintains a list of timestamps when the user accessed the api within
-        the cache.
-
         Returns ``False`` if the user should NOT be throttled or ``True`` if
         the user should be throttled.
         """
-        key = self.convert_identifier_to_key(identifier)
-
-        # Make sure something is there.
-        cache.add(key, [])
-
-        # Weed out anything older than the timeframe.
-        minimum_time = int(time.time()) - int(self.timeframe)
-        times_accessed = [access for access in cache.get(key) if access >= minimum_time]
-        cache.set(key, times_accessed, self.expiration)
-
         throttle_at = self.custom_throttles.get(identifier, int(self.throttle_at))
-        if len(times_accessed) >= throttle_at:
+        if self.count_accesses(identifier) >= throttle_at:
             # Throttle them.
             return True
 
         # Let them through.
         return False
 
+    def accessed(self, identifier, **kwargs):
+        """Count an access by identifier in the counter of the current slice
+        of time.
+        """
+        width = self.get_bucket_width()
+        key = self.get_bucket_key(identifier, int(self.now()) // width)
+        # Keep the counter until the timeframe no longer covers it.
+        cache.add(key, 0, int(self.timeframe) + width)
+        try:
+            cache.incr(key)
+        except ValueError:
+            # It expired in between.
+            cache.set(key, 1, int(self.timeframe) + width)
+
 
 class SolrList(object):
     """This implements a yielding list object that fetches items as they are
@@ -157,11 +310,9 @@ class SolrList(object):
         self.type = type
         self._item_cache = []
         if self.type == 'o':
-            self.conn = sunburnt.SolrInterface(
-                settings.SOLR_OPINION_URL, mode='r')
+            self.url = settings.SOLR_OPINION_URL
         elif self.type == 'oa':
-            self.conn = sunburnt.SolrInterface(
-                settings.SOLR_AUDIO_URL, mode='r')
+            self.url = settings.SOLR_AUDIO_URL
 
     def __len__(self):
         """Tastypie's paginator takes the len() of the item for its work."""
@@ -169,8 +320,8 @@ class SolrList(object):
             mq = self.main_query.copy()  # local copy for manipulation
             mq['rows'] = 0  # For performance, we just want the count
             mq['caller'] = 'api_search_count'
-            r = self.conn.raw_query(**mq).execute()
-            self.length = r.result.numFound
+            r = search_utils.get_search_results(self.url, mq)
+            self.length = r['numFound']
         return self.length
 
     def __iter__(self):
@@ -182,19 +333,20 @@ class SolrList(object):
 
     def __getitem__(self, item):
         self.main_query['start'] = self.offset
-        results_si = self.conn.raw_query(**self.main_query).execute()
+        results = search_utils.get_search_results(self.url, self.main_query)
 
         # Set the length if it's not yet set.
         if self.length is None:
-            self.length = results_si.result.numFound
+            self.length = results['numFound']
 
         # Pull the text snippet up a level, where tastypie can find it
-        for result in results_si.result.docs:
-            result['snippet'] = '&hellip;'.join(
-                result['solr_highlights']['text'])
+        for result in results['docs']:
+            if 'solr_highlights' in result:
+                result['snippet'] = '&hellip;'.join(
+                    result['solr_highlights']['text'])
 
         # Return the results as objects, not dicts.
-        for result in results_si.result.docs:
+        for result in results['docs']:
             self._item_cache.append(SolrObject(initial=result))
 
         # Now, assuming our _item_cache is all set, we just get the item.
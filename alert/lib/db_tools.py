@@ -1,10 +1,111 @@
+import uuid
 from datetime import timedelta
 from alert import settings
+from django.db import connection
+
+
+def _server_side_rows(queryset, chunksize):
+    """Run the queryset's SQL with a named (server-side) Postgres cursor,
+    yielding its rows a chunk at a time.
+
+    Outside of a transaction, named cursors have to be declared WITH HOLD, so
+    Postgres keeps the results on its side when the statement completes.
+    Either way, only chunksize rows are ever held here.
+    """
+    sql, params = queryset.query.sql_with_params()
+    # Make sure the connection is open before using it directly.
+    connection.cursor()
+    cursor = connection.connection.cursor(
+        name='keyset_%s' % uuid.uuid4().hex, withhold=True)
+    cursor.itersize = chunksize
+    try:
+        cursor.execute(sql, params)
+        while True:
+            rows = cursor.fetchmany(chunksize)
+            if not rows:
+                break
+            yield rows
+    finally:
+        cursor.close()
+
+
+def keyset_chunks(queryset, chunksize=1000, fields=None, flat=False,
+                  prefetch=(), start_pk=None, server_side=False):
+    """Iterate over a queryset in order of pk, a list of chunksize items at a
+    time.
+
+    Each chunk is fetched with a query that picks up after the last pk of the
+    one before it, so, unlike an offset, later chunks are as quick to get as
+    the first ones, and no counting is needed up front.
+
+    fields works like the arguments to values_list, so you only get the
+    columns you need. Otherwise you get model instances, and the only(),
+    defer() and select_related() of the queryset are respected.
+
+    prefetch is a list of lookups for prefetch_related, run once per chunk.
+    Items with a pk greater than start_pk are returned, if it's given.
+
+    With server_side, the query is run once on Postgres with a named cursor,
+    and its rows are streamed back a chunk at a time. When model instances
+    are wanted, only their pks are streamed, and the instances are fetched a
+    chunk at a time. On other databases this falls back to the normal method.
+    """
+    if settings.DEVELOPMENT:
+        chunksize = 5
+
+    queryset = queryset.prefetch_related(None).order_by('pk')
+    if start_pk is not None:
+        queryset = queryset.filter(pk__gt=start_pk)
+    server_side = server_side and connection.vendor == 'postgresql'
+
+    if fields:
+        if server_side:
+            rows = queryset.values_list(*fields)
+            for chunk in _server_side_rows(rows, chunksize):
+                yield [row[0] for row in chunk] if flat else chunk
+            return
+        # Get the pk first in every row, to know where the next chunk starts.
+        rows = queryset.values_list('pk', *fields)
+        last_pk = None
+        while True:
+            if last_pk is None:
+                chunk = list(rows[:chunksize])
+            else:
+                chunk = list(rows.filter(pk__gt=last_pk)[:chunksize])
+            if not chunk:
+                return
+            last_pk = chunk[-1][0]
+            yield [row[1] if flat else row[1:] for row in chunk]
+        return
+
+    if prefetch:
+        queryset = queryset.prefetch_related(*prefetch)
+    if server_side:
+        pks = queryset.values_list('pk')
+        for chunk in _server_side_rows(pks, chunksize):
+            yield list(queryset.filter(pk__in=[row[0] for row in chunk]))
+        return
+    last_pk = None
+    while True:
+        if last_pk is None:
+            chunk = list(queryset[:chunksize])
+        else:
+            chunk = list(queryset.filter(pk__gt=last_pk)[:chunksize])
+        if not chunk:
+            return
+        last_pk = chunk[-1].pk
+        yield chunk
+
+
+def keyset_iterator(queryset, chunksize=1000, **kwargs):
+    """Like keyset_chunks, but yielding one item at a time."""
+    for chunk in keyset_chunks(queryset, chunksize, **kwargs):
+        for item in chunk:
+            yield item
 
 
 def queryset_generator(queryset, chunksize=1000):
     """
-    from: http://djangosnippets.org/snippets/1949/
     Iterate over a Django Queryset ordered by the primary key
 
     This method loads a maximum of chunksize (default: 1000) rows in its
@@ -13,25 +114,9 @@ def queryset_generator(queryset, chunksize=1000):
     classes.
 
     Note that the implementation of the iterator does not support ordered query
-    sets.
+    sets. New code should use keyset_iterator.
     """
-    if settings.DEVELOPMENT:
-        chunksize = 5
-
-    # Make a query that doesn't do related fetching for optimization
-    bare_qs = queryset.prefetch_related(None)
-    if bare_qs.count() == 0:
-        return
-    pk = bare_qs.order_by('pk')[0].pk
-    # Decrement pk for use with 'greater than' filter
-    if pk > 0:
-        pk -= 1
-    last_pk = bare_qs.order_by('-pk')[0].pk
-    queryset = bare_qs.order_by('pk')
-    while pk < last_pk:
-        for row in queryset.filter(pk__gt=pk)[:chunksize]:
-            pk = row.pk
-            yield row
+    return keyset_iterator(queryset, chunksize=chunksize)
 
 
 def queryset_generator_by_date(queryset, date_field, start_date, end_date, chunksize=7):
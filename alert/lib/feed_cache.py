@@ -0,0 +1,118 @@
+import hashlib
+
+from django.core.cache import cache
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_http_date_safe
+
+# Rendered feeds are kept for this long, unless something in them is indexed
+# first.
+FEED_CACHE_TIMEOUT = 60 * 60 * 6
+
+# Feeds are cached under generation numbers that are bumped when items are
+# indexed. 'all' covers feeds of every court, and is bumped whenever anything
+# is indexed. A court's covers the feeds of that court alone. 'everything'
+# covers every feed, and is bumped when what was indexed isn't known.
+FEED_GENERATION_KEY = 'feed-generation-%s'
+ALL_COURTS = 'all'
+EVERYTHING = 'everything'
+# How long the generations are kept. They have to outlive the feeds cached
+# under them, and a timeout of None is the cache's default, not forever.
+FEED_GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
+
+def get_feed_generations(scope):
+    keys = [FEED_GENERATION_KEY % EVERYTHING, FEED_GENERATION_KEY % scope]
+    generations = cache.get_many(keys)
+    return tuple(generations.get(key, 0) for key in keys)
+
+
+def bump_feed_generation(scope):
+    key = FEED_GENERATION_KEY % scope
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.set(key, 1, FEED_GENERATION_TIMEOUT)
+
+
+def invalidate_feeds(court_ids=None):
+    """Make the cached feeds with items from the courts stale, or every
+    cached feed if the courts aren't known.
+    """
+    if court_ids is None:
+        bump_feed_generation(EVERYTHING)
+    else:
+        bump_feed_generation(ALL_COURTS)
+        for court_id in set(court_ids):
+            bump_feed_generation(court_id)
+
+
+def etag_matches(etag, if_none_match):
+    if if_none_match.strip() == '*':
+        return True
+    return etag in [tag.strip() for tag in if_none_match.split(',')]
+
+
+class CachedFeedMixin(object):
+    """Keep the rendered XML of a feed in the cache, and answer conditional
+    GETs.
+
+    Feed readers poll constantly, and most of the time nothing has changed.
+    The feed is rendered once and then served from the cache, with an ETag of
+    its content and the Last-Modified of its newest item, until items are
+    indexed for its court. Readers that send If-None-Match or
+    If-Modified-Since get a 304 when they're up to date, without a query
+    being made.
+
+    Use it before Feed in the bases of a feed.
+    """
+    def get_feed_court(self, *args, **kwargs):
+        """Get the court the feed is of, or None if it has items from every
+        court.
+        """
+        return None
+
+    def get_feed_cache_key(self, request, args, kwargs):
+        court = self.get_feed_court(*args, **kwargs)
+        return 'feed-%s' % hashlib.md5(repr((
+            self.__class__.__name__,
+            args,
+            sorted(kwargs.items()),
+            sorted(request.GET.lists()),
+            get_feed_generations(court or ALL_COURTS),
+        ))).hexdigest()
+
+    def __call__(self, request, *args, **kwargs):
+        key = self.get_feed_cache_key(request, args, kwargs)
+        feed = cache.get(key)
+        if feed is None:
+            response = super(CachedFeedMixin, self).__call__(request, *args,
+                                                             **kwargs)
+            feed = {
+                'content': response.content,
+                'content_type': response['Content-Type'],
+                'etag': '"%s"' % hashlib.md5(response.content).hexdigest(),
+                'last_modified': response.get('Last-Modified'),
+            }
+            cache.set(key, feed, FEED_CACHE_TIMEOUT)
+
+        if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+        if_modified_since = parse_http_date_safe(
+            request.META.get('HTTP_IF_MODIFIED_SINCE', ''))
+        if if_none_match is not None:
+            not_modified = etag_matches(feed['etag'], if_none_match)
+        elif if_modified_since is not None and feed['last_modified']:
+            last_modified = parse_http_date_safe(feed['last_modified'])
+            not_modified = (last_modified is not None and
+                            last_modified <= if_modified_since)
+        else:
+            not_modified = False
+
+        if not_modified:
+            response = HttpResponseNotModified()
+        else:
+            response = HttpResponse(feed['content'],
+                                    content_type=feed['content_type'])
+        response['ETag'] = feed['etag']
+        if feed['last_modified']:
+            response['Last-Modified'] = feed['last_modified']
+        return response
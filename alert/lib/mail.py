@@ -0,0 +1,57 @@
+from multiprocessing.pool import ThreadPool
+
+from django.core.mail import get_connection
+from django.template import loader
+
+from alert.lib.sunburnt.sunburnt import grouper
+
+# How many messages are sent over a connection in one go.
+MAIL_BATCH_SIZE = 100
+# How many connections send at the same time.
+MAIL_CONNECTIONS = 4
+
+_templates = {}
+
+
+def get_template(template_name):
+    """Get a compiled template, compiling it only once per process."""
+    template = _templates.get(template_name)
+    if template is None:
+        template = _templates[template_name] = loader.get_template(
+            template_name)
+    return template
+
+
+def send_messages_in_batches(messages, batch_size=MAIL_BATCH_SIZE,
+                             connections=MAIL_CONNECTIONS,
+                             fail_silently=False):
+    """Send a list of EmailMessages, returning how many were sent.
+
+    Opening a connection to the mail server for every message is what makes
+    sending lots of them slow. Instead, the messages are split between a few
+    connections, which are each opened once and send their share batch_size
+    messages at a time.
+    """
+    batches = list(grouper(messages, batch_size))
+    if not batches:
+        return 0
+    connections = max(1, min(connections, len(batches)))
+    shares = [batches[i::connections] for i in range(connections)]
+
+    def send_share(share):
+        connection = get_connection(fail_silently=fail_silently)
+        connection.open()
+        try:
+            return sum(connection.send_messages(batch) or 0
+                       for batch in share)
+        finally:
+            connection.close()
+
+    if connections == 1:
+        return send_share(shares[0])
+    pool = ThreadPool(connections)
+    try:
+        return sum(pool.map(send_share, shares))
+    finally:
+        pool.close()
+        pool.join()
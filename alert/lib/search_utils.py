@@ -1,10 +1,25 @@
+import hashlib
+import re
+from datetime import date
 from urllib import urlencode
 from urlparse import parse_qs
+from django.core.cache import cache
 from django.utils.timezone import now
 
 from alert.lib import sunburnt
+from alert.lib.feed_cache import invalidate_feeds
+from alert.lib.sunburnt.schema import solr_date
 from django.conf import settings
 
+# Search results are cached for this long, unless something is committed to
+# the index first, which bumps the generation and leaves them behind.
+SEARCH_CACHE_TIMEOUT = 60 * 60
+INDEX_GENERATION_KEY = 'search-index-generation'
+# How long the generation is kept. It has to outlive the results cached under
+# it, or they'd be served again when it starts over. A timeout of None is the
+# cache's default, not forever.
+INDEX_GENERATION_TIMEOUT = 60 * 60 * 24 * 30
+
 
 def make_get_string(request, nuke_fields=None):
     """Makes a get string from the request object. If necessary, it removes
@@ -24,6 +39,300 @@ def make_get_string(request, nuke_fields=None):
     return get_string
 
 
+def get_index_generation():
+    generation = cache.get(INDEX_GENERATION_KEY)
+    if generation is None:
+        generation = 1
+        cache.add(INDEX_GENERATION_KEY, generation, INDEX_GENERATION_TIMEOUT)
+    return generation
+
+
+def bump_index_generation():
+    """Make every cached search result stale."""
+    try:
+        cache.incr(INDEX_GENERATION_KEY)
+    except ValueError:
+        # Not there. Anything will do that isn't the default.
+        cache.set(INDEX_GENERATION_KEY, 2, INDEX_GENERATION_TIMEOUT)
+
+
+def commit_index(si, court_ids=None):
+    """Commit the changes sent to Solr, and stop serving the search results
+    cached from before them.
+
+    If the courts of the items changed are given, only the cached feeds of
+    those courts are thrown away, rather than all of them.
+    """
+    si.commit()
+    bump_index_generation()
+    invalidate_feeds(court_ids)
+
+
+def make_cache_key(prefix, *args):
+    return '%s-%s' % (prefix, hashlib.md5(repr(args)).hexdigest())
+
+
+def normalize_params(params):
+    return sorted((k, unicode(v)) for k, v in params.items())
+
+
+def get_search_results(url, params):
+    """Run a raw query against the Solr core at url, or get its results from
+    the cache.
+
+    Queries are the same when their params are, so the key is made from the
+    params, which are built from the cleaned data of the search form. It
+    doesn't matter what order things were in the GET string, or what else was
+    in it. The key also has the index generation, so results go stale as soon
+    as anything is committed.
+
+    Deep pages are fetched with a cursor when there's one for them, see
+    execute_with_cursor.
+
+    Returns a dict with the docs, the number of results found and the facet
+    fields, which is what callers need from the response.
+    """
+    generation = get_index_generation()
+    key = make_cache_key('search-results', generation, url,
+                         normalize_params(params))
+    results = cache.get(key)
+    if results is None:
+        results = execute_with_cursor(url, params)
+        cache.set(key, results, SEARCH_CACHE_TIMEOUT)
+    return results
+
+
+# Sorts where a cursor is of no use, because the values sorted on can't be
+# filtered on.
+UNCURSORABLE_SORT_RE = re.compile(r'score|\(|random')
+# The fields every result has a value for. The range queries of a cursor
+# never match results that are missing a value for a field they sort on, so
+# cursors are only used for sorts on these.
+FIELDS_WITH_VALUES = ('id', 'citeCount')
+
+
+def get_cursor_sort(sort):
+    """Turn a sort param into a list of (field, direction) tuples with id as
+    the final tie breaker, so that every result has a unique place in the
+    order. Returns None if the sort can't be used with a cursor.
+    """
+    if not sort or UNCURSORABLE_SORT_RE.search(sort):
+        return None
+    sort_fields = []
+    for clause in sort.split(','):
+        parts = clause.split()
+        if len(parts) != 2 or parts[1] not in ('asc', 'desc'):
+            return None
+        sort_fields.append((parts[0], parts[1]))
+    if 'id' not in [field for field, direction in sort_fields]:
+        sort_fields.append(('id', 'asc'))
+    return sort_fields
+
+
+def has_values(sort_fields):
+    """Does every result have a value for all of sort_fields?"""
+    return all(field in FIELDS_WITH_VALUES for field, _ in sort_fields)
+
+
+def to_solr_value(value):
+    """Quote a value from a result so it can go in a query."""
+    if isinstance(value, (int, long, float)):
+        return unicode(value)
+    if isinstance(value, date):
+        value = unicode(solr_date(value))
+    return u'"%s"' % unicode(value).replace('\\', '\\\\').replace('"', '\\"')
+
+
+def make_cursor_query(sort_fields, values):
+    """Make a filter query for the results that come after values in the
+    order of sort_fields.
+
+    This is the same as a cursorMark, for a Solr that predates them: a result
+    comes after the last one if it's past it on the first field, or equal on
+    the first and past it on the second, and so on. The filter isn't worth
+    caching, since every page has its own.
+    """
+    clauses = []
+    for i, (field, direction) in enumerate(sort_fields):
+        terms = [u'%s:%s' % (equal_field, to_solr_value(value)) for
+                 (equal_field, _), value in zip(sort_fields[:i], values[:i])]
+        if direction == 'asc':
+            terms.append(u'%s:{%s TO *]' % (field, to_solr_value(values[i])))
+        else:
+            terms.append(u'%s:[* TO %s}' % (field, to_solr_value(values[i])))
+        clauses.append(u'(%s)' % u' AND '.join(terms))
+    return u'{!cache=false tag=cursor}%s' % u' OR '.join(clauses)
+
+
+def exclude_cursor_from_facet(facet_field):
+    """Make a facet count results on earlier pages, too."""
+    m = re.match(r'\{!ex=([^}]*)\}(.*)', facet_field)
+    if m:
+        return u'{!ex=%s,cursor}%s' % m.groups()
+    return u'{!ex=cursor}%s' % facet_field
+
+
+def add_sort_fields_to_fl(params, sort_fields):
+    """Make sure the sort fields are returned, since they're needed to make
+    the next cursor.
+    """
+    if 'fl' in params:
+        fl = params['fl'].split(',')
+        missing = [field for field, _ in sort_fields if field not in fl]
+        if missing and '*' not in fl:
+            params['fl'] = ','.join(fl + missing)
+
+
+def get_cursor_key(url, params, start):
+    return make_cache_key('search-cursor', url, start,
+                          normalize_params(dict(
+                              (k, v) for k, v in params.items()
+                              if k not in ('start', 'rows'))))
+
+
+def execute_with_cursor(url, params):
+    """Run a query, using a cursor for its start if there is one.
+
+    Solr has to collect and sort every result before start to find a page,
+    which makes deep pages slow. Each time a page of a query with a sort
+    that allows it is fetched, the sort values of its last result are kept
+    as the cursor for the page after it. When that page is asked for, it's
+    fetched from the start of the results that come after the cursor, which
+    costs the same as the first page. Crawlers and people paging through
+    results one page after another get every page that way.
+
+    Only sorts on fields that every result has a value for can use a
+    cursor; the rest are fetched from their start every time.
+
+    Cursors outlast commits to the index. A page fetched with one starts
+    right after the last result of the page before, even if results have
+    been added since, which is what someone paging through wants.
+    """
+    sort_fields = get_cursor_sort(params.get('sort'))
+    if sort_fields is not None and not has_values(sort_fields):
+        # Results without a date, say, would be left off every page fetched
+        # with a cursor.
+        sort_fields = None
+    start = int(params.get('start') or 0)
+    query_params = params.copy()
+    cursor = None
+    if sort_fields is not None:
+        # Break ties the same way on every page.
+        query_params['sort'] = ','.join('%s %s' % sort_field
+                                        for sort_field in sort_fields)
+        if start > 0:
+            cursor = cache.get(get_cursor_key(url, params, start))
+    if cursor is not None:
+        fq = params.get('fq', [])
+        if isinstance(fq, basestring):
+            fq = [fq]
+        query_params['fq'] = list(fq) + [make_cursor_query(sort_fields,
+                                                            cursor)]
+        query_params['start'] = 0
+        if 'facet.field' in params:
+            query_params['facet.field'] = exclude_cursor_from_facet(
+                params['facet.field'])
+    if sort_fields is not None:
+        add_sort_fields_to_fl(query_params, sort_fields)
+
+    conn = sunburnt.get_solr_interface(url, mode='r')
+    response = conn.raw_query(**query_params).execute()
+    docs = response.result.docs
+    num_found = response.result.numFound
+    if cursor is not None:
+        # Count the results skipped over by the cursor, too.
+        num_found += start
+
+    if sort_fields is not None and docs:
+        next_cursor = [docs[-1].get(field) for field, _ in sort_fields]
+        if None not in next_cursor:
+            cache.set(get_cursor_key(url, params, start + len(docs)),
+                      next_cursor, SEARCH_CACHE_TIMEOUT)
+    return {
+        'docs': docs,
+        'numFound': num_found,
+        'facet_fields': response.facet_counts.facet_fields,
+    }
+
+
+def iterate_search_results(url, params, chunksize=1000):
+    """Yield every result of a query, in order, fetching them chunksize at a
+    time with a cursor.
+
+    The query must have a sort that get_cursor_sort can use. A cursor never
+    matches results without a value for a field that's sorted on, so for
+    fields that can be missing, the results that have them are walked first,
+    and then the ones that don't, sorted on the rest of the fields. Nothing
+    is cached, since each chunk is only needed once.
+    """
+    sort_fields = get_cursor_sort(params.get('sort'))
+    if sort_fields is None:
+        raise ValueError("Can't iterate over results sorted by %s" %
+                         params.get('sort'))
+    fq = params.get('fq', [])
+    if isinstance(fq, basestring):
+        fq = [fq]
+    conn = sunburnt.get_solr_interface(url, mode='r')
+    return _iterate_search_results(conn, params, list(fq), sort_fields,
+                                   set(FIELDS_WITH_VALUES), chunksize)
+
+
+def _iterate_search_results(conn, params, fq, sort_fields, present,
+                            chunksize):
+    """Walk the results matching fq, where every one of them has a value for
+    the fields in present.
+    """
+    for field, _ in sort_fields:
+        if field not in present:
+            has_field = u'%s:[* TO *]' % field
+            for doc in _iterate_search_results(
+                    conn, params, fq + [has_field], sort_fields,
+                    present | set([field]), chunksize):
+                yield doc
+            rest = [sort_field for sort_field in sort_fields
+                    if sort_field[0] != field]
+            for doc in _iterate_search_results(
+                    conn, params, fq + [u'-' + has_field], rest, present,
+                    chunksize):
+                yield doc
+            return
+
+    query_params = params.copy()
+    query_params.update({
+        'sort': ','.join('%s %s' % sort_field for sort_field in sort_fields),
+        'start': 0,
+        'rows': chunksize,
+        'fq': fq,
+    })
+    add_sort_fields_to_fl(query_params, sort_fields)
+    while True:
+        docs = conn.raw_query(**query_params).execute().result.docs
+        for doc in docs:
+            yield doc
+        if len(docs) < chunksize:
+            break
+        cursor = [docs[-1][field] for field, _ in sort_fields]
+        query_params['fq'] = fq + [make_cursor_query(sort_fields, cursor)]
+
+
+class SolrResults(object):
+    """One page of search results, that pretends to be all of them so that
+    Django's Paginator can page through them.
+    """
+    def __init__(self, docs, num_found, start):
+        self.docs = docs
+        self.num_found = num_found
+        self.start = start
+
+    def __len__(self):
+        return self.num_found
+
+    def __getitem__(self, k):
+        if isinstance(k, slice):
+            return self.docs[k.start - self.start:k.stop - self.start]
+        return self.docs[k - self.start]
+
+
 def get_string_to_dict(get_string):
     """Reverses the work that the make_get_string function performs, building a
     dict from the get_string.
@@ -397,7 +706,7 @@ def build_main_query(cd, highlight='all', order_by=''):
         if len(selected_courts_string) + len(selected_stats_string) > 0:
             main_fq.extend([
                 '{!tag=dt}status_exact:(%s)' % selected_stats_string,
-                '{!tag=dt}court_exact:(%s)' % selected_courts_string
+                'court_exact:(%s)' % selected_courts_string
             ])
     elif cd['type'] == 'oa':
         if len(selected_courts_string) > 0:
@@ -415,11 +724,28 @@ def build_main_query(cd, highlight='all', order_by=''):
     return main_params
 
 
-def place_facet_queries(cd, conn=sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')):
+def add_status_facet(main_params):
+    """Ask for the counts of the status filters along with the results of
+    the main query, saving the round trip of place_facet_queries.
+
+    The counts leave out the status filter, which is tagged in
+    build_main_query, so they're of what each checkbox would give.
+    """
+    main_params.update({
+        'facet': 'true',
+        'facet.mincount': 0,
+        'facet.field': '{!ex=dt}status_exact',
+    })
+    return main_params
+
+
+def place_facet_queries(cd, conn=None):
     """Get facet values for the status filters
 
     Using the search form, query Solr and get the values for the status filters.
     """
+    if conn is None:
+        conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
     # Build up all the queries needed
     facet_params = {
         'rows': '0',
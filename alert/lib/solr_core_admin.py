@@ -5,7 +5,7 @@ import requests
 import StringIO
 import time
 from alert import settings
-from alert.lib.sunburnt import SolrError
+from alert.lib.sunburnt import SolrError, invalidate_solr_interfaces
 
 
 def create_solr_core(core_name, data_dir='/tmp/solr/data',
@@ -64,6 +64,9 @@ def swap_solr_core(current_core, desired_core):
         'other': desired_core,
     }
     r = requests.get('http://localhost:8983/solr/admin/cores', params=params)
+    # The cores behind our URLs just changed, so cached schemas and
+    # connections are stale.
+    invalidate_solr_interfaces()
     if r.status_code != 200:
         print "Problem swapping cores. Got status_code of %s. Check the Solr " \
               "logs for details." % r.status_code
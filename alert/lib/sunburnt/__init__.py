@@ -1,8 +1,10 @@
 from __future__ import absolute_import
 
 from .strings import RawString
-from .sunburnt import SolrError, SolrInterface
+from .sunburnt import SolrError, SolrInterface, get_solr_interface, \
+    invalidate_solr_interfaces
 
 __version__ = '0.6'
 
-__all__ = ['RawString', 'SolrError', 'SolrInterface']
+__all__ = ['RawString', 'SolrError', 'SolrInterface', 'get_solr_interface',
+           'invalidate_solr_interfaces']
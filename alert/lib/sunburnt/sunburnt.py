@@ -5,6 +5,7 @@ import cStringIO as StringIO
 from itertools import islice
 import logging
 import socket
+import threading
 import time
 import urllib
 import urlparse
@@ -148,7 +149,8 @@ class SolrInterface(object):
     writeable = True
     remote_schema_file = "admin/file/?file=schema.xml"
     def __init__(self, url, schemadoc=None, http_connection=None, mode='',
-                 retry_timeout= -1, max_length_get_url=MAX_LENGTH_GET_URL):
+                 retry_timeout= -1, max_length_get_url=MAX_LENGTH_GET_URL,
+                 schema=None):
         self.conn = SolrConnection(url, http_connection, retry_timeout,
                                    max_length_get_url)
         self.schemadoc = schemadoc
@@ -156,7 +158,12 @@ class SolrInterface(object):
             self.writeable = False
         elif mode == 'w':
             self.readable = False
-        self.init_schema()
+        if schema is not None:
+            # An already parsed schema was provided (see get_solr_interface),
+            # so there's no need to fetch and parse it again.
+            self.schema = schema
+        else:
+            self.init_schema()
 
     @retry((urllib2.URLError, socket.error), 5, 3)
     def init_schema(self):
@@ -283,6 +290,59 @@ class SolrInterface(object):
         return q
 
 
+# Process-wide registry of parsed schemas, keyed by Solr URL, and of
+# per-thread SolrInterface objects, keyed by (URL, mode). httplib2 connections
+# aren't thread safe, so each thread gets its own interfaces, but they all
+# share the parsed schema.
+_schemas = {}
+_registry_lock = threading.Lock()
+_registry_generation = [0]
+_local = threading.local()
+
+
+def _normalize_url(url):
+    return url.rstrip("/") + "/"
+
+
+def get_solr_interface(url, mode=''):
+    """Get a SolrInterface for url and mode from the registry.
+
+    The schema for each URL is fetched and parsed once per process, and the
+    interface (with its keep-alive HTTP connection) is reused for the life of
+    the thread. Use this instead of constructing SolrInterface objects
+    directly.
+    """
+    url = _normalize_url(url)
+    generation = _registry_generation[0]
+    if getattr(_local, 'generation', None) != generation:
+        _local.interfaces = {}
+        _local.generation = generation
+    key = (url, mode)
+    si = _local.interfaces.get(key)
+    if si is None:
+        schema = _schemas.get(url)
+        si = SolrInterface(url, mode=mode, schema=schema)
+        if schema is None:
+            with _registry_lock:
+                _schemas.setdefault(url, si.schema)
+        _local.interfaces[key] = si
+    return si
+
+
+def invalidate_solr_interfaces(url=None):
+    """Drop cached schemas and interfaces, e.g. after a core swap.
+
+    If url is None, the entire registry is invalidated. Interfaces held by
+    other threads are discarded the next time they ask the registry for one.
+    """
+    with _registry_lock:
+        if url is None:
+            _schemas.clear()
+        else:
+            _schemas.pop(_normalize_url(url), None)
+        _registry_generation[0] += 1
+
+
 def grouper(iterable, n):
     """grouper('ABCDEFG', 3) --> [['ABC'], ['DEF'], ['G']]"""
     i = iter(iterable)
@@ -4,6 +4,7 @@ from datetime import date
 from django.test import TestCase
 from alert.audio.models import Audio
 from alert.lib import sunburnt
+from alert.lib.search_utils import commit_index
 from alert.lib.solr_core_admin import create_solr_core, swap_solr_core, \
     delete_solr_core
 from alert.scrapers.management.commands.cl_scrape_oral_arguments import \
@@ -93,8 +94,8 @@ class SolrTestCase(TestCase):
 
         self.expected_num_results_opinion = 3
         self.expected_num_results_audio = 2
-        self.si_opinion.commit()
-        self.si_audio.commit()
+        commit_index(self.si_opinion)
+        commit_index(self.si_audio)
 
     def tearDown(self):
         Document.objects.all().delete()
@@ -159,3 +160,54 @@ class CitationTest(TestCase):
 
     def tearDown(self):
         Document.objects.all().delete()
+
+
+class FakeSolrResponse(object):
+    """Stands in for the response of a query to Solr. It's a list of docs,
+    which are also at result.docs, and has the counts of its facet queries at
+    facet_counts.facet_queries.
+    """
+    def __init__(self, docs=(), facet_queries=()):
+        self.docs = list(docs)
+        self.result = self
+        self.facet_counts = self
+        self.facet_queries = list(facet_queries)
+
+    def __len__(self):
+        return len(self.docs)
+
+    def __iter__(self):
+        return iter(self.docs)
+
+
+class FakeSolrQuery(object):
+    def __init__(self, response):
+        self.response = response
+
+    def execute(self):
+        return self.response
+
+
+class FakeSolr(object):
+    """Stands in for a connection to Solr, for tests that don't need a real
+    one.
+
+    The params of every raw_query are kept in queries. Each one is answered
+    by respond, which by default gives the docs and facet query counts this
+    was made with. Override it to answer according to the params; it can
+    return a FakeSolrResponse, or just a list of docs.
+    """
+    def __init__(self, docs=(), facet_queries=()):
+        self.docs = docs
+        self.facet_queries = facet_queries
+        self.queries = []
+
+    def respond(self, params):
+        return FakeSolrResponse(self.docs, self.facet_queries)
+
+    def raw_query(self, **params):
+        self.queries.append(params)
+        response = self.respond(params)
+        if not isinstance(response, FakeSolrResponse):
+            response = FakeSolrResponse(response)
+        return FakeSolrQuery(response)
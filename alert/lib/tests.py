@@ -1,6 +1,16 @@
 from django.test import TestCase
+from alert.lib.api import PerUserCacheThrottle
+from alert.lib.db_tools import keyset_chunks, keyset_iterator
+from alert.lib.mail import send_messages_in_batches
 from alert.lib.string_utils import trunc
-from lib.search_utils import make_fq
+from alert.lib.test_helpers import FakeSolr
+from alert.search.models import Court
+from django.core import mail
+from django.core.paginator import Paginator
+from lib.search_utils import (SolrResults, _iterate_search_results,
+                              bump_index_generation,
+                              get_cursor_sort, get_index_generation,
+                              has_values, make_cursor_query, make_fq)
 
 
 class TestStringUtils(TestCase):
@@ -46,6 +56,31 @@ class TestStringUtils(TestCase):
             )
 
 
+class TestKeysetIterator(TestCase):
+    fixtures = ['court_data.json']
+
+    def test_keyset_iterator(self):
+        """Do we get every item, in order, however they're asked for?"""
+        qs = Court.objects.all()
+        pks = list(qs.order_by('pk').values_list('pk', flat=True))
+        self.assertEqual([court.pk for court in keyset_iterator(qs, 3)], pks)
+        self.assertEqual(list(keyset_iterator(qs, 3, fields=('pk',),
+                                              flat=True)), pks)
+        self.assertEqual(
+            list(keyset_iterator(qs, 3, fields=('pk', 'full_name'))),
+            list(qs.order_by('pk').values_list('pk', 'full_name')),
+        )
+        self.assertEqual(
+            list(keyset_iterator(qs, 3, fields=('pk',), flat=True,
+                                 start_pk=pks[1])),
+            pks[2:],
+        )
+        self.assertEqual(
+            [court.pk for chunk in keyset_chunks(qs, 3) for court in chunk],
+            pks,
+        )
+
+
 class TestMakeFQ(TestCase):
     def test_make_fq(self):
         test_pairs = (
@@ -63,3 +98,149 @@ class TestMakeFQ(TestCase):
                 make_fq(cd={key: test[0]}, field=field, key=key),
                 '%s:(%s)' % (field, test[1])
             )
+
+
+class TestSearchResultCache(TestCase):
+    def test_solr_results_paginate(self):
+        """Does a single page of results work with the paginator?"""
+        docs = [{'id': i} for i in range(40, 60)]
+        paginator = Paginator(SolrResults(docs, 95, 40), 20)
+        self.assertEqual(paginator.num_pages, 5)
+        page = paginator.page(3)
+        self.assertEqual([doc['id'] for doc in page.object_list],
+                         range(40, 60))
+        self.assertEqual(page.start_index(), 41)
+
+    def test_bump_index_generation(self):
+        generation = get_index_generation()
+        bump_index_generation()
+        self.assertNotEqual(get_index_generation(), generation)
+
+    def test_cursor_sort(self):
+        self.assertEqual(get_cursor_sort('dateFiled desc'),
+                         [('dateFiled', 'desc'), ('id', 'asc')])
+        self.assertEqual(get_cursor_sort('citeCount asc,id desc'),
+                         [('citeCount', 'asc'), ('id', 'desc')])
+        self.assertIsNone(get_cursor_sort('score desc'))
+
+    def test_cursors_only_for_fields_with_values(self):
+        """Are sorts on fields that some results lack kept from cursors?"""
+        self.assertTrue(has_values(get_cursor_sort('citeCount desc')))
+        self.assertFalse(has_values(get_cursor_sort('dateFiled desc')))
+        self.assertFalse(has_values(get_cursor_sort('dateArgued asc')))
+
+    def test_cursor_query(self):
+        """Does the cursor filter for what comes after the last result?"""
+        self.assertEqual(
+            make_cursor_query([('citeCount', 'desc'), ('id', 'asc')],
+                              [5, u'12']),
+            u'{!cache=false tag=cursor}(citeCount:[* TO 5}) OR '
+            u'(citeCount:5 AND id:{"12" TO *])'
+        )
+
+
+class IterableSolr(FakeSolr):
+    """Answers the queries of iterate_search_results from a list of docs.
+
+    The fqs for having a field, or not, are applied, and a cursor is followed
+    by skipping the docs returned by the queries before it.
+    """
+    def __init__(self, docs):
+        super(IterableSolr, self).__init__(docs)
+        self.seen = {}
+
+    def respond(self, params):
+        filters = tuple(fq for fq in params['fq'] if 'cursor' not in fq)
+        docs = self.docs
+        for fq in filters:
+            field = fq.lstrip('-').split(':')[0]
+            docs = [d for d in docs if (field in d) != fq.startswith('-')]
+        seen = self.seen.get(filters, 0)
+        docs = docs[seen:seen + params['rows']]
+        self.seen[filters] = seen + len(docs)
+        return docs
+
+
+class TestIterateSearchResults(TestCase):
+    def test_results_without_the_sort_field_are_included(self):
+        docs = [{'id': u'%s' % i, 'dateFiled': i} for i in range(5)] + \
+               [{'id': u'x%s' % i} for i in range(3)]
+        solr = IterableSolr(docs)
+        results = list(_iterate_search_results(
+            solr, {'sort': 'dateFiled asc'}, [],
+            [('dateFiled', 'asc'), ('id', 'asc')], set(['id']), 2))
+        self.assertEqual([d['id'] for d in results],
+                         [d['id'] for d in docs])
+        # The undated results are walked last, sorted on what's left.
+        self.assertEqual(solr.queries[-1]['sort'], 'id asc')
+
+
+class ClockedThrottle(PerUserCacheThrottle):
+    """A throttle whose clock is set by the test."""
+    clock = 1000000
+
+    def now(self):
+        return self.clock
+
+
+class TestPerUserCacheThrottle(TestCase):
+    def burst(self, throttle, identifier, requests):
+        """Make requests the way tastypie does, returning how many got
+        through.
+        """
+        allowed = 0
+        for i in range(requests):
+            if not throttle.should_be_throttled(identifier):
+                throttle.accessed(identifier)
+                allowed += 1
+        return allowed
+
+    def test_burst_is_throttled(self):
+        throttle = ClockedThrottle(throttle_at=50, timeframe=100)
+        self.assertEqual(self.burst(throttle, 'burst', 80), 50)
+        # Other users have their own limits.
+        self.assertEqual(self.burst(throttle, 'other', 10), 10)
+
+    def test_window_slides(self):
+        throttle = ClockedThrottle(throttle_at=50, timeframe=100)
+        self.assertEqual(self.burst(throttle, 'slides', 50), 50)
+
+        # Half the timeframe later, the burst still counts.
+        throttle.clock += 50
+        self.assertEqual(self.burst(throttle, 'slides', 10), 0)
+
+        # Once the timeframe has passed, the burst is forgotten.
+        throttle.clock += 60
+        self.assertEqual(self.burst(throttle, 'slides', 80), 50)
+
+    def test_oldest_slice_counts_in_part(self):
+        """Are the accesses in the slice the timeframe only partly covers
+        counted in proportion?"""
+        throttle = ClockedThrottle(throttle_at=50, timeframe=100)
+        self.assertEqual(self.burst(throttle, 'partial', 20), 20)
+        throttle.clock += 30
+        self.assertEqual(self.burst(throttle, 'partial', 10), 10)
+
+        # Halfway through the slice after the first burst's, half of that
+        # burst is still in the timeframe, and all of the second one.
+        throttle.clock += 75
+        self.assertEqual(throttle.count_accesses('partial'), 20)
+        self.assertEqual(self.burst(throttle, 'partial', 80), 30)
+
+    def test_custom_throttles(self):
+        throttle = ClockedThrottle(throttle_at=5, timeframe=100)
+        self.assertEqual(self.burst(throttle, 'scout_test', 200), 200)
+        self.assertEqual(self.burst(throttle, 'not_scout', 200), 5)
+
+
+class TestSendMessagesInBatches(TestCase):
+    def test_all_messages_sent(self):
+        messages = [mail.EmailMessage('Subject %s' % i, 'Body', 'from@test.com',
+                                      ['to%s@test.com' % i])
+                    for i in range(250)]
+        sent = send_messages_in_batches(messages, batch_size=100,
+                                        connections=2)
+        self.assertEqual(sent, 250)
+        self.assertEqual(sorted(m.subject for m in mail.outbox),
+                         sorted(m.subject for m in messages))
+        self.assertEqual(send_messages_in_batches([]), 0)
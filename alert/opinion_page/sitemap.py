@@ -3,33 +3,28 @@ from django.http import HttpResponse
 from django.template import loader
 from django.utils.encoding import smart_str
 
-from alert.lib import sunburnt
-from alert.sitemap import items_per_sitemap
+from alert.lib import search_utils
+from alert.sitemap import items_per_sitemap, serve_sitemap_file, \
+    sitemap_file_name
 
+opinion_sitemap_params = {
+    'q': '*:*',
+    'fl': ','.join([
+        'absolute_url',
+        'dateFiled',
+        'local_path',
+        'citeCount',
+        'timestamp',
+    ]),
+    'sort': 'dateFiled asc',
+    'caller': 'opinion_sitemap_maker',
+}
 
-def opinion_sitemap_maker(request):
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
-    page = request.GET.get("p")
-    start = (int(page) - 1) * items_per_sitemap
-    params = {
-        'q': '*:*',
-        'rows': items_per_sitemap,
-        'start': start,
-        'fl': ','.join([
-            'absolute_url',
-            'dateFiled',
-            'local_path',
-            'citeCount',
-            'timestamp',
-        ]),
-        'sort': 'dateFiled asc',
-        'caller': 'opinion_sitemap_maker',
-    }
-    search_results_object = conn.raw_query(**params).execute()
-
-    # Translate Solr object into something Django's template can use
+
+def make_opinion_urls(results):
+    """Translate Solr results into something Django's template can use"""
     urls = []
-    for result in search_results_object:
+    for result in results:
         url_strs = [
             'https://www.courtlistener.com%s' % result['absolute_url']]
         if int(result['citeCount']) > 0:
@@ -54,6 +49,24 @@ def opinion_sitemap_maker(request):
             else:
                 sitemap_item['priority'] = '0.5'
             urls.append(dict(sitemap_item))
+    return urls
+
+
+def opinion_sitemap_maker(request):
+    page = int(request.GET.get("p"))
+    response = serve_sitemap_file(request,
+                                  sitemap_file_name('opinions', page))
+    if response is not None:
+        return response
+
+    # The files haven't been made yet, so get the page from the index.
+    params = opinion_sitemap_params.copy()
+    params.update({
+        'rows': items_per_sitemap,
+        'start': (page - 1) * items_per_sitemap,
+    })
+    results = search_utils.get_search_results(settings.SOLR_OPINION_URL, params)
+    urls = make_opinion_urls(results['docs'])
 
     xml = smart_str(loader.render_to_string('sitemap.xml', {'urlset': urls}))
     # These links contain case names, so they should get crawled but not
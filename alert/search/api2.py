@@ -532,12 +532,32 @@ class SearchResource(ModelResourceWithFieldsFilter):
         else:
             return ''
 
-    def get_object_list(self, request=None, **kwargs):
+    def get_solr_params(self, request, for_list):
+        """Get the params that limit what Solr sends back to what will be
+        dehydrated.
+
+        Without fl, Solr sends every stored field, including the full text of
+        every result, which is only shown on the detail page. Highlighting is
+        only needed for the snippet.
+        """
+        dehydrated = self.get_dehydrated_fields(request, for_list)
+        solr_fields = set(['id', 'score'])
+        for field_name, field_object in dehydrated.items():
+            if field_name != 'snippet' and field_object.attribute:
+                solr_fields.add(field_object.attribute)
+        return {
+            'fl': ','.join(sorted(solr_fields)),
+            'highlight': 'text' if 'snippet' in dehydrated else False,
+        }
+
+    def get_object_list(self, request=None, for_list=True, **kwargs):
         """Performs the Solr work."""
         main_query = {'caller': 'api_search'}
+        solr_params = self.get_solr_params(request, for_list)
         try:
-            main_query.update(build_main_query(kwargs['cd'],
-                                               highlight='text'))
+            main_query.update(build_main_query(
+                kwargs['cd'], highlight=solr_params['highlight']))
+            main_query['fl'] = solr_params['fl']
             sl = SolrList(
                 main_query=main_query,
                 offset=request.GET.get('offset', 0),
@@ -547,8 +567,9 @@ class SearchResource(ModelResourceWithFieldsFilter):
         except KeyError:
             sf = forms.SearchForm({'q': "*:*"})
             if sf.is_valid():
-                main_query.update(build_main_query(sf.cleaned_data,
-                                                   highlight='text'))
+                main_query.update(build_main_query(
+                    sf.cleaned_data, highlight=solr_params['highlight']))
+                main_query['fl'] = solr_params['fl']
             sl = SolrList(
                 main_query=main_query,
                 offset=request.GET.get('offset', 0),
@@ -573,7 +594,8 @@ class SearchResource(ModelResourceWithFieldsFilter):
         if search_form.is_valid():
             cd = search_form.cleaned_data
             cd['q'] = 'id:%s' % kwargs['pk']
-            return self.get_object_list(bundle.request, cd=cd)[0]
+            return self.get_object_list(bundle.request, for_list=False,
+                                        cd=cd)[0]
         else:
             BadRequest("Invalid resource lookup data provided. Unable to "
                        "complete your request.")
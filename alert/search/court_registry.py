@@ -0,0 +1,182 @@
+import bisect
+import threading
+import time
+
+from alert.search.models import Court
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+# The version of the courts in the cache, which every process compares with
+# its own to know when another one has changed a court.
+VERSION_KEY = 'court-registry-version'
+# How long the version is kept. A timeout of None is the cache's default, not
+# forever, so this is the longest memcached allows.
+VERSION_TIMEOUT = 60 * 60 * 24 * 30
+
+# How often, in seconds, to check the shared version.
+VERSION_CHECK_INTERVAL = 60
+
+# How many answers of get_by_citation_string to remember. Parentheticals are
+# messy, so there's no end of different ones.
+MAX_CITATION_STRING_ANSWERS = 10000
+
+# The values of the courts in use that the search page needs.
+SEARCH_VALUES = ('pk', 'short_name', 'jurisdiction',
+                 'has_oral_argument_scraper')
+
+
+def normalize_citation_string(citation_string):
+    return u' '.join(citation_string.split())
+
+
+class CourtRegistry(object):
+    """All the courts, held in memory.
+
+    There are only a few hundred courts and they hardly ever change, yet
+    nearly every search, index update and citation lookup needs some of them.
+    The registry loads them all with a single query the first time they're
+    needed, and serves every lookup from memory after that.
+
+    Saving or deleting a court reloads the registry in this process and bumps
+    a version number in the cache. Other processes notice the new version
+    within VERSION_CHECK_INTERVAL seconds and reload too. Anything derived
+    from the courts can be kept with get_derived, which is thrown away on
+    reload.
+    """
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.courts = None
+        self.version = None
+        self.last_check = 0
+
+    def _load(self):
+        with self.lock:
+            courts = list(Court.objects.all())
+            self.by_pk = dict((court.pk, court) for court in courts)
+            self.by_jurisdiction = {}
+            for court in courts:
+                self.by_jurisdiction.setdefault(court.jurisdiction,
+                                                []).append(court)
+            self.derived = {}
+            self.courts = courts
+            return courts
+
+    def _get_courts(self):
+        if time.time() - self.last_check > VERSION_CHECK_INTERVAL:
+            self.last_check = time.time()
+            version = cache.get(VERSION_KEY)
+            if version != self.version:
+                self.version = version
+                self.courts = None
+        courts = self.courts
+        if courts is None:
+            courts = self._load()
+        return courts
+
+    def reload(self):
+        """Throw away the courts in every process, so that they're loaded
+        again when next needed.
+        """
+        try:
+            self.version = cache.incr(VERSION_KEY)
+        except ValueError:
+            self.version = 1
+            cache.set(VERSION_KEY, self.version, VERSION_TIMEOUT)
+        self.clear()
+
+    def clear(self):
+        """Throw away the courts in this process only."""
+        self.courts = None
+
+    def all(self):
+        """Get every court, in order of position."""
+        return self._get_courts()
+
+    def in_use(self):
+        return [court for court in self._get_courts() if court.in_use]
+
+    def get(self, pk):
+        """Get a court by its pk. Raises Court.DoesNotExist if there isn't
+        one.
+
+        A court that's missing may have just been made by another process, so
+        the courts are loaded again before giving up.
+        """
+        self._get_courts()
+        if pk not in self.by_pk:
+            self._load()
+        try:
+            return self.by_pk[pk]
+        except KeyError:
+            raise Court.DoesNotExist('No court with pk %s' % pk)
+
+    def get_by_jurisdiction(self, jurisdiction):
+        self._get_courts()
+        return list(self.by_jurisdiction.get(jurisdiction, []))
+
+    def _make_citation_string_index(self):
+        """Make a prefix index of the courts by citation string: the sorted
+        citation strings, the courts in the same order, and a dict to keep
+        the answers to prefixes that have been looked up.
+        """
+        entries = sorted(
+            (normalize_citation_string(court.citation_string), i, court)
+            for i, court in enumerate(self._get_courts())
+        )
+        return ([entry[0] for entry in entries],
+                [(entry[1], entry[2]) for entry in entries],
+                {})
+
+    def get_by_citation_string(self, citation_string):
+        """Get the first court, in order of position, whose citation string
+        starts with citation_string, or None.
+
+        Citations are often missing the final period of the court, e.g.
+        "2d Cir", hence the prefix match. The citation strings are kept
+        sorted, so the ones starting with a prefix are found by bisection
+        rather than by checking every court, and answers are remembered.
+        Whitespace is normalized on both sides.
+        """
+        strings, courts, answers = self.get_derived(
+            'citation_string_index', self._make_citation_string_index)
+        prefix = normalize_citation_string(citation_string)
+        try:
+            return answers[prefix]
+        except KeyError:
+            pass
+        lo = bisect.bisect_left(strings, prefix)
+        hi = bisect.bisect_left(strings, prefix + u'\uffff', lo)
+        court = min(courts[lo:hi])[1] if hi > lo else None
+        if len(answers) >= MAX_CITATION_STRING_ANSWERS:
+            answers.clear()
+        answers[prefix] = court
+        return court
+
+    def search_values(self):
+        """Get the courts in use as dicts of SEARCH_VALUES, like
+        Court.objects.filter(in_use=True).values(*SEARCH_VALUES) would.
+
+        The dicts are new on every call, so callers can change them.
+        """
+        return [dict((field, getattr(court, field)) for field in SEARCH_VALUES)
+                for court in self.in_use()]
+
+    def get_derived(self, name, make):
+        """Get something made from the courts by calling make, making it only
+        once per load of the courts.
+        """
+        self._get_courts()
+        with self.lock:
+            if name not in self.derived:
+                self.derived[name] = make()
+            return self.derived[name]
+
+
+court_registry = CourtRegistry()
+
+
+@receiver(post_save, sender=Court)
+@receiver(post_delete, sender=Court)
+def reload_court_registry(sender, **kwargs):
+    court_registry.reload()
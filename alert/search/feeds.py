@@ -1,5 +1,6 @@
 import datetime
 from alert.lib import search_utils, sunburnt
+from alert.lib.feed_cache import CachedFeedMixin
 from alert.search.forms import SearchForm
 from alert.search.models import Court
 from django.conf import settings
@@ -8,7 +9,7 @@ from django.shortcuts import get_object_or_404
 from django.utils.feedgenerator import Atom1Feed
 
 
-class SearchFeed(Feed):
+class SearchFeed(CachedFeedMixin, Feed):
     """This feed returns the results of a search feed. It lacks a second
     argument in the method b/c it gets its search query from a GET request.
     """
@@ -28,7 +29,6 @@ class SearchFeed(Feed):
         search_form = SearchForm(obj.GET)
         if search_form.is_valid():
             cd = search_form.cleaned_data
-            conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
             main_params = search_utils.build_main_query(cd, highlight=False)
             main_params.update({
                 'sort': 'dateFiled desc',
@@ -36,7 +36,8 @@ class SearchFeed(Feed):
                 'start': '0',
                 'caller': 'SearchFeed',
             })
-            return conn.raw_query(**main_params).execute()
+            return search_utils.get_search_results(
+                settings.SOLR_OPINION_URL, main_params)['docs']
         else:
             return []
 
@@ -53,7 +54,7 @@ class SearchFeed(Feed):
         return item['caseName']
 
 
-class JurisdictionFeed(Feed):
+class JurisdictionFeed(CachedFeedMixin, Feed):
     """When working on this feed, note that it is overridden in a number of
     places, so changes here may have unintended consequences.
     """
@@ -66,12 +67,15 @@ class JurisdictionFeed(Feed):
     def title(self, obj):
         return "CourtListener.com: All opinions for the " + obj.full_name
 
+    def get_feed_court(self, court=None):
+        return court
+
     def get_object(self, request, court):
         return get_object_or_404(Court, pk=court)
 
     def items(self, obj):
         """Do a Solr query here. Return the first 20 results"""
-        conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+        conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
         params = {
             'q': '*:*',
             'fq': 'court_exact:%s' % obj.pk,
@@ -108,7 +112,7 @@ class AllJurisdictionsFeed(JurisdictionFeed):
 
     def items(self, obj):
         """Do a Solr query here. Return the first 20 results"""
-        conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+        conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
         params = {
             'q': '*:*',
             'sort': 'dateFiled desc',
@@ -1,9 +1,10 @@
 from alert.search.fields import CeilingDateField
 from alert.search.fields import FloorDateField
-from alert.search.models import Court
+from alert.search.court_registry import court_registry
 from alert.search.models import DOCUMENT_STATUSES
 from django import forms
 
+import copy
 import re
 
 OPINION_ORDER_BY_CHOICES = (
@@ -59,14 +60,23 @@ def _clean_form(request, cd):
     mutable_get['order_by'] = cd['order_by']
     mutable_get['type'] = cd['type']
 
-    courts = Court.objects.filter(in_use=True).values(
-        'pk', 'short_name', 'jurisdiction', 'has_oral_argument_scraper')
-    for court in courts:
-        mutable_get['court_%s' % court['pk']] = cd['court_%s' % court['pk']]
+    for court in court_registry.in_use():
+        mutable_get['court_%s' % court.pk] = cd['court_%s' % court.pk]
 
     return SearchForm(mutable_get)
 
 
+def make_court_fields():
+    """Make a checkbox field for every court in use, for SearchForm to copy.
+    """
+    return [('court_' + court.pk, forms.BooleanField(
+        label=court.short_name,
+        required=False,
+        initial=True,
+        widget=forms.CheckboxInput(attrs={'checked': 'checked'})
+    )) for court in court_registry.in_use()]
+
+
 class SearchForm(forms.Form):
     #
     # Blended fields
@@ -221,15 +231,10 @@ class SearchForm(forms.Form):
         names coming from the database, we need to interact directly with the
         fields dict.
         """
-        courts = Court.objects.filter(in_use=True).values(
-            'pk', 'short_name', 'jurisdiction', 'has_oral_argument_scraper')
-        for court in courts:
-            self.fields['court_' + court['pk']] = forms.BooleanField(
-                label=court['short_name'],
-                required=False,
-                initial=True,
-                widget=forms.CheckboxInput(attrs={'checked': 'checked'})
-            )
+        court_fields = court_registry.get_derived('search_form_court_fields',
+                                                  make_court_fields)
+        for name, field in court_fields:
+            self.fields[name] = copy.deepcopy(field)
 
         tabindex_i = 204
         for status in DOCUMENT_STATUSES:
@@ -0,0 +1,96 @@
+import sys
+import time
+
+from alert.opinion_page.views import make_citation_string
+from alert.search.court_registry import court_registry
+from alert.search.models import Document
+from alert.search.search_indexes import SearchDocument, make_opinion_text
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.template import Context, loader
+from django.test.utils import CaptureQueriesContext
+from optparse import make_option
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--count',
+            type=int,
+            default=1000,
+            help='How many documents from the database, ordered by pk, to '
+                 'build.',
+        ),
+        make_option(
+            '--iterations',
+            type=int,
+            default=3,
+            help='How many times to build the documents. The fastest run is '
+                 'reported.',
+        ),
+    )
+    help = 'Benchmark making the objects that opinions are indexed with.'
+
+    @staticmethod
+    def build_legacy(pks):
+        """Do the work that making a SearchDocument took before the bulk
+        builder existed: lazily getting the docket, court and citation of
+        every item, and rendering the text with the template engine.
+        """
+        text_template = loader.get_template('search/indexes/opinion_text.txt')
+        for item in Document.objects.filter(pk__in=pks).order_by('pk'):
+            court = item.docket.court
+            court.full_name, court.pk, court.citation_string
+            item.citation.case_name
+            make_citation_string(item)
+            text_template.render(Context({'object': item}))
+
+    @staticmethod
+    def build(pks):
+        court_registry.clear()
+        list(SearchDocument.from_queryset(Document.objects.filter(pk__in=pks)))
+
+    @staticmethod
+    def best_of(iterations, func, *args):
+        timings = []
+        for _ in range(iterations):
+            with CaptureQueriesContext(connection) as queries:
+                t1 = time.time()
+                func(*args)
+                timings.append(time.time() - t1)
+        return min(timings), len(queries)
+
+    @staticmethod
+    def count_text_differences(pks):
+        """Count the documents whose assembled text has different words than
+        the template gives.
+        """
+        text_template = loader.get_template('search/indexes/opinion_text.txt')
+        differences = 0
+        qs = Document.objects.filter(pk__in=pks).select_related(
+            'docket__court', 'citation')
+        for item in qs:
+            rendered = text_template.render(Context({'object': item}))
+            assembled = make_opinion_text(item, item.docket.court)
+            if rendered.split() != assembled.split():
+                differences += 1
+        return differences
+
+    def handle(self, *args, **options):
+        pks = list(Document.objects.order_by('pk').values_list(
+            'pk', flat=True)[:options['count']])
+        if not pks:
+            raise CommandError('No documents found to benchmark with.')
+        iterations = options['iterations']
+
+        for label, func in (('One at a time', self.build_legacy),
+                            ('In bulk', self.build)):
+            elapsed, query_count = self.best_of(iterations, func, pks)
+            sys.stdout.write(
+                '{0}: {1:.3f}s for {2:d} documents ({3:.1f} docs/s), {4:d} '
+                'queries.\n'.format(label, elapsed, len(pks),
+                                    len(pks) / max(elapsed, 1e-9),
+                                    query_count))
+
+        sys.stdout.write('Text differs from the template for {0:d} '
+                         'documents.\n'.format(self.count_text_differences(pks)))
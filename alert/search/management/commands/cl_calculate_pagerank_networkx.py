@@ -1,17 +1,16 @@
 __author__ = 'Krist Jin'
 
 from alert import settings
-from alert.search.models import Document
-from alert.lib.db_tools import queryset_generator
 from alert.lib.solr_core_admin import get_data_dir_location, reload_pagerank_external_file_cache
+from alert.search import pagerank
 from django.core.management.base import BaseCommand
+from optparse import make_option
 import logging
 import os
 import pwd
 import shutil
 import sys
 import time
-import networkx as nx
 
 logger = logging.getLogger(__name__)
 
@@ -19,100 +18,111 @@ logger = logging.getLogger(__name__)
 class Command(BaseCommand):
     args = '<args>'
     help = 'Calculate pagerank value for every case'
+    option_list = BaseCommand.option_list + (
+        make_option('--damping',
+                    type=float,
+                    default=pagerank.DAMPING,
+                    help='The damping factor. Default: %s' % pagerank.DAMPING),
+        make_option('--tolerance',
+                    type=float,
+                    default=pagerank.TOLERANCE,
+                    help='Stop iterating when the ranks change by less than '
+                         'this per case. Default: %s' % pagerank.TOLERANCE),
+        make_option('--max-iterations',
+                    dest='max_iterations',
+                    type=int,
+                    default=pagerank.MAX_ITERATIONS,
+                    help='Give up if the ranks have not converged after this '
+                         'many iterations. Default: %s'
+                         % pagerank.MAX_ITERATIONS),
+        make_option('--dangling',
+                    type='choice',
+                    choices=pagerank.DANGLING_CHOICES,
+                    default='uniform',
+                    help='How to handle the rank of cases that cite nothing: '
+                         '"uniform" shares it among all cases, "drop" '
+                         'discards it. Default: uniform'),
+        make_option('--incremental',
+                    action='store_true',
+                    default=False,
+                    help='Apply the citations added and removed since the '
+                         'last run to its graph, and start from its ranks, '
+                         'instead of starting over. Falls back to a full run '
+                         'if there has not been one yet.'),
+    )
     RESULT_FILE_PATH = get_data_dir_location() + "external_pagerank"
-    TEMP_EXTENSION = '.tmp'
-    result_file = open(RESULT_FILE_PATH + TEMP_EXTENSION, 'w')
 
-    def do_pagerank(self, verbosity=1, chown=True):
-        #####################
-        #      Stage I      #
-        # Import Data to NX #
-        #####################
-        sys.stdout.write('Initializing...\n')
-        graph_size = Document.objects.all().count()
-        citing_graph = nx.DiGraph()
-        qs = Document.objects.only(
-            'pk',
-            'cases_cited',
-        )
-        case_list = queryset_generator(qs, chunksize=10000)
-        case_count = 0
-        timings = []
-        average_per_s = 0
-
-        # Build up the network graph and a list of all valid ids
-        id_list = []
-        for source_case in case_list:
-            case_count += 1
-            if case_count % 100 == 1:
-                t1 = time.time()
-            if case_count % 100 == 0:
-                t2 = time.time()
-                timings.append(t2 - t1)
-                average_per_s = 100 / (sum(timings) / float(len(timings)))
-            sys.stdout.write("\rGenerating networkx graph...{:.0%} ({}/{}, {:.1f}/s)".format(
-                case_count * 1.0 / graph_size,
-                case_count,
-                graph_size,
-                average_per_s,
-            ))
-            sys.stdout.flush()
-            for target_case in source_case.cases_cited.values_list('parent_documents__id'):
-                citing_graph.add_edge(str(source_case.pk), str(target_case[0]))
-
-            # Save all the keys since they get dropped by networkx in Stage II
-            id_list.append(str(source_case.pk))
+    def do_pagerank(self, verbosity=1, chown=True, damping=pagerank.DAMPING,
+                    tolerance=pagerank.TOLERANCE,
+                    max_iterations=pagerank.MAX_ITERATIONS,
+                    dangling='uniform', incremental=False,
+                    snapshot_path=None, change_log_path=None):
+        ######################
+        #      Stage I       #
+        # Build the graph    #
+        ######################
+        snapshot = pagerank.load_snapshot(snapshot_path) if incremental else None
+        if incremental and snapshot is None and verbosity >= 1:
+            sys.stdout.write('No previous run found. Doing a full run.\n')
+        # Changes from now on are logged for the next run, whether they make it
+        # into this one or not.
+        changes = pagerank.take_citation_changes(change_log_path)
+        t1 = time.time()
+        if snapshot is not None:
+            if verbosity >= 1:
+                sys.stdout.write('Applying {} changes to the citation '
+                                 'network...'.format(len(changes)))
+                sys.stdout.flush()
+            sources, targets = pagerank.edges_from_keys(
+                pagerank.apply_citation_changes(snapshot['edges'], changes))
+        else:
+            if verbosity >= 1:
+                sys.stdout.write('Loading the citation network...')
+                sys.stdout.flush()
+            sources, targets = pagerank.get_citation_edges()
+        graph = pagerank.CitationGraph(sources, targets)
+        if verbosity >= 1:
+            sys.stdout.write('{} cases and {} citations in {:.1f}s.\n'.format(
+                len(graph), graph.matrix.nnz, time.time() - t1))
 
         ######################
         #      Stage II      #
         # Calculate Pagerank #
         ######################
         if verbosity >= 1:
-            sys.stdout.write('\n')
-            sys.stdout.write('NetworkX PageRank calculating...')
+            sys.stdout.write('Calculating PageRank...')
             sys.stdout.flush()
-        pr_result = nx.pagerank(citing_graph)
+        t1 = time.time()
+        start = None
+        if snapshot is not None:
+            start = pagerank.carry_over_ranks(graph, snapshot)
+        ranks = pagerank.pagerank(graph, damping=damping, tolerance=tolerance,
+                                  max_iterations=max_iterations,
+                                  dangling=dangling, start=start)
         if verbosity >= 1:
-            sys.stdout.write('Complete!\n')
+            sys.stdout.write('done in {:.1f}s.\n'.format(time.time() - t1))
 
         ###################
         #    Stage III    #
         # Update Pagerank #
         ###################
-        progress = 0
-        min_value = min(pr_result.values())
-        for id in id_list:
-            progress += 1
-            try:
-                new_pr = pr_result[id]
-            except KeyError:
-                # NetworkX removes the isolated nodes from the network, but they still need to go into the PR file.
-                new_pr = min_value
-            self.result_file.write('{}={}\n'.format(id, new_pr))
-
-            if verbosity >= 1:
-                sys.stdout.write('\rUpdating Pagerank in external file...{:.0%}'.format(
-                    progress * 1.0 / graph_size
-                ))
-                sys.stdout.flush()
-
-        self.result_file.close()
+        # Cases with no citations either way get the lowest rank there is. The
+        # file comes out sorted, for Solr's sake, because the pks do.
+        if verbosity >= 1:
+            sys.stdout.write('Updating Pagerank in external file...\n')
+        pagerank.write_pagerank_file(self.RESULT_FILE_PATH,
+                                     pagerank.get_document_pks(), graph, ranks)
+        pagerank.save_snapshot(graph, ranks, sources, targets, snapshot_path)
+        pagerank.finish_citation_changes(change_log_path)
 
         if verbosity >= 1:
-            sys.stdout.write('\nPageRank calculation finished!')
+            sys.stdout.write('PageRank calculation finished!')
             sys.stdout.write('See the django log for more details.\n')
 
         ########################
         #       Stage IV       #
         # Maintenance Routines #
         ########################
-        if verbosity >= 1:
-            sys.stdout.write('Sorting the temp pagerank file for improved Solr performance...\n')
-
-        # Sort the temp file, creating a new file without the TEMP_EXTENSION value, then delete the temp file.
-        os.system('sort -n %s%s > %s' % (self.RESULT_FILE_PATH, self.TEMP_EXTENSION, self.RESULT_FILE_PATH))
-        os.remove(self.RESULT_FILE_PATH + self.TEMP_EXTENSION)
-
         if verbosity >= 1:
             sys.stdout.write('Reloading the external file cache in Solr...\n')
         reload_pagerank_external_file_cache()
@@ -125,4 +135,9 @@ class Command(BaseCommand):
             os.chown(settings.BULK_DATA_DIR + 'external_pagerank', user_info.pw_uid, user_info.pw_gid)
 
     def handle(self, *args, **options):
-        self.do_pagerank(verbosity=int(options.get('verbosity', 1)))
+        self.do_pagerank(verbosity=int(options.get('verbosity', 1)),
+                         damping=options['damping'],
+                         tolerance=options['tolerance'],
+                         max_iterations=options['max_iterations'],
+                         dangling=options['dangling'],
+                         incremental=options['incremental'])
@@ -0,0 +1,118 @@
+import hashlib
+import itertools
+import json
+import os
+import sys
+
+from alert.audio.sitemap import make_oral_argument_urls, \
+    oral_argument_sitemap_params
+from alert.lib.search_utils import iterate_search_results
+from alert.opinion_page.sitemap import make_opinion_urls, \
+    opinion_sitemap_params
+from alert.sitemap import items_per_sitemap, make_sitemap_index, \
+    sitemap_file_name, sitemap_index_file_name, write_sitemap_file
+from django.conf import settings
+from django.core.management import BaseCommand
+from django.template import loader
+from optparse import make_option
+
+# The hash of every page written, so the next run can tell which changed.
+MANIFEST_FILE_NAME = 'sitemaps.json'
+
+
+class Command(BaseCommand):
+    option_list = BaseCommand.option_list + (
+        make_option(
+            '--force',
+            action='store_true',
+            default=False,
+            help='Write every page, not just the ones that changed.',
+        ),
+    )
+    help = ('Write the sitemaps of the opinions and oral arguments to gzipped '
+            'files, which the sitemap views serve.')
+
+    sitemap_types = (
+        ('opinions', settings.SOLR_OPINION_URL, opinion_sitemap_params,
+         make_opinion_urls),
+        ('oral-arguments', settings.SOLR_AUDIO_URL,
+         oral_argument_sitemap_params, make_oral_argument_urls),
+    )
+
+    @staticmethod
+    def get_pages(url, params):
+        """Walk the index once with a cursor, yielding a page of results at a
+        time.
+        """
+        results = iterate_search_results(url, params,
+                                         chunksize=items_per_sitemap * 10)
+        while True:
+            page = list(itertools.islice(results, items_per_sitemap))
+            if not page:
+                break
+            yield page
+
+    @staticmethod
+    def hash_urls(urls):
+        return hashlib.md5(repr([sorted(url.items()) for url in urls])) \
+            .hexdigest()
+
+    @staticmethod
+    def load_manifest(path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (IOError, ValueError):
+            return {}
+
+    def write_sitemaps(self, obj_type, url, params, make_urls, old_hashes,
+                       force):
+        """Write the pages of a type of sitemap whose items have changed, and
+        delete any past the end. Returns the hashes of all the pages.
+        """
+        hashes = []
+        written = 0
+        for page, results in enumerate(self.get_pages(url, params), 1):
+            urls = make_urls(results)
+            digest = self.hash_urls(urls)
+            hashes.append(digest)
+            file_name = sitemap_file_name(obj_type, page)
+            unchanged = (page <= len(old_hashes) and
+                         old_hashes[page - 1] == digest and
+                         os.path.exists(os.path.join(settings.SITEMAP_DIR,
+                                                     file_name)))
+            if force or not unchanged:
+                write_sitemap_file(file_name, loader.render_to_string(
+                    'sitemap.xml', {'urlset': urls}))
+                written += 1
+
+        for page in range(len(hashes) + 1, len(old_hashes) + 1):
+            path = os.path.join(settings.SITEMAP_DIR,
+                                sitemap_file_name(obj_type, page))
+            if os.path.exists(path):
+                os.remove(path)
+
+        sys.stdout.write('Wrote %s of %s %s sitemaps.\n' % (
+            written, len(hashes), obj_type))
+        return hashes
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(settings.SITEMAP_DIR):
+            os.makedirs(settings.SITEMAP_DIR)
+        manifest_path = os.path.join(settings.SITEMAP_DIR, MANIFEST_FILE_NAME)
+        manifest = self.load_manifest(manifest_path)
+
+        new_manifest = {}
+        for obj_type, url, params, make_urls in self.sitemap_types:
+            new_manifest[obj_type] = self.write_sitemaps(
+                obj_type, url, params, make_urls,
+                manifest.get(obj_type, []), options['force'])
+
+        write_sitemap_file(sitemap_index_file_name, make_sitemap_index(
+            [(obj_type, len(new_manifest[obj_type]))
+             for obj_type, _, _, _ in self.sitemap_types]))
+
+        tmp_path = manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(new_manifest, f)
+        os.rename(tmp_path, manifest_path)
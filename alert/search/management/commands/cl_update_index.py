@@ -1,21 +1,41 @@
 import ast
 import datetime
+import multiprocessing
 import sys
+import threading
 import time
+from Queue import Empty, Full, Queue
 from alert.audio.models import Audio
 from alert.lib import sunburnt
-from alert.lib.db_tools import queryset_generator
+from alert.lib.db_tools import keyset_chunks, keyset_iterator
+from alert.lib.search_utils import commit_index
 from alert.lib.timer import print_timing
 from alert.search.models import Document
+from alert.search.court_registry import court_registry
 # Celery requires imports like this. Disregard syntax error.
 from search.tasks import (delete_items, add_or_update_audio_files,
-                          add_or_update_docs, add_or_update_items)
+                          add_or_update_docs, add_or_update_items,
+                          make_search_items)
 from celery.task.sets import TaskSet
+from collections import deque
 from django.core.management.base import BaseCommand
+from django.db import connection
 from django.utils.timezone import make_aware, utc
 from optparse import make_option
 
 
+# How many rows to get from the DB per query, how many items to send to Solr
+# per request, and how many batches may wait between the stages of the
+# pipeline used by --update --everything.
+FETCH_CHUNKSIZE = 500
+POST_BATCH_SIZE = 1000
+QUEUE_SIZE = 8
+
+
+class PipelineAborted(Exception):
+    """Another stage of the pipeline has failed."""
+
+
 def proceed_with_deletion(out, count):
     """
     Checks whether we want to proceed to delete (lots of) items
@@ -103,11 +123,26 @@ class Command(BaseCommand):
                     default=False,
                     help='Take action on a list of items using a single '
                          'Celery task'),
+        make_option('--start-pk',
+                    dest='start_pk',
+                    type=int,
+                    default=0,
+                    help='With --update --everything, only index items with '
+                         'a pk greater than this. Use it to resume an '
+                         'interrupted run from the last pk it reported.'),
+        make_option('--workers',
+                    dest='workers',
+                    type=int,
+                    default=multiprocessing.cpu_count(),
+                    help='With --update --everything, how many processes to '
+                         'use when building the items to send to Solr. '
+                         'Defaults to the number of CPUs.'),
     )
     args = (
         "--solr-url http://127.0.0.1:8983/your/core/location (--update | "
         "--delete) (--everything | --datetime 'YYYY-MM-DD [HH:MM:SS]' | "
-        "--query Q | --item <item_id> <item_id> ...) [--optimize]")
+        "--query Q | --item <item_id> <item_id> ...) [--optimize] "
+        "[--start-pk N] [--workers N]")
     help = 'Adds, updates or removes items in an index.'
 
     def _chunk_queryset_into_tasks(self, items, count, chunksize=5000,
@@ -117,7 +152,8 @@ class Command(BaseCommand):
 
         Potential performance improvements:
          - Postgres is quiescent when Solr is popping tasks from Celery,
-           instead, it should be fetching the next 1,000
+           instead, it should be fetching the next 1,000. See _run_pipeline,
+           which is used for --everything.
          - The wait loop (while not result.ready()) polls for the results, at
            a 1s interval. Could this be reduced or somehow eliminated while
            keeping Celery's tasks list from running away?
@@ -149,7 +185,7 @@ class Command(BaseCommand):
             if (processed_count % 50000 == 0) or last_item:
                 # Do a commit every 50000 items, for good measure.
                 self.stdout.write("...running commit command...")
-                self.si.commit()
+                commit_index(self.si)
 
             sys.stdout.write("\rProcessed {}/{} ({:.0%})".format(
                 processed_count,
@@ -181,7 +217,7 @@ class Command(BaseCommand):
             self.stdout.write('Marking all items as deleted...\n')
             self.si.delete_all()
             self.stdout.write('Committing the deletion...\n')
-            self.si.commit()
+            commit_index(self.si)
             self.stdout.write('\nDone. Your index has been emptied. Hope this '
                               'is what you intended.\n')
 
@@ -196,10 +232,9 @@ class Command(BaseCommand):
         count = qs.count()
         if proceed_with_deletion(self.stdout, count):
             self.stdout.write("Deleting all item(s) newer than %s\n" % dt)
-            items = queryset_generator(qs)
-            for item in items:
-                self.si.delete(item)
-            self.si.commit()
+            for pks in keyset_chunks(qs, fields=('pk',), flat=True):
+                self.si.delete(pks)
+            commit_index(self.si)
 
     @print_timing
     def delete_by_query(self, query):
@@ -212,7 +247,7 @@ class Command(BaseCommand):
             self.stdout.write("Deleting all item(s) that match the query: "
                               "%s\n" % query)
             self.si.delete(queries=self.si.Q(**query_dict))
-            self.si.commit()
+            commit_index(self.si)
 
     @print_timing
     def add_or_update(self, *items):
@@ -235,12 +270,183 @@ class Command(BaseCommand):
         self.stdout.write(
             "Adding or updating items(s) newer than %s\n" % dt)
         qs = self.type.objects.filter(time_retrieved__gt=dt)
-        items = queryset_generator(qs)
+        items = keyset_iterator(self._with_related(qs), server_side=True)
         count = qs.count()
         self._chunk_queryset_into_tasks(items, count)
 
+    def _with_related(self, queryset):
+        """Select the related objects needed to make search items."""
+        if self.type == Document:
+            return queryset.select_related('docket', 'citation')
+        return queryset.select_related('docket__court')
+
+    def _fetch_items(self, queryset, start_pk, batch_queue, abort):
+        """Gets the items in queryset with a pk greater than start_pk, a chunk
+        at a time, putting each chunk on batch_queue.
+
+        The related objects that are needed to build the search items are
+        selected in the same query, or, for the courts of opinions, are in the
+        court cache, so the builders never need the DB. None is put on the
+        queue when there's nothing left. If the pipeline fails, nothing more
+        is put on it, since nobody is left to take it off.
+        """
+        try:
+            for items in keyset_chunks(self._with_related(queryset),
+                                       FETCH_CHUNKSIZE, start_pk=start_pk,
+                                       server_side=True):
+                self._put(batch_queue, items, abort)
+            self._put(batch_queue, None, abort)
+        except PipelineAborted:
+            return
+        except Exception:
+            abort.set()
+            raise
+        finally:
+            connection.close()
+
+    def _post_items(self, post_queue, count, abort):
+        """Sends the items on post_queue to Solr in large requests, printing
+        the throughput as it goes.
+
+        Each entry on the queue is a tuple of the search items made from a
+        chunk of the DB, and the last pk of that chunk. Chunks arrive in pk
+        order, so once one is sent, everything before it is in the index, and
+        its pk is a safe place to resume from.
+        """
+        si = sunburnt.get_solr_interface(self.solr_url, mode='w')
+        processed_count = 0
+        last_commit_count = 0
+        start_time = time.time()
+        search_items = []
+        try:
+            while True:
+                entry = self._get(post_queue, abort)
+                if entry is not None:
+                    chunk_items, chunk_size, chunk_last_pk = entry
+                    search_items.extend(chunk_items)
+                    processed_count += chunk_size
+                if search_items and (len(search_items) >= POST_BATCH_SIZE or
+                                     entry is None):
+                    si.add(search_items)
+                    search_items = []
+                    self.last_indexed_pk = chunk_last_pk
+                if processed_count - last_commit_count >= 50000:
+                    # Do a commit every 50000 items, for good measure.
+                    commit_index(si)
+                    last_commit_count = processed_count
+                if entry is None:
+                    commit_index(si)
+                    break
+
+                elapsed = max(time.time() - start_time, 1e-9)
+                sys.stdout.write(
+                    "\rProcessed {}/{} ({:.0%}) at {:.0f} items/s. Last "
+                    "indexed pk: {}".format(
+                        processed_count,
+                        count,
+                        processed_count * 1.0 / max(count, 1),
+                        processed_count / elapsed,
+                        self.last_indexed_pk,
+                    ))
+                sys.stdout.flush()
+        except PipelineAborted:
+            return
+        except Exception:
+            abort.set()
+            raise
+
+    def _run_pipeline(self, queryset, start_pk, count, workers):
+        """Indexes the items in queryset using three stages that run at the
+        same time: a thread getting items from the DB, a pool of processes
+        building the search items, and a thread sending them to Solr.
+
+        The queues between the stages are bounded, so a slow stage holds up
+        the ones before it instead of letting memory run away.
+        """
+        abort = threading.Event()
+        batch_queue = Queue(maxsize=QUEUE_SIZE)
+        post_queue = Queue(maxsize=QUEUE_SIZE)
+        self.last_indexed_pk = start_pk
+
+        # Fork the builders with the courts already loaded, before any threads
+        # exist, and without an open DB connection that the children would
+        # share.
+        court_registry.all()
+        connection.close()
+        pool = multiprocessing.Pool(workers)
+        fetcher = threading.Thread(target=self._fetch_items,
+                                   args=(queryset, start_pk, batch_queue,
+                                         abort))
+        poster = threading.Thread(target=self._post_items,
+                                  args=(post_queue, count, abort))
+        fetcher.daemon = poster.daemon = True
+        fetcher.start()
+        poster.start()
+
+        try:
+            # Results are kept in the order the chunks were fetched, with a
+            # couple of chunks per builder in flight at once.
+            pending = deque()
+            while True:
+                items = self._get(batch_queue, abort)
+                if items is not None:
+                    pending.append((
+                        pool.apply_async(make_search_items, (items,)),
+                        len(items),
+                        items[-1].pk,
+                    ))
+                while pending and (items is None or
+                                   len(pending) >= workers * 2):
+                    result, chunk_size, chunk_last_pk = pending.popleft()
+                    self._put(post_queue,
+                              (result.get(), chunk_size, chunk_last_pk),
+                              abort)
+                if items is None:
+                    break
+            self._put(post_queue, None, abort)
+            poster.join()
+            if abort.is_set():
+                raise PipelineAborted()
+            pool.close()
+            pool.join()
+        except (Exception, KeyboardInterrupt):
+            abort.set()
+            pool.terminate()
+            pool.join()
+            self.stdout.write('\nStopped. To resume, run again with '
+                              '--start-pk %s\n' % self.last_indexed_pk)
+            raise
+        self.stdout.write('\n')
+
+    @staticmethod
+    def _put(queue, item, abort):
+        """Puts item on queue, unless the pipeline fails while waiting for
+        room on it.
+        """
+        while True:
+            if abort.is_set():
+                raise PipelineAborted()
+            try:
+                queue.put(item, timeout=1)
+                return
+            except Full:
+                pass
+
+    @staticmethod
+    def _get(queue, abort):
+        """Gets an item from queue, unless the pipeline fails while waiting
+        for one.
+        """
+        while True:
+            if abort.is_set():
+                raise PipelineAborted()
+            try:
+                return queue.get(timeout=1)
+            except Empty:
+                pass
+
     @print_timing
-    def add_or_update_all(self):
+    def add_or_update_all(self, start_pk=0, workers=1):
         """
         Iterates over the entire corpus, adding it to the index. Can be run on
         an empty index or an existing one.
@@ -248,10 +454,9 @@ class Command(BaseCommand):
         If run on an existing index, existing items will be updated.
         """
         self.stdout.write("Adding or updating all items...\n")
-        q = self.type.objects.all()
-        items = queryset_generator(q, chunksize=5000)
+        q = self.type.objects.filter(pk__gt=start_pk)
         count = q.count()
-        self._chunk_queryset_into_tasks(items, count)
+        self._run_pipeline(q, start_pk, count, workers)
 
     @print_timing
     def optimize(self):
@@ -266,14 +471,14 @@ class Command(BaseCommand):
     def commit(self):
         """Runs a simple commit command.
         """
-        self.si.commit()
+        commit_index(self.si)
 
     def handle(self, *args, **options):
         self.verbosity = int(options.get('verbosity', 1))
         if options.get('solr_url'):
             self.solr_url = options.get('solr_url')
-            self.si = sunburnt.SolrInterface(options.get('solr_url'),
-                                             mode='rw')
+            self.si = sunburnt.get_solr_interface(options.get('solr_url'),
+                                                  mode='rw')
         else:
             self.stderr.write("solr-url is a required parameter.\n")
             exit(1)
@@ -307,7 +512,8 @@ class Command(BaseCommand):
             if self.verbosity >= 1:
                 self.stdout.write('Running in update mode...\n')
             if options.get('everything'):
-                self.add_or_update_all()
+                self.add_or_update_all(options.get('start_pk'),
+                                       options.get('workers'))
             elif options.get('datetime'):
                 self.add_or_update_by_datetime(dt)
             elif options.get('query'):
@@ -1,5 +1,9 @@
+import logging
+import os
 import re
-from django.db.models.signals import pre_save
+from django.conf import settings as django_settings
+from django.db.models.signals import m2m_changed, post_delete, post_init, \
+    post_save, pre_save
 from django.dispatch import receiver
 from alert import settings
 from alert.lib.model_helpers import make_upload_path
@@ -9,6 +13,7 @@ from django.db import models
 from django.utils.text import slugify
 from django.utils.encoding import smart_unicode
 
+logger = logging.getLogger(__name__)
 
 # changes here need to be mirrored in the coverage page view and Solr configs
 # Note that spaces cannot be used in the keys, or else the SearchForm won't work
@@ -209,6 +214,15 @@ class Court(models.Model):
         ordering = ["position"]
 
 
+# The citation fields, in BlueBook order. See make_citation_string.
+CITATION_FIELDS = (
+    'neutral_cite', 'federal_cite_one', 'federal_cite_two',
+    'federal_cite_three', 'specialty_cite_one', 'state_cite_regional',
+    'state_cite_one', 'state_cite_two', 'state_cite_three', 'westlaw_cite',
+    'lexis_cite',
+)
+
+
 class Citation(models.Model):
     slug = models.SlugField(
         help_text="URL that the document should map to (the slug)",
@@ -553,6 +567,132 @@ class Document(models.Model):
         db_table = "Document"
 
 
+def log_citation_changes(lines):
+    """Append lines to the log of changes to the citation network, which
+    incremental PageRank applies to its last graph.
+
+    The lines go out in a single write to a file opened for appending, so the
+    lines from different processes don't get mixed together. If the log can't
+    be written, that's logged, and the save or delete goes ahead.
+    """
+    if not lines:
+        return
+    # Read from django.conf's settings, so tests can point it elsewhere.
+    path = django_settings.PAGERANK_CHANGE_LOG
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0644)
+        try:
+            os.write(fd, ''.join(lines))
+        finally:
+            os.close(fd)
+    except OSError, e:
+        # Saving the citations matters more than the log. A full run of
+        # PageRank picks up what's missing from it.
+        logger.error('Unable to log %s citation changes to %s: %s' %
+                     (len(lines), path, e))
+
+
+@receiver(m2m_changed, sender=Document.cases_cited.through)
+def log_cases_cited_changes(sender, instance, action, reverse, pk_set,
+                            **kwargs):
+    """Log the citations added to or removed from documents, as lines of:
+
+        +|- document id citation id
+    """
+    if action == 'post_add':
+        sign = '+'
+    elif action in ('post_remove', 'pre_clear'):
+        sign = '-'
+    else:
+        return
+    if action == 'pre_clear':
+        if reverse:
+            pk_set = instance.citing_opinions.values_list('pk', flat=True)
+        else:
+            pk_set = instance.cases_cited.values_list('pk', flat=True)
+    if reverse:
+        pairs = [(pk, instance.pk) for pk in pk_set]
+    else:
+        pairs = [(instance.pk, pk) for pk in pk_set]
+    log_citation_changes(['%s %s %s\n' % (sign, document_id, citation_id)
+                          for document_id, citation_id in pairs])
+
+
+@receiver(post_delete, sender=Document)
+def log_deleted_document(sender, instance, **kwargs):
+    """Log the deletion of a document, which takes its citations with it, as
+    a line of:
+
+        x document id
+    """
+    log_citation_changes(['x %s\n' % instance.pk])
+
+
+# The fields the entries of the citation index are made from, see
+# citations.citation_index.make_entries. Changes to anything else leave the
+# index alone.
+CITATION_INDEX_FIELDS = {
+    Document: ('citation_id', 'date_filed', 'precedential_status',
+               'docket_id'),
+    Citation: CITATION_FIELDS,
+    Docket: ('court_id',),
+}
+
+
+def get_citation_index_values(instance):
+    # Read from __dict__, so deferred fields aren't fetched one at a time.
+    return tuple(instance.__dict__.get(field) for field in
+                 CITATION_INDEX_FIELDS[instance.__class__])
+
+
+@receiver(post_init, sender=Document)
+@receiver(post_init, sender=Citation)
+@receiver(post_init, sender=Docket)
+def remember_citation_index_values(sender, instance, **kwargs):
+    """Note the values the citation index uses as they were loaded, to tell
+    whether a save changes them.
+    """
+    instance._citation_index_values = get_citation_index_values(instance)
+
+
+def refresh_citation_index(pks):
+    """Have every process update the citation index for the documents with
+    pks.
+    """
+    # Imported here, since the index is built from these models.
+    from alert.citations.citation_index import citation_index
+    citation_index.refresh(pks)
+
+
+@receiver(post_save, sender=Document)
+@receiver(post_save, sender=Citation)
+@receiver(post_save, sender=Docket)
+def update_citation_index(sender, instance, created, **kwargs):
+    """Update the citation index for the documents whose entries changed.
+
+    Documents are saved all the time, for their citation counts and so on,
+    so the index is only told about it when its fields change. New citations
+    and dockets don't have any documents yet.
+    """
+    values = get_citation_index_values(instance)
+    if not created and values == instance._citation_index_values:
+        return
+    instance._citation_index_values = values
+    if sender is Document:
+        refresh_citation_index([instance.pk])
+    elif not created:
+        if sender is Citation:
+            qs = Document.objects.filter(citation=instance)
+        else:
+            qs = Document.objects.filter(docket=instance)
+        refresh_citation_index(qs.values_list('pk', flat=True))
+
+
+@receiver(post_delete, sender=Document)
+def remove_from_citation_index(sender, instance, **kwargs):
+    refresh_citation_index([instance.pk])
+
+
 def save_doc_and_cite(doc, index):
     """Save a document and citation simultaneously.
 
@@ -0,0 +1,318 @@
+"""PageRank for the citation network, using sparse matrices.
+
+Documents are identified by their integer pks throughout. The graph is held
+as a scipy CSR matrix of the citations between them, and the ranks as a numpy
+vector, so millions of documents fit in a few hundred MB and each iteration of
+the power method is a single sparse matrix-vector product.
+"""
+import array
+import os
+
+import numpy as np
+from scipy import sparse
+
+from alert.lib.db_tools import keyset_chunks
+from alert.search.models import Document
+from django.conf import settings
+
+DAMPING = 0.85
+TOLERANCE = 1.0e-6
+MAX_ITERATIONS = 100
+
+# What to do with the rank of documents that cite nothing. 'uniform' shares
+# it out among every document, as NetworkX does. 'drop' lets it leak away,
+# and rescales the ranks after each iteration so they still add up to one.
+DANGLING_CHOICES = ('uniform', 'drop')
+
+
+class PageRankError(Exception):
+    """The power iteration did not converge."""
+    def __init__(self, message):
+        Exception.__init__(self, message)
+
+
+def get_citation_edges(chunksize=100000):
+    """Get every citation between two documents, as two arrays of pks: the
+    citing documents, and the cited ones.
+
+    The cases_cited join table has the citations each document cites, and is
+    streamed in a single pass, keyed on its own pks. Which documents have
+    those citations is then streamed from the documents, and the two are
+    joined here, as apply_citation_changes does for a few. Everything is
+    collected in compact arrays rather than lists of Python objects.
+    """
+    sources = array.array('l')
+    citation_ids = array.array('l')
+    rows = Document.cases_cited.through.objects.all()
+    for chunk in keyset_chunks(rows, chunksize,
+                               fields=('document_id', 'citation_id'),
+                               server_side=True):
+        for source, citation_id in chunk:
+            sources.append(source)
+            citation_ids.append(citation_id)
+
+    document_citation_ids = array.array('l')
+    document_pks = array.array('l')
+    documents = Document.objects.exclude(citation=None)
+    for chunk in keyset_chunks(documents, chunksize,
+                               fields=('citation_id', 'pk'),
+                               server_side=True):
+        for citation_id, pk in chunk:
+            document_citation_ids.append(citation_id)
+            document_pks.append(pk)
+
+    return join_citations(np.frombuffer(sources, dtype=np.int_),
+                          np.frombuffer(citation_ids, dtype=np.int_),
+                          np.frombuffer(document_citation_ids, dtype=np.int_),
+                          np.frombuffer(document_pks, dtype=np.int_))
+
+
+def join_citations(sources, citation_ids, document_citation_ids,
+                   document_pks):
+    """Turn citations of citation ids into citations of the documents that
+    have them. A citation that belongs to several documents makes an edge to
+    each of them, and one that belongs to none makes no edges.
+
+    Returns the citing and cited pks, as two arrays.
+    """
+    order = np.argsort(document_citation_ids, kind='mergesort')
+    document_citation_ids = document_citation_ids[order]
+    document_pks = document_pks[order]
+    first = np.searchsorted(document_citation_ids, citation_ids, 'left')
+    counts = np.searchsorted(document_citation_ids, citation_ids,
+                             'right') - first
+    # The index of every document of every citation, in order.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts,
+                                                  counts)
+    targets = document_pks[np.repeat(first, counts) + offsets]
+    return np.repeat(sources, counts), targets
+
+
+class CitationGraph(object):
+    """The citation network, as a sparse matrix.
+
+    Only documents that cite or are cited by something are in the graph. pks
+    holds their pks in sorted order, and the row and column numbers of the
+    matrix are indices into it. Row i of the matrix holds the documents that
+    cite document pks[i], which is the orientation the power iteration wants.
+    Repeated citations count once.
+    """
+    def __init__(self, sources, targets):
+        self.pks, inverse = np.unique(np.concatenate((sources, targets)),
+                                      return_inverse=True)
+        size = len(self.pks)
+        source_indices = inverse[:len(sources)]
+        target_indices = inverse[len(sources):]
+        matrix = sparse.csr_matrix(
+            (np.ones(len(sources)), (target_indices, source_indices)),
+            shape=(size, size),
+        )
+        matrix.sum_duplicates()
+        matrix.data[:] = 1
+        self.matrix = matrix
+        self.out_degree = np.asarray(matrix.sum(axis=0)).ravel()
+
+    def __len__(self):
+        return len(self.pks)
+
+    def indices_of(self, pks):
+        """Get the indices of pks in the graph, and a mask of which ones are
+        in the graph at all.
+        """
+        if len(self.pks) == 0:
+            return (np.zeros(len(pks), dtype=np.int_),
+                    np.zeros(len(pks), dtype=bool))
+        indices = np.searchsorted(self.pks, pks)
+        indices[indices == len(self.pks)] = 0
+        found = self.pks[indices] == pks
+        return indices, found
+
+
+def pagerank(graph, damping=DAMPING, tolerance=TOLERANCE,
+             max_iterations=MAX_ITERATIONS, dangling='uniform', start=None):
+    """Calculate the PageRank of every document in graph with the power
+    method.
+
+    Iteration stops when the ranks change by less than tolerance per
+    document, on average. start can be a vector of ranks to start from, such
+    as those of a previous run, which converges much sooner than starting
+    from scratch when the graph has hardly changed.
+
+    Returns a vector of ranks, in the order of graph.pks.
+    """
+    if dangling not in DANGLING_CHOICES:
+        raise ValueError("dangling must be one of %s" % (DANGLING_CHOICES,))
+    size = len(graph)
+    if size == 0:
+        return np.zeros(0)
+    if start is None:
+        x = np.ones(size) / size
+    else:
+        x = np.asarray(start, dtype=np.float64) / np.sum(start)
+
+    is_dangling = graph.out_degree == 0
+    inverse_out_degree = np.zeros(size)
+    inverse_out_degree[~is_dangling] = 1.0 / graph.out_degree[~is_dangling]
+    teleport = (1.0 - damping) / size
+
+    for _ in xrange(max_iterations):
+        x_last = x
+        x = damping * graph.matrix.dot(x_last * inverse_out_degree)
+        if dangling == 'uniform':
+            x += (damping * x_last[is_dangling].sum()) / size + teleport
+        else:
+            x += teleport
+            x /= x.sum()
+        if np.abs(x - x_last).sum() < size * tolerance:
+            return x
+    raise PageRankError("PageRank failed to converge in %s iterations."
+                        % max_iterations)
+
+
+def write_pagerank_file(path, pks, graph, ranks):
+    """Write the ranks of the documents to an external file for Solr.
+
+    pks are all the document pks, in sorted order, so the file comes out
+    sorted without another pass. Documents that aren't in the graph get the
+    lowest rank of those that are. The file is written next to path and then
+    moved into place, so Solr never sees half of it.
+    """
+    indices, found = graph.indices_of(pks)
+    if len(ranks):
+        values = np.where(found, ranks[indices], ranks.min())
+    else:
+        values = np.zeros(len(pks))
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        for pk, value in zip(pks.tolist(), values.tolist()):
+            f.write('{}={}\n'.format(pk, value))
+    os.rename(tmp_path, path)
+
+
+def get_document_pks(chunksize=100000):
+    """Get the pks of every document, in sorted order."""
+    pks = array.array('l')
+    for chunk in keyset_chunks(Document.objects.all(), chunksize,
+                               fields=('pk',), flat=True, server_side=True):
+        pks.extend(chunk)
+    return np.frombuffer(pks, dtype=np.int_)
+
+
+def edge_keys(sources, targets):
+    """Pack edges into single integers, so that sets of them can be handled
+    with numpy's set functions.
+    """
+    return (sources.astype(np.int64) << 32) | targets.astype(np.int64)
+
+
+def edges_from_keys(keys):
+    return keys >> 32, keys & 0xffffffff
+
+
+def save_snapshot(graph, ranks, sources, targets, path=None):
+    """Keep the edges of the graph and its ranks, for the next incremental
+    run to start from, at path, which defaults to
+    settings.PAGERANK_SNAPSHOT_PATH.
+    """
+    path = path or settings.PAGERANK_SNAPSHOT_PATH
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        np.savez(f, edges=np.unique(edge_keys(sources, targets)),
+                 pks=graph.pks, ranks=ranks)
+    os.rename(tmp_path, path)
+
+
+def load_snapshot(path=None):
+    """Get the edges, pks and ranks of the last run, or None if there wasn't
+    one.
+    """
+    path = path or settings.PAGERANK_SNAPSHOT_PATH
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        snapshot = np.load(f)
+        return dict((key, snapshot[key]) for key in snapshot.files)
+
+
+def take_citation_changes(path=None):
+    """Move the log of changes to the citation network aside, and get its
+    lines. path defaults to settings.PAGERANK_CHANGE_LOG.
+
+    Changes logged from now on go to a new log. The ones taken are kept until
+    finish_citation_changes is called, so a failed run doesn't lose them.
+    """
+    path = path or settings.PAGERANK_CHANGE_LOG
+    processing_path = path + '.processing'
+    if os.path.exists(path):
+        taken_path = '%s.%s' % (path, os.getpid())
+        os.rename(path, taken_path)
+        with open(taken_path) as taken, open(processing_path, 'a') as f:
+            f.write(taken.read())
+        os.remove(taken_path)
+    if not os.path.exists(processing_path):
+        return []
+    with open(processing_path) as f:
+        return f.readlines()
+
+
+def finish_citation_changes(path=None):
+    path = path or settings.PAGERANK_CHANGE_LOG
+    processing_path = path + '.processing'
+    if os.path.exists(processing_path):
+        os.remove(processing_path)
+
+
+def apply_citation_changes(edges, lines):
+    """Apply the lines of the change log, in order, to a set of edge keys,
+    returning the new set.
+
+    The log has citation ids rather than the documents they belong to, so
+    those are looked up in a single query.
+    """
+    changes = []
+    deleted = set()
+    citation_ids = set()
+    for line in lines:
+        fields = line.split()
+        if len(fields) == 3 and fields[0] in '+-':
+            changes.append((fields[0], int(fields[1]), int(fields[2])))
+            citation_ids.add(int(fields[2]))
+        elif len(fields) == 2 and fields[0] == 'x':
+            deleted.add(int(fields[1]))
+
+    documents_by_citation = {}
+    for citation_id, pk in Document.objects.filter(
+            citation_id__in=citation_ids).values_list('citation_id', 'pk'):
+        documents_by_citation.setdefault(citation_id, []).append(pk)
+
+    # The last change to each edge wins.
+    latest = {}
+    for sign, source, citation_id in changes:
+        for target in documents_by_citation.get(citation_id, []):
+            latest[(source << 32) | target] = (sign == '+')
+    added = np.array([key for key, add in latest.iteritems() if add],
+                     dtype=np.int64)
+    removed = np.array([key for key, add in latest.iteritems() if not add],
+                       dtype=np.int64)
+
+    edges = np.union1d(edges[~np.in1d(edges, removed)], added)
+    if deleted:
+        deleted = np.array(sorted(deleted), dtype=np.int64)
+        sources, targets = edges_from_keys(edges)
+        edges = edges[~(np.in1d(sources, deleted) | np.in1d(targets, deleted))]
+    return edges
+
+
+def carry_over_ranks(graph, snapshot):
+    """Make a starting vector for graph out of the ranks of the last run.
+
+    Documents that are new to the graph start with the average rank.
+    """
+    old_pks = snapshot['pks']
+    old_ranks = snapshot['ranks']
+    if len(old_pks) == 0:
+        return None
+    indices = np.searchsorted(old_pks, graph.pks)
+    indices[indices == len(old_pks)] = 0
+    found = old_pks[indices] == graph.pks
+    return np.where(found, old_ranks[indices], 1.0 / max(len(graph), 1))
@@ -3,7 +3,10 @@ from datetime import time
 from django.core.urlresolvers import NoReverseMatch
 from django.template import Context
 from django.template import loader
-from alert.opinion_page.views import make_citation_string
+from django.utils.html import escape, strip_tags
+from alert.lib.db_tools import keyset_chunks
+from alert.search.models import CITATION_FIELDS
+from alert.search.court_registry import court_registry
 
 
 class InvalidDocumentError(Exception):
@@ -16,51 +19,94 @@ class InvalidDocumentError(Exception):
 null_map = dict.fromkeys(range(0, 10) + range(11, 13) + range(14, 32))
 
 
+OPINION_TEXT_TEMPLATE = u'%s\n\n' + u'\n'.join([u'%s'] * 8) + u'\n'
+
+
+def make_opinion_text(item, court):
+    """Assemble the text of an opinion for the index.
+
+    This makes the same text as rendering search/indexes/opinion_text.txt,
+    autoescaping included, without going through the template engine.
+    """
+    if item.html_lawbox:
+        body = strip_tags(item.html_lawbox)
+    elif item.html:
+        body = strip_tags(item.html)
+    else:
+        body = item.plain_text or u''
+    values = [body, item.citation.case_name, item.precedential_status,
+              item.sha1, court.full_name, court.citation_string, court.pk,
+              item.judges, item.nature_of_suit]
+    return OPINION_TEXT_TEMPLATE % tuple(
+        escape(value) if value is not None else u'' for value in values)
+
+
 class SearchDocument(object):
-    def __init__(self, item):
+    def __init__(self, item, court=None):
+        docket = item.docket
+        if court is None:
+            court = court_registry.get(docket.court_id)
         # Standard fields
         self.id = item.pk
         if item.date_filed is not None:
             self.dateFiled = datetime.combine(item.date_filed, time())  # Midnight, PST
         self.citeCount = item.citation_count
-        self.court = item.docket.court.full_name
-        self.court_id = item.docket.court.pk
-        self.court_citation_string = item.docket.court.citation_string
+        self.court = court.full_name
+        self.court_id = court.pk
+        self.court_citation_string = court.citation_string
+        citation = item.citation
         try:
-            self.caseName = item.citation.case_name
+            self.caseName = citation.case_name
             self.absolute_url = item.get_absolute_url()
         except AttributeError:
             raise InvalidDocumentError("Unable to save to index due to missing Citation object.")
         except NoReverseMatch:
             raise InvalidDocumentError("Unable to save to index due to missing absolute_url (court_id: %s, item.pk: %s). "
                                        "Might the court have in_use set to False?"
-                                       % (self.docket.court_id, item.pk))
+                                       % (court.pk, item.pk))
         self.judge = item.judges
         self.suitNature = item.nature_of_suit
-        self.docketNumber = item.docket.docket_number
-        self.lexisCite = item.citation.lexis_cite
-        self.neutralCite = item.citation.neutral_cite
+        self.docketNumber = docket.docket_number
+        self.lexisCite = citation.lexis_cite
+        self.neutralCite = citation.neutral_cite
         self.status = item.get_precedential_status_display()
         self.source = item.source
         self.download_url = item.download_url
         self.local_path = unicode(item.local_path)
-        self.citation = make_citation_string(item)
+        self.citation = ', '.join(
+            [cite for cite in [getattr(citation, field)
+                               for field in CITATION_FIELDS] if cite])
         # Assign the docket number and/or the citation to the caseNumber field
-        if item.citation and item.docket.docket_number:
-            self.caseNumber = '%s, %s' % (self.citation, item.docket.docket_number)
-        elif item.citation:
+        if citation and docket.docket_number:
+            self.caseNumber = '%s, %s' % (self.citation, docket.docket_number)
+        elif citation:
             self.caseNumber = self.citation
-        elif item.docket.docket_number:
-            self.caseNumber = self.docket.docket_number
+        elif docket.docket_number:
+            self.caseNumber = docket.docket_number
 
-        # Load the document text using a template for cleanup and concatenation
-        text_template = loader.get_template('search/indexes/opinion_text.txt')
-        c = Context({'object': item})
-        self.text = '%s %s' % (text_template.render(c).translate(null_map), self.caseNumber)
+        # Load the document text, cleaned up and concatenated
+        self.text = '%s %s' % (make_opinion_text(item, court).translate(null_map), self.caseNumber)
 
         # Faceting fields
-        self.status_exact = item.get_precedential_status_display()
-        self.court_exact = item.docket.court.pk
+        self.status_exact = self.status
+        self.court_exact = court.pk
+
+    @classmethod
+    def from_queryset(cls, queryset, chunksize=500):
+        """Make SearchDocuments for every item in a queryset of Documents.
+
+        The dockets and citations are selected along with the items, a chunk
+        at a time, and the courts come from the cache, so this makes one query
+        per chunk instead of several per item. Items that can't be made into
+        a SearchDocument are skipped.
+        """
+        for items in keyset_chunks(
+                queryset.select_related('docket', 'citation'), chunksize):
+            for item in items:
+                try:
+                    yield cls(item)
+                except InvalidDocumentError:
+                    print "Unable to parse: %s" % item
 
 
 class SearchAudioFile(object):
@@ -1,6 +1,7 @@
 import os
 import socket
 import sys
+from datetime import datetime, timedelta
 from alert.lib.sunburnt import SolrError
 from audio.models import Audio
 
@@ -9,26 +10,37 @@ sys.path.append(INSTALL_ROOT)
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "settings")
 from django.conf import settings
 
+from alert.custom_filters.templatetags.text_filters import naturalduration
+from alert.lib import search_utils
 from alert.lib import sunburnt
+from alert.search.forms import SearchForm
 from alert.search.models import Citation
 from alert.search.models import Document
 from alert.search.search_indexes import InvalidDocumentError, SearchAudioFile
 from alert.search.search_indexes import SearchDocument
+from alert.stats.models import Stat
 from celery import task
-
-
-@task
-def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
-    """Adds an item to a solr index.
-
-    This function is for use with the update_index command. It's slightly
-    different than the commands below because it expects a Django object,
-    rather than a primary key. This rejects the standard Celery advice about
-    not passing objects around, but thread safety shouldn't be an issue since
-    this is only used by the update_index command, and we want to query and
-    build the SearchDocument objects in the task, not in its caller.
+from celery.task import periodic_task
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db.models import Sum
+from django.utils.timezone import make_aware, utc
+
+# The homepage is rendered from a snapshot that's refreshed this often. It's
+# kept for longer, so that it doesn't expire between refreshes.
+HOMEPAGE_SNAPSHOT_KEY = 'homepage-snapshot'
+HOMEPAGE_SNAPSHOT_INTERVAL = timedelta(minutes=10)
+HOMEPAGE_SNAPSHOT_TIMEOUT = 60 * 60
+
+
+def make_search_items(items):
+    """Turns Django objects into the objects that get sent to Solr, skipping
+    any that can't be made into one.
+
+    This does no querying of its own if the related objects of items have
+    been selected already, so it can be used in processes that have no
+    database connection.
     """
-    si = sunburnt.SolrInterface(solr_url, mode='w')
     if hasattr(items, "items") or not hasattr(items, "__iter__"):
         # If it's a dict or a single item make it a list
         items = [items]
@@ -45,7 +57,22 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
             print "ValueError trying to add: %s\n  %s" % (item, e)
         except InvalidDocumentError:
             print "Unable to parse: %s" % item
+    return search_item_list
+
+
+@task
+def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
+    """Adds an item to a solr index.
 
+    This function is for use with the update_index command. It's slightly
+    different than the commands below because it expects a Django object,
+    rather than a primary key. This rejects the standard Celery advice about
+    not passing objects around, but thread safety shouldn't be an issue since
+    this is only used by the update_index command, and we want to query and
+    build the SearchDocument objects in the task, not in its caller.
+    """
+    si = sunburnt.get_solr_interface(solr_url, mode='w')
+    search_item_list = make_search_items(items)
     try:
         si.add(search_item_list)
     except socket.error, exc:
@@ -54,51 +81,50 @@ def add_or_update_items(items, solr_url=settings.SOLR_OPINION_URL):
 
 @task
 def delete_items(items):
-    si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     si.delete(list(items))
-    si.commit()
+    search_utils.commit_index(si)
 
 
 @task
 def add_or_update_docs(item_pks):
-    si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
-    item_list = []
-    for pk in item_pks:
-        item = Document.objects.get(pk=pk)
-        item_list.append(SearchDocument(item))
+    si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
+    item_list = list(SearchDocument.from_queryset(
+        Document.objects.filter(pk__in=item_pks)))
     si.add(item_list)
-    si.commit()
+    search_utils.commit_index(si, [item.court_id for item in item_list])
 
 
 @task
 def add_or_update_audio_files(item_pks):
-    si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     item_list = []
     for pk in item_pks:
         item = Audio.objects.get(pk=pk)
         item_list.append(SearchDocument(item))
     si.add(item_list)
-    si.commit()
+    search_utils.commit_index(si, [item.court_id for item in item_list])
 
 
 @task
 def delete_item(pk, solr_url):
     """Deletes the item from the index.
     """
-    si = sunburnt.SolrInterface(solr_url, mode='w')
+    si = sunburnt.get_solr_interface(solr_url, mode='w')
     si.delete(pk)
-    si.commit()
+    search_utils.commit_index(si)
 
 
 @task
 def add_or_update_doc(pk, force_commit=True):
     """Updates the document in the index. Called by Document save function.
     """
-    si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     try:
-        si.add(SearchDocument(Document.objects.get(pk=pk)))
+        item = SearchDocument(Document.objects.get(pk=pk))
+        si.add(item)
         if force_commit:
-            si.commit()
+            search_utils.commit_index(si, [item.court_id])
     except SolrError, exc:
         add_or_update_doc.retry(exc=exc, countdown=30)
 
@@ -107,11 +133,12 @@ def add_or_update_doc(pk, force_commit=True):
 def add_or_update_audio_file(pk, force_commit=True):
     """Updates the document in the index. Called by Document save function.
     """
-    si = sunburnt.SolrInterface(settings.SOLR_AUDIO_URL, mode='w')
+    si = sunburnt.get_solr_interface(settings.SOLR_AUDIO_URL, mode='w')
     try:
-        si.add(SearchAudioFile(Audio.objects.get(pk=pk)))
+        item = SearchAudioFile(Audio.objects.get(pk=pk))
+        si.add(item)
         if force_commit:
-            si.commit()
+            search_utils.commit_index(si, [item.court_id])
     except SolrError, exc:
         add_or_update_audio_file.retry(exc=exc, countdown=30)
 
@@ -121,10 +148,83 @@ def update_cite(citation_id, force_commit=False):
     """If a citation and a document are both updated simultaneously, we will
     needlessly update the index twice. No easy way around it.
     """
-    si = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='w')
+    si = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='w')
     cite = Citation.objects.get(pk=citation_id)
-    for doc in cite.parent_documents.all():
-        search_doc = SearchDocument(doc)
-        si.add(search_doc)
+    item_list = list(SearchDocument.from_queryset(
+        cite.parent_documents.all()))
+    si.add(item_list)
     if force_commit:
-        si.commit()
+        search_utils.commit_index(si, [item.court_id for item in item_list])
+
+
+def get_latest_results(url, order_by, type, rows=5):
+    """Get the newest items in a Solr index, in the shape the search result
+    template expects of a page of results.
+    """
+    search_form = SearchForm({})
+    search_form.is_valid()
+    cd = search_form.cleaned_data
+    cd['order_by'] = order_by
+    cd['type'] = type
+    conn = sunburnt.get_solr_interface(url, mode='r')
+    params = search_utils.build_main_query(cd)
+    params['rows'] = rows
+    response = conn.raw_query(**params).execute()
+    results = {
+        'object_list': response.result.docs,
+        'number': 1,
+        'paginator': {'count': response.result.numFound},
+    }
+    return results, cd, conn
+
+
+def make_homepage_snapshot():
+    """Gather the numbers and latest items shown on the homepage, and cache
+    them.
+    """
+    results, cd, conn = get_latest_results(
+        settings.SOLR_OPINION_URL, 'dateFiled desc', 'o')
+    results_oa = get_latest_results(
+        settings.SOLR_AUDIO_URL, 'dateArgued desc', 'oa')[0]
+
+    ten_days_ago = make_aware(datetime.today() - timedelta(days=10), utc)
+    recent_stats = Stat.objects.filter(date_logged__gte=ten_days_ago)
+    snapshot = {
+        'results': results,
+        'results_oa': results_oa,
+        'stat_facet_fields': search_utils.place_facet_queries(cd, conn),
+        'alerts_in_last_ten': recent_stats.filter(
+            name__contains='alerts.sent').aggregate(
+            Sum('count'))['count__sum'],
+        'queries_in_last_ten': recent_stats.filter(
+            name='search.results').aggregate(Sum('count'))['count__sum'],
+        'bulk_in_last_ten': recent_stats.filter(
+            name__contains='bulk_data').aggregate(Sum('count'))['count__sum'],
+        'api_in_last_ten': recent_stats.filter(
+            name__contains='api').aggregate(Sum('count'))['count__sum'],
+        'users_in_last_ten': User.objects.filter(
+            date_joined__gte=ten_days_ago).count(),
+        'opinions_in_last_ten': Document.objects.filter(
+            time_retrieved__gte=ten_days_ago).count(),
+        'oral_arguments_in_last_ten': Audio.objects.filter(
+            time_retrieved__gte=ten_days_ago).count(),
+        'days_of_oa': naturalduration(
+            Audio.objects.aggregate(Sum('duration'))['duration__sum'],
+            as_dict=True,
+        )['d'],
+    }
+    cache.set(HOMEPAGE_SNAPSHOT_KEY, snapshot, HOMEPAGE_SNAPSHOT_TIMEOUT)
+    return snapshot
+
+
+def get_homepage_snapshot():
+    """Get the cached homepage snapshot, making one if there isn't one."""
+    snapshot = cache.get(HOMEPAGE_SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = make_homepage_snapshot()
+    return snapshot
+
+
+@periodic_task(run_every=HOMEPAGE_SNAPSHOT_INTERVAL)
+def update_homepage_snapshot():
+    make_homepage_snapshot()
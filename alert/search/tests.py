@@ -2,12 +2,14 @@ import StringIO
 import os
 import shutil
 import simplejson
+import tempfile
 import time
 
 from collections import OrderedDict
 from datadiff import diff
 import datetime
 from django.core.files.base import ContentFile
+from django.template import Context, loader
 from django.test import TestCase
 from django.test.client import Client
 from django.test.utils import override_settings
@@ -15,7 +17,11 @@ from lxml import html
 
 from alert.lib.solr_core_admin import (get_data_dir_location)
 from alert.lib.test_helpers import CitationTest, SolrTestCase
+from alert.search.court_registry import court_registry
+from alert.search.forms import SearchForm
+from alert.search import pagerank
 from alert.search.models import Citation, Court, Document, Docket
+from alert.search.search_indexes import SearchDocument, make_opinion_text
 from alert import settings
 from alert.search.management.commands.cl_calculate_pagerank_networkx import \
     Command
@@ -82,6 +88,77 @@ class DocketUpdateSignalTest(TestCase):
         self.assertEqual(changed_docket.case_name, new_case_name)
 
 
+class SearchDocumentTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def setUp(self):
+        court = Court.objects.get(pk='test')
+        self.docs = []
+        for html in (u'<p>Smith & Wesson said "hi"</p>', u''):
+            cite = Citation(case_name=u'Smith & Wesson v. <Jones>',
+                            federal_cite_one=u'1 F.2d 1')
+            cite.save(index=False)
+            docket = Docket(case_name=cite.case_name, court=court)
+            docket.save()
+            doc = Document(citation=cite, docket=docket, html=html,
+                           plain_text=u'Plain & simple',
+                           date_filed=datetime.date(2000, 1, 1))
+            doc.save(index=False)
+            self.docs.append(doc)
+
+    def test_text_matches_the_template(self):
+        """Is the assembled text the same as rendering the old template?"""
+        text_template = loader.get_template('search/indexes/opinion_text.txt')
+        for doc in self.docs:
+            rendered = text_template.render(Context({'object': doc}))
+            self.assertEqual(
+                make_opinion_text(doc, doc.docket.court).split(),
+                rendered.split(),
+            )
+
+    def test_from_queryset(self):
+        """Do we get the same documents in bulk as one at a time?"""
+        qs = Document.objects.filter(pk__in=[doc.pk for doc in self.docs])
+        bulk = list(SearchDocument.from_queryset(qs, chunksize=1))
+        self.assertEqual(
+            [search_doc.__dict__ for search_doc in bulk],
+            [SearchDocument(doc).__dict__ for doc in self.docs],
+        )
+
+
+class CourtRegistryTest(TestCase):
+    fixtures = ['test_court.json']
+
+    def test_lookups(self):
+        self.assertEqual(court_registry.get('test').short_name,
+                         u'Testing Supreme Court')
+        self.assertEqual(court_registry.get_by_citation_string(u'Tes').pk,
+                         'test')
+        self.assertIn('test', [court.pk for court in
+                               court_registry.get_by_jurisdiction('F')])
+        self.assertRaises(Court.DoesNotExist, court_registry.get, 'nope')
+
+    def test_citation_string_lookup(self):
+        """Are courts found by the start of their citation strings, including
+        after one is changed?"""
+        self.assertIsNone(court_registry.get_by_citation_string(u'Nowhere'))
+        court = Court.objects.get(pk='test')
+        court.citation_string = u'Nowhere Ct.'
+        court.save()
+        self.assertEqual(
+            court_registry.get_by_citation_string(u'Nowhere  Ct').pk, 'test')
+
+    def test_reloads_when_a_court_is_saved(self):
+        """Do changes to a court show up, including in the search form?"""
+        court = Court.objects.get(pk='test')
+        court.short_name = u'Renamed Court'
+        court.save()
+        self.assertEqual(court_registry.get('test').short_name,
+                         u'Renamed Court')
+        self.assertEqual(SearchForm().fields['court_test'].label,
+                         u'Renamed Court')
+
+
 class SearchTest(SolrTestCase):
     def test_a_simple_text_query(self):
         """Does typing into the main query box work?"""
@@ -468,6 +545,25 @@ class ApiTest(SolrTestCase):
                     (v, num_actual_results,
                      self.expected_num_results_opinion))
 
+    def test_api_fields_filter(self):
+        """Do we get back only the fields asked for, whether they come from
+        the database or from Solr?"""
+        self.client.login(username='pandora', password='password')
+        for endpoint, fields in (('document', ['id', 'date_filed']),
+                                 ('cited-by', ['id', 'court']),
+                                 ('search', ['id', 'case_name'])):
+            r = self.client.get('/api/rest/v2/%s/?format=json&id=1&fields=%s'
+                                % (endpoint, ','.join(fields)))
+            json = simplejson.loads(r.content)
+            self.assertTrue(json['objects'])
+            for o in json['objects']:
+                self.assertEqual(
+                    sorted(o.keys()),
+                    sorted(fields),
+                    msg="Got unexpected fields from the %s endpoint: %s" %
+                        (endpoint, o.keys())
+                )
+
     def test_api_able_to_login(self):
         """Can we login properly?"""
         username, password = 'pandora', 'password'
@@ -500,17 +596,47 @@ class FeedTest(SolrTestCase):
                     "Instead found: %s" % (count, test, node_count)
             )
 
+    def test_conditional_get(self):
+        """Do feed readers that are up to date get a 304?"""
+        response = self.client.get('/feed/court/test/')
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        response = self.client.get('/feed/court/test/',
+                                   HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        response = self.client.get('/feed/court/test/',
+                                   HTTP_IF_NONE_MATCH='"stale"')
+        self.assertEqual(response.status_code, 200)
+
 
 class PagerankTest(CitationTest):
+    def setUp(self):
+        # Keep the snapshot and the change log of the tests to themselves.
+        self.tmp_dir = tempfile.mkdtemp()
+        self.snapshot_path = os.path.join(self.tmp_dir, 'snapshot.npz')
+        self.change_log_path = os.path.join(self.tmp_dir, 'changes')
+        self.paths = override_settings(
+            PAGERANK_SNAPSHOT_PATH=self.snapshot_path,
+            PAGERANK_CHANGE_LOG=self.change_log_path,
+        )
+        self.paths.enable()
+        super(PagerankTest, self).setUp()
+
+    def tearDown(self):
+        self.paths.disable()
+        shutil.rmtree(self.tmp_dir)
+
+    def do_pagerank(self, **kwargs):
+        Command().do_pagerank(chown=False, snapshot_path=self.snapshot_path,
+                              change_log_path=self.change_log_path, **kwargs)
+
     def test_pagerank_calculation(self):
         """Create a few Documents and fake citation relation among them, then
         run the pagerank algorithm. Check whether this simple case can get the
         correct result.
         """
         #calculate pagerank of these 3 document
-        comm = Command()
-        self.verbosity = 1
-        comm.do_pagerank(chown=False)
+        self.do_pagerank()
 
         # read in the pagerank file, converting to a dict
         pr_values_from_file = {}
@@ -533,3 +659,54 @@ class PagerankTest(CitationTest):
                     "%s" % (key, pr_values_from_file[key],
                             answers[key], )
             )
+
+    @staticmethod
+    def read_pagerank_file():
+        pr_values_from_file = {}
+        with open(get_data_dir_location() + "external_pagerank") as f:
+            for line in f:
+                pk, value = line.split('=')
+                pr_values_from_file[pk] = float(value.strip())
+        return pr_values_from_file
+
+    def test_incremental_pagerank(self):
+        """Does applying a new citation to the last run give the same answer
+        as starting over?
+        """
+        self.do_pagerank()
+        d1, d2, d3 = Document.objects.order_by('pk')
+        d2.cases_cited.add(d1.citation)
+        self.assertTrue(os.path.exists(self.change_log_path))
+
+        self.do_pagerank(incremental=True)
+        incremental_values = self.read_pagerank_file()
+        self.do_pagerank()
+        full_values = self.read_pagerank_file()
+        for key, value in full_values.iteritems():
+            self.assertAlmostEqual(incremental_values[key], value, places=4)
+
+    def test_citation_edges(self):
+        """Is every document with a cited citation found, however the rows
+        fall into chunks?"""
+        d1, d2, d3 = Document.objects.order_by('pk')
+        # A second document with the citation of d3, which d1 and d2 cite.
+        docket = Docket(case_name=u'c3 again', court=self.court)
+        docket.save()
+        d4 = Document(date_filed=datetime.date.today(), citation=d3.citation,
+                      docket=docket)
+        d4.save(index=False)
+
+        sources, targets = pagerank.get_citation_edges(chunksize=2)
+        self.assertEqual(
+            sorted(zip(sources.tolist(), targets.tolist())),
+            sorted([(d1.pk, d2.pk), (d1.pk, d3.pk), (d1.pk, d4.pk),
+                    (d2.pk, d3.pk), (d2.pk, d4.pk), (d3.pk, d1.pk)]),
+        )
+
+    def test_unwritable_change_log(self):
+        """Are citations still saved when the change log can't be written?"""
+        d1, d2, d3 = Document.objects.order_by('pk')
+        with self.settings(PAGERANK_CHANGE_LOG=os.path.join(
+                self.tmp_dir, 'missing', 'changes')):
+            d2.cases_cited.add(d1.citation)
+        self.assertIn(d1.citation, d2.cases_cited.all())
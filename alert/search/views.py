@@ -1,11 +1,7 @@
 import logging
-from datetime import datetime, timedelta
 
-from django.contrib.auth.models import User
-from django.db.models import Sum
-from django.utils.timezone import utc, make_aware
 from django.contrib import messages
-from django.core.paginator import EmptyPage, PageNotAnInteger, Paginator
+from django.core.paginator import EmptyPage, Paginator
 from django.shortcuts import render_to_response, get_object_or_404
 from django.shortcuts import HttpResponseRedirect
 from django.template import RequestContext
@@ -13,20 +9,33 @@ from django.views.decorators.cache import never_cache
 
 from alert.alerts.forms import CreateAlertForm
 from alert.alerts.models import Alert
-from alert.audio.models import Audio
-from alert.custom_filters.templatetags.text_filters import naturalduration
 from alert.lib import search_utils
-from alert.lib import sunburnt
 from alert.lib.bot_detector import is_bot
 from alert.search.forms import SearchForm, _clean_form
 from alert import settings
-from alert.search.models import Document, Court
-from alert.stats import tally_stat, Stat
+from alert.search.court_registry import court_registry
+from alert.search.tasks import get_homepage_snapshot
+from alert.stats import tally_stat
 
 
 logger = logging.getLogger(__name__)
 
 
+def get_results_page(url, main_params, page, rows):
+    """Get a page of search results, for use with a Paginator, and the facet
+    counts that came with them.
+    """
+    params = main_params.copy()
+    params.update({
+        'start': (page - 1) * rows,
+        'rows': rows,
+    })
+    results = search_utils.get_search_results(url, params)
+    return (search_utils.SolrResults(results['docs'], results['numFound'],
+                                     params['start']),
+            results['facet_fields'])
+
+
 def do_search(request, rows=20, order_by=None, type=None):
 
     # Bind the search form.
@@ -41,21 +50,16 @@ def do_search(request, rows=20, order_by=None, type=None):
         search_form = _clean_form(request, cd)
 
         try:
+            main_params = search_utils.build_main_query(cd)
             if cd['type'] == 'o':
-                conn = sunburnt.SolrInterface(
-                    settings.SOLR_OPINION_URL, mode='r')
-                stat_facet_fields = search_utils.place_facet_queries(cd, conn)
-                status_facets = search_utils.make_stats_variable(
-                    stat_facet_fields, search_form)
+                url = settings.SOLR_OPINION_URL
+                # The status facets come back with the results, in one
+                # request.
+                search_utils.add_status_facet(main_params)
             elif cd['type'] == 'oa':
-                conn = sunburnt.SolrInterface(
-                    settings.SOLR_AUDIO_URL, mode='r')
-                status_facets = None
-            results_si = conn.raw_query(**search_utils.build_main_query(cd))
+                url = settings.SOLR_AUDIO_URL
 
-            courts = Court.objects.filter(in_use=True).values(
-                'pk', 'short_name', 'jurisdiction',
-                'has_oral_argument_scraper')
+            courts = court_registry.search_values()
             courts, court_count_human, court_count = search_utils\
                 .merge_form_with_courts(courts, search_form)
 
@@ -69,18 +73,30 @@ def do_search(request, rows=20, order_by=None, type=None):
         logger.warning("Invalid form when loading search page with request: %s" % request.GET)
         return {'error': True}
 
-    # Set up pagination
+    # Set up pagination. Only the requested page is fetched from Solr (or the
+    # cache), along with the count of all the results.
     try:
-        paginator = Paginator(results_si, rows)
-        page = request.GET.get('page', 1)
         try:
-            paged_results = paginator.page(page)
-        except PageNotAnInteger:
+            page = max(int(request.GET.get('page', 1)), 1)
+        except ValueError:
             # If page is not an integer, deliver first page.
-            paged_results = paginator.page(1)
+            page = 1
+        results, facet_fields = get_results_page(url, main_params, page,
+                                                 rows)
+        paginator = Paginator(results, rows)
+        try:
+            paged_results = paginator.page(page)
         except EmptyPage:
             # If page is out of range (e.g. 9999), deliver last page of results.
+            results, facet_fields = get_results_page(
+                url, main_params, paginator.num_pages, rows)
+            paginator = Paginator(results, rows)
             paged_results = paginator.page(paginator.num_pages)
+        if cd['type'] == 'o':
+            status_facets = search_utils.make_stats_variable(facet_fields,
+                                                             search_form)
+        else:
+            status_facets = None
     except Exception, e:
         # Catches any Solr errors, and aborts.
         logger.warning("Error loading pagination on search page with request: %s" % request.GET)
@@ -171,57 +187,31 @@ def show_results(request):
             if not is_bot(request):
                 tally_stat('search.homepage_loaded')
 
-            # Load the render_dict with good results that can be shown in the
-            # "Latest Cases" section
-            render_dict.update(do_search(request, rows=5,
-                                         order_by='dateFiled desc'))
-            # Get the results from the oral arguments as well
-            oa_dict = do_search(request, rows=5, order_by='dateArgued desc',
-                                type='oa')
-            render_dict.update({'results_oa': oa_dict['results']})
-            # But give it a fresh form for the advanced search section
-            render_dict.update({'search_form': SearchForm(request.GET)})
-            ten_days_ago = make_aware(datetime.today() - timedelta(days=10),
-                                      utc)
-            alerts_in_last_ten = Stat.objects\
-                .filter(
-                    name__contains='alerts.sent',
-                    date_logged__gte=ten_days_ago)\
-                .aggregate(Sum('count'))['count__sum']
-            queries_in_last_ten = Stat.objects\
-                .filter(
-                    name='search.results',
-                    date_logged__gte=ten_days_ago) \
-                .aggregate(Sum('count'))['count__sum']
-            bulk_in_last_ten = Stat.objects\
-                .filter(
-                    name__contains='bulk_data',
-                    date_logged__gte=ten_days_ago)\
-                .aggregate(Sum('count'))['count__sum']
-            api_in_last_ten = Stat.objects \
-                .filter(
-                    name__contains='api',
-                    date_logged__gte=ten_days_ago) \
-                .aggregate(Sum('count'))['count__sum']
-            users_in_last_ten = User.objects\
-                .filter(date_joined__gte=ten_days_ago).count()
-            opinions_in_last_ten = Document.objects\
-                .filter(time_retrieved__gte=ten_days_ago).count()
-            oral_arguments_in_last_ten = Audio.objects\
-                .filter(time_retrieved__gte=ten_days_ago).count()
-            days_of_oa = naturalduration(
-                Audio.objects.aggregate(Sum('duration'))['duration__sum'],
-                as_dict=True,
-            )['d']
+            # The latest cases and the numbers come from a snapshot that's
+            # refreshed in the background.
+            snapshot = get_homepage_snapshot()
+            search_form = SearchForm(request.GET)
+            courts = court_registry.search_values()
+            courts, court_count_human, court_count = search_utils\
+                .merge_form_with_courts(courts, search_form)
             render_dict.update({
-                'alerts_in_last_ten': alerts_in_last_ten,
-                'queries_in_last_ten': queries_in_last_ten,
-                'opinions_in_last_ten': opinions_in_last_ten,
-                'oral_arguments_in_last_ten': oral_arguments_in_last_ten,
-                'bulk_in_last_ten': bulk_in_last_ten,
-                'api_in_last_ten': api_in_last_ten,
-                'users_in_last_ten': users_in_last_ten,
-                'days_of_oa': days_of_oa,
+                'search_form': search_form,
+                'results': snapshot['results'],
+                'results_oa': snapshot['results_oa'],
+                'courts': courts,
+                'court_count_human': court_count_human,
+                'court_count': court_count,
+                'status_facets': search_utils.make_stats_variable(
+                    snapshot['stat_facet_fields'], search_form),
+                'alerts_in_last_ten': snapshot['alerts_in_last_ten'],
+                'queries_in_last_ten': snapshot['queries_in_last_ten'],
+                'opinions_in_last_ten': snapshot['opinions_in_last_ten'],
+                'oral_arguments_in_last_ten':
+                    snapshot['oral_arguments_in_last_ten'],
+                'bulk_in_last_ten': snapshot['bulk_in_last_ten'],
+                'api_in_last_ten': snapshot['api_in_last_ten'],
+                'users_in_last_ten': snapshot['users_in_last_ten'],
+                'days_of_oa': snapshot['days_of_oa'],
                 'private': False
             })
             return render_to_response(
@@ -164,6 +164,17 @@ STATIC_ROOT = os.path.join(INSTALL_ROOT, 'alert/assets/static/')
 # Where should the bulk data be stored?
 BULK_DATA_DIR = os.path.join(INSTALL_ROOT, 'alert/assets/media/bulk-data/')
 
+# Where the citation index is written by cl_build_citation_index
+CITATION_INDEX_PATH = os.path.join(INSTALL_ROOT, 'alert/assets/media/citation_index')
+
+# Where changes to the citation network are logged, and where the last
+# PageRank run is kept, for incremental PageRank.
+PAGERANK_CHANGE_LOG = os.path.join(INSTALL_ROOT, 'alert/assets/media/pagerank_changes')
+PAGERANK_SNAPSHOT_PATH = os.path.join(INSTALL_ROOT, 'alert/assets/media/pagerank_snapshot.npz')
+
+# Where cl_make_sitemaps writes the sitemaps that the sitemap views serve
+SITEMAP_DIR = os.path.join(INSTALL_ROOT, 'alert/assets/media/sitemaps/')
+
 TEMPLATE_DIRS = (
     # Don't forget to use absolute paths, not relative paths.
     os.path.join(INSTALL_ROOT, 'alert/assets/templates/'),
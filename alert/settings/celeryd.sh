@@ -17,6 +17,10 @@ fi
 # How to call "manage.py celeryd_multi"
 CELERYD_MULTI="$ENV_PYTHON $INSTALL_ROOT/manage.py celeryd_multi"
 
+# Run the scheduler for periodic tasks, such as refreshing the homepage, in
+# the single node.
+CELERYD_OPTS="-B"
+
 # %n will be replaced with the nodename.
 CELERYD_LOG_FILE="/var/log/celery/%n.log"
 CELERYD_LOG_LEVEL="INFO"
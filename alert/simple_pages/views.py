@@ -17,6 +17,7 @@ from alert.lib import magic
 from alert.lib import search_utils
 from alert.lib.bot_detector import is_bot
 from alert.lib.sunburnt import sunburnt
+from alert.search.court_registry import court_registry
 from alert.search.models import Court, Document
 from alert.search.forms import SearchForm
 from alert.simple_pages.forms import ContactForm
@@ -38,7 +39,7 @@ def faq(request):
         in_use=True,
         has_opinion_scraper=True
     ).count()
-    conn = sunburnt.SolrInterface(settings.SOLR_OPINION_URL, mode='r')
+    conn = sunburnt.get_solr_interface(settings.SOLR_OPINION_URL, mode='r')
     response = conn.raw_query(
         **search_utils.build_total_count_query()).execute()
     total_opinion_count = response.result.numFound
@@ -66,7 +67,7 @@ def build_court_dicts(courts):
 
 
 def coverage_graph(request):
-    courts = Court.objects.filter(in_use=True)
+    courts = court_registry.in_use()
     courts_json = json.dumps(build_court_dicts(courts))
 
     search_form = SearchForm(request.GET)
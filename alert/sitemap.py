@@ -1,19 +1,97 @@
+import gzip
+import os
+from StringIO import StringIO
+
 from django.conf import settings
 from django.http import HttpResponse
 from django.template import loader
+from django.utils.encoding import smart_str
 from django.views.decorators.cache import never_cache
 from alert.lib import sunburnt
 
 
 items_per_sitemap = 250
 
+# The sitemaps written by cl_make_sitemaps, and what they're named.
+sitemap_index_file_name = 'sitemap.xml.gz'
+
+
+def sitemap_file_name(obj_type, page):
+    return 'sitemap-%s-%s.xml.gz' % (obj_type, page)
+
+
+def write_sitemap_file(file_name, xml):
+    """Write a gzipped sitemap to the sitemap directory.
+
+    The file is written next to where it goes and then moved into place, so
+    it's never served half written.
+    """
+    path = os.path.join(settings.SITEMAP_DIR, file_name)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'wb') as f:
+        # No mtime, so the same sitemap always makes the same file.
+        gz = gzip.GzipFile(filename='', mode='wb', fileobj=f, mtime=0)
+        gz.write(smart_str(xml))
+        gz.close()
+    os.rename(tmp_path, path)
+
+
+def serve_sitemap_file(request, file_name):
+    """Serve a sitemap written by cl_make_sitemaps, or return None if there
+    isn't one.
+
+    The files are gzipped, and are sent that way to anything that accepts it,
+    which is every crawler that matters.
+    """
+    try:
+        with open(os.path.join(settings.SITEMAP_DIR, file_name), 'rb') as f:
+            content = f.read()
+    except IOError:
+        return None
+    if 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', ''):
+        response = HttpResponse(content, mimetype='application/xml')
+        response['Content-Encoding'] = 'gzip'
+    else:
+        xml = gzip.GzipFile(fileobj=StringIO(content)).read()
+        response = HttpResponse(xml, mimetype='application/xml')
+    response['Vary'] = 'Accept-Encoding'
+    # These links contain case names, so they should get crawled but not
+    # indexed
+    response['X-Robots-Tag'] = 'noindex, noodp, noarchive, noimageindex'
+    return response
+
+
+def make_sitemap_index(page_counts):
+    """Make the sitemap index, given the number of pages of each type of
+    sitemap.
+    """
+    sites = []
+    for obj_type, num_pages in page_counts:
+        for i in range(1, num_pages + 1):
+            sites.append(
+                'https://www.courtlistener.com/sitemap-%s.xml?p=%s' % (obj_type, i)
+            )
+
+    # Random additional sitemaps.
+    sites.extend([
+        'https://www.courtlistener.com/sitemap-donate.xml',
+    ])
+
+    return loader.render_to_string('sitemap_index.xml', {'sitemaps': sites})
+
+
 @never_cache
 def index_sitemap_maker(request):
     """Generate a sitemap index page
 
-    Counts the number of cases in the site, divides by `items_per_sitemap` and
-    provides links items.
+    Serves the index written by cl_make_sitemaps, if there is one. Otherwise,
+    counts the number of cases in the site, divides by `items_per_sitemap`
+    and provides links items.
     """
+    response = serve_sitemap_file(request, sitemap_index_file_name)
+    if response is not None:
+        return response
+
     params = {
         'q': '*:*',
         'rows': '0',  # just need the count
@@ -24,23 +102,14 @@ def index_sitemap_maker(request):
         (settings.SOLR_OPINION_URL, 'opinions'),
         (settings.SOLR_AUDIO_URL, 'oral-arguments'),
     )
-    sites = []
+    page_counts = []
     for connection_string, obj_type in connection_string_obj_type_pairs:
-        conn = sunburnt.SolrInterface(connection_string, mode='r')
+        conn = sunburnt.get_solr_interface(connection_string, mode='r')
         search_results_object = conn.raw_query(**params).execute()
         count = search_results_object.result.numFound
-        num_pages = count / items_per_sitemap + 1
-        for i in range(1, num_pages + 1):
-            sites.append(
-                'https://www.courtlistener.com/sitemap-%s.xml?p=%s' % (obj_type, i)
-            )
-
-    # Random additional sitemaps.
-    sites.extend([
-        'https://www.courtlistener.com/sitemap-donate.xml',
-    ])
+        page_counts.append((obj_type, count / items_per_sitemap + 1))
 
-    xml = loader.render_to_string('sitemap_index.xml', {'sitemaps': sites})
+    xml = make_sitemap_index(page_counts)
 
     # These links contain case names, so they should get crawled but not
     # indexed
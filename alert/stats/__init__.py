@@ -1,16 +1,177 @@
+import atexit
+import os
+import threading
+import time
+from collections import defaultdict
 from datetime import date
+
+from celery.signals import worker_process_shutdown
+from django.db import IntegrityError, connection, transaction
 from django.utils.timezone import now
 from alert.stats.models import Stat
 from django.db.models import F
 
+# Tallies are written to the database at least this often, in seconds...
+FLUSH_INTERVAL = 5
+# ...or once this many events have been tallied, whichever comes first.
+FLUSH_SIZE = 100
+
+
+def write_stats(counts):
+    """Add counts, a dict of {(name, date_logged): inc}, to the database.
+
+    The rows that already exist are found with one query and incremented, and
+    the rest are made with one more. Nothing is written if it fails.
+    """
+    names = set(name for name, date_logged in counts)
+    dates = set(date_logged for name, date_logged in counts)
+    with transaction.commit_on_success():
+        existing = dict(
+            ((s.name, s.date_logged), s.pk) for s in
+            Stat.objects.filter(name__in=names, date_logged__in=dates).only(
+                'pk', 'name', 'date_logged')
+        )
+        for key, inc in counts.iteritems():
+            if key in existing:
+                Stat.objects.filter(pk=existing[key]).update(
+                    count=F('count') + inc)
+        missing = [Stat(name=name, date_logged=date_logged, count=inc)
+                   for (name, date_logged), inc in counts.iteritems()
+                   if (name, date_logged) not in existing]
+        sid = transaction.savepoint()
+        try:
+            Stat.objects.bulk_create(missing)
+        except IntegrityError:
+            # Another process made some of them first.
+            transaction.savepoint_rollback(sid)
+            for s in missing:
+                tally_stat_now(s.name, s.count, s.date_logged)
+        else:
+            transaction.savepoint_commit(sid)
+
+
+class StatBuffer(object):
+    """Tallies of events, held in memory until they're written to the
+    database together.
+
+    Events like searches and API calls happen on nearly every request, and
+    writing each one to its row as it happens means several queries per
+    request, all of them waiting on the same few rows. Instead, the tallies
+    are added up here and written every FLUSH_INTERVAL seconds or every
+    FLUSH_SIZE events. A timer thread writes whatever is left once things go
+    quiet, and the tallies are written when the process exits.
+    """
+    def __init__(self, flush_interval=FLUSH_INTERVAL, flush_size=FLUSH_SIZE):
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self._reset()
+
+    def _reset(self):
+        self.pid = os.getpid()
+        self.lock = threading.Lock()
+        self.pending = defaultdict(int)
+        self.events = 0
+        self.last_flush = time.time()
+        self.timer = None
+
+    def _check_pid(self):
+        # A forked process starts with a copy of its parent's tallies, which
+        # the parent will write itself.
+        if self.pid != os.getpid():
+            self._reset()
+
+    def add(self, name, inc, date_logged):
+        self._check_pid()
+        with self.lock:
+            self.pending[(name, date_logged)] += inc
+            self.events += 1
+            due = (self.events >= self.flush_size or
+                   time.time() - self.last_flush >= self.flush_interval)
+            if not due and self.timer is None:
+                self.timer = threading.Timer(self.flush_interval,
+                                             self._flush_from_timer)
+                self.timer.daemon = True
+                self.timer.start()
+        if due:
+            self.flush()
+
+    def get_pending(self, name=None):
+        """Get the tallies that haven't been written yet, as a dict of
+        {(name, date_logged): count}, or of {date_logged: count} if name is
+        given.
+        """
+        self._check_pid()
+        with self.lock:
+            if name is None:
+                return dict(self.pending)
+            return dict((date_logged, count) for (n, date_logged), count in
+                        self.pending.iteritems() if n == name)
 
-def tally_stat(name, inc=1, date_logged=now()):
-    """Tally an event's occurrence to the database.
+    def flush(self):
+        """Write the tallies to the database. If that fails, they're kept
+        for the next flush.
+        """
+        self._check_pid()
+        with self.lock:
+            pending = self.pending
+            self.pending = defaultdict(int)
+            self.events = 0
+            self.last_flush = time.time()
+            if self.timer is not None:
+                self.timer.cancel()
+                self.timer = None
+        if pending:
+            try:
+                write_stats(pending)
+            except Exception:
+                # Keep the tallies for the next flush.
+                with self.lock:
+                    for key, inc in pending.iteritems():
+                        self.pending[key] += inc
+                raise
+
+    def _flush_from_timer(self):
+        try:
+            self.flush()
+        finally:
+            # The timer's thread has a connection of its own.
+            connection.close()
+
+    def discard(self, name):
+        """Throw away the tallies of name that haven't been written yet."""
+        self._check_pid()
+        with self.lock:
+            for key in [key for key in self.pending if key[0] == name]:
+                del self.pending[key]
+
+
+stat_buffer = StatBuffer()
+atexit.register(stat_buffer.flush)
+
+
+@worker_process_shutdown.connect
+def flush_stats(**kwargs):
+    # Celery's worker processes don't run atexit functions.
+    stat_buffer.flush()
+
+
+def tally_stat(name, inc=1, date_logged=None):
+    """Tally an event's occurrence.
 
     Will assume the following overridable values:
        - the event happened today.
        - the event happened once.
+
+    The tally is buffered and written to the database shortly after. Use
+    tally_stat_now to write it straight away.
+    """
+    stat_buffer.add(name, inc, date_logged or date.today())
+
+
+def tally_stat_now(name, inc=1, date_logged=None):
+    """Tally an event's occurrence to the database, returning the new count.
     """
+    date_logged = date_logged or date.today()
     s, created = Stat.objects.get_or_create(name=name, date_logged=date_logged,
                                             defaults={'count': inc})
     if created:
@@ -29,6 +190,7 @@ def clear_stats(name, clear_date=now()):
 
     If clear_date is None, it will clear all dates for the name.
     """
+    stat_buffer.discard(name)
     if clear_date is None:
         Stat.objects.filter(name=name).delete()
     else:
@@ -40,6 +202,7 @@ def set_stat(name, value, set_date=now()):
 
     Returns the value if possible, or None if unable to complete.
     """
+    stat_buffer.flush()
     try:
         s = Stat.objects.get(name=name, date=set_date)
         s.count = value
@@ -5,7 +5,13 @@ when you run "manage.py test".
 Replace this with more appropriate tests for your application.
 """
 
+from datetime import date
+
+from django.db import DatabaseError
 from django.test import TestCase
+from alert import stats
+from alert.stats import StatBuffer
+from alert.stats.models import Stat
 
 
 class SimpleTest(TestCase):
@@ -14,3 +20,58 @@ class SimpleTest(TestCase):
         Tests that 1 + 1 always equals 2.
         """
         self.assertEqual(1 + 1, 2)
+
+
+class StatBufferTest(TestCase):
+    def setUp(self):
+        self.buffer = StatBuffer(flush_interval=60, flush_size=5)
+        self.today = date.today()
+
+    def tearDown(self):
+        self.buffer.flush()
+
+    def test_tallies_are_buffered(self):
+        """Are tallies held until they're flushed, and then written
+        together?"""
+        for i in range(3):
+            self.buffer.add('test.event', 1, self.today)
+        self.buffer.add('test.other', 2, self.today)
+        self.assertEqual(self.buffer.get_pending('test.event'),
+                         {self.today: 3})
+        self.assertFalse(Stat.objects.filter(name='test.event').exists())
+
+        self.buffer.flush()
+        self.assertEqual(self.buffer.get_pending(), {})
+        self.assertEqual(Stat.objects.get(name='test.event').count, 3)
+        self.assertEqual(Stat.objects.get(name='test.other').count, 2)
+
+    def test_flush_adds_to_existing_counts(self):
+        Stat.objects.create(name='test.event', date_logged=self.today,
+                            count=10)
+        self.buffer.add('test.event', 1, self.today)
+        self.buffer.flush()
+        self.assertEqual(Stat.objects.get(name='test.event').count, 11)
+
+    def test_flush_after_flush_size_events(self):
+        for i in range(5):
+            self.buffer.add('test.event', 1, self.today)
+        self.assertEqual(self.buffer.get_pending(), {})
+        self.assertEqual(Stat.objects.get(name='test.event').count, 5)
+
+    def test_tallies_are_kept_when_the_write_fails(self):
+        def fail(counts):
+            raise DatabaseError('The database is down.')
+
+        self.buffer.add('test.event', 2, self.today)
+        write_stats = stats.write_stats
+        stats.write_stats = fail
+        try:
+            self.assertRaises(DatabaseError, self.buffer.flush)
+        finally:
+            stats.write_stats = write_stats
+        self.assertEqual(self.buffer.get_pending('test.event'),
+                         {self.today: 2})
+
+        self.buffer.add('test.event', 1, self.today)
+        self.buffer.flush()
+        self.assertEqual(Stat.objects.get(name='test.event').count, 3)
@@ -1,11 +1,13 @@
 from django.contrib.auth.models import User
 from django.utils.timezone import utc, make_aware
 
-from django.core.mail import send_mass_mail
+from django.core.mail import EmailMessage
 from django.core.management.base import BaseCommand
-from django.template import Context, loader
+from django.template import Context
 from optparse import make_option
 
+from alert.lib.mail import get_template, send_messages_in_batches
+
 from datetime import datetime, timedelta
 import logging
 import sys
@@ -39,11 +41,11 @@ class Command(BaseCommand):
         messages = []
         email_subject = 'Hi from CourtListener and Free Law Project'
         email_sender = 'Brian Carver <bcarver@courtListener.com>'
-        txt_template = loader.get_template('emails/welcome_email.txt')
+        txt_template = get_template('emails/welcome_email.txt')
         for recipient in recipients:
             c = Context({'name': recipient.first_name,})
             email_txt = txt_template.render(c)
-            messages.append((
+            messages.append(EmailMessage(
                 email_subject,
                 email_txt,
                 email_sender,
@@ -51,7 +53,7 @@ class Command(BaseCommand):
             ))
 
         if not self.options['simulate']:
-            send_mass_mail(messages, fail_silently=False)
+            send_messages_in_batches(messages)
             logger.info("Sent daily welcome emails.")
         else:
             sys.stdout.write('Simulation mode. Imagine that we just sent the '
@@ -18,6 +18,26 @@ donation_exclusion_codes = [
 ]
 
 
+def get_totals_donated_last_year(user_profiles):
+    """Get what each of user_profiles donated in the last year, as a dict of
+    {pk: total}, with one query instead of one per profile.
+    """
+    one_year_ago = now() - timedelta(days=365)
+    totals = dict((up.pk, Decimal(0.0)) for up in user_profiles)
+    donations = Donation.objects.filter(
+        donors__in=totals.keys(),
+        date_created__gte=one_year_ago,
+    ).exclude(
+        status__in=donation_exclusion_codes,
+    ).order_by(
+        # Otherwise the default ordering ends up in the GROUP BY, and there's
+        # a row per donation instead of per donor.
+    ).values('donors').annotate(total=Sum('amount'))
+    for donation in donations:
+        totals[donation['donors']] = donation['total']
+    return totals
+
+
 class BarMembership(models.Model):
     barMembership = USStateField(
         'the two letter state abbreviation of a bar membership'
@@ -1,12 +1,15 @@
 # coding=utf-8
 from datetime import timedelta
+from decimal import Decimal
 from django.contrib.auth.tokens import default_token_generator
 from django.core import mail
 from django.test import TestCase, LiveServerTestCase
 from django.utils.timezone import now
 from selenium import webdriver
 
-from alert.userHandling.models import UserProfile
+from alert.donate.models import Donation
+from alert.userHandling.models import UserProfile, \
+    get_totals_donated_last_year
 
 
 class UserTest(TestCase):
@@ -65,6 +68,21 @@ class UserTest(TestCase):
         for up in ups:
             self.assertTrue(up.email_confirmed)
 
+    def test_totals_donated_last_year(self):
+        """Are all of a donor's donations added up, and are failed ones left
+        out?"""
+        up = UserProfile.objects.get(pk=2)
+        for amount, status in ((10, 4), (15, 2), (100, 6)):
+            up.donation.add(Donation.objects.create(
+                amount=Decimal(amount),
+                payment_provider='check',
+                payment_id='test',
+                status=status,
+            ))
+        other = UserProfile.objects.get(pk=3)
+        self.assertEqual(get_totals_donated_last_year([up, other]),
+                         {up.pk: Decimal(25), other.pk: Decimal(0)})
+
 
 class LiveUserTest(LiveServerTestCase):
     fixtures = ['authtest_data.json']